@@ -1,9 +1,15 @@
 from django.contrib import admin
-from .models import User, Package, CourierLog, OTPLog, Anomaly, DashboardFeedback
+from .models import User, Package, CourierLog, OTPLog, Anomaly, DashboardFeedback, IngestedFile
+
+
+@admin.register(User)
+class UserAdmin(admin.ModelAdmin):
+    # Kept by F() updates on delivery; repaired with ratings.recompute_courier_ratings, not by hand
+    readonly_fields = User.RATING_FIELDS
 
-admin.site.register(User)
 admin.site.register(Package)
 admin.site.register(CourierLog)
 admin.site.register(OTPLog)
 admin.site.register(Anomaly)
 admin.site.register(DashboardFeedback)
+admin.site.register(IngestedFile)
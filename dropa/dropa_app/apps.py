@@ -1,5 +1,21 @@
 from django.apps import AppConfig
+from django.conf import settings
+import threading
 
 class DropaAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'dropa_app'
+
+    def ready(self):
+        from . import signals
+        
+        # Web workers can opt in to loading ML models at boot; management
+        # commands and tests keep the default lazy loading
+        if getattr(settings, 'ML_WARMUP_ON_READY', False):
+            from .ml_service import ml_service
+            threading.Thread(target=ml_service.warm_up, name='ml-warmup', daemon=True).start()
+        
+        # Web workers can also watch for newly published models and swap them in
+        if getattr(settings, 'ML_MODEL_WATCH_SECONDS', 0) > 0:
+            from .ml_service import ml_service
+            ml_service.start_watcher(settings.ML_MODEL_WATCH_SECONDS)
@@ -0,0 +1,169 @@
+"""
+Micro-batching of concurrent single-row model predictions
+Requests handled by different threads queue their feature row and wait on a future; a worker
+thread collects rows for up to a short window or a maximum batch size, scores them with one
+vectorized model call and hands each caller its own result. Per-call model overhead is then
+paid once per batch instead of once per request.
+"""
+
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the batch size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class MicroBatcher:
+    """Coalesce single-row predictions submitted from many threads into batched model calls"""
+
+    def __init__(self, score, window_ms=2.0, max_batch=64, name='model'):
+        """
+        Args:
+            score (callable): Takes an (n, features) float64 matrix and returns n per-row results
+            window_ms (float): Longest time the first row of a batch waits for more rows
+            max_batch (int): Rows that close a batch early
+            name (str): Name used for the worker thread and logs
+        """
+        self._score = score
+        self.window = window_ms / 1000
+        self.max_batch = max(int(max_batch), 1)
+        self.name = name
+        self._queue = queue.SimpleQueue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._requests = 0
+        self._batches = 0
+        self._rows = 0
+        self._errors = 0
+        self._fallbacks = 0
+        self._max_queue_depth = 0
+        self._max_batch_seen = 0
+        self._wait_seconds = 0.0
+        self._score_seconds = 0.0
+        self._histogram = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+
+    def submit(self, row):
+        """
+        Queue one feature row
+
+        Returns:
+            Future: Resolves to the row's result, or raises the model's exception
+
+        Raises:
+            ValueError: The row is not a flat sequence of numbers; raised here, in the caller's
+                thread, so malformed input never reaches a shared batch
+        """
+        row = np.asarray(row, dtype=np.float64)
+        if row.ndim != 1:
+            raise ValueError(f"Expected one feature row, got an array of shape {row.shape}")
+        if self._worker is None:
+            self._start()
+        future = Future()
+        with self._stats_lock:
+            self._requests += 1
+        self._queue.put((row, future, time.perf_counter()))
+        return future
+
+    def predict(self, row, timeout=None):
+        """Score one feature row through the batcher and wait for its result"""
+        return self.submit(row).result(timeout)
+
+    def _start(self):
+        with self._start_lock:
+            if self._worker is None:
+                # Started on first use, so every forked web worker gets its own thread
+                self._worker = threading.Thread(target=self._run, name=f'micro-batcher-{self.name}', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(batch, self._queue.qsize())
+
+    def _run_batch(self, batch, queue_depth):
+        started = time.perf_counter()
+        futures = [future for _, future, _ in batch]
+        errors = 0
+        fallback = False
+        try:
+            results = self._score(np.array([row for row, _, _ in batch], dtype=np.float64))
+            for future, result in zip(futures, results):
+                future.set_result(result)
+        except Exception as e:
+            logger.error(f"Error scoring {self.name} batch of {len(batch)}: {str(e)}")
+            if len(batch) == 1:
+                futures[0].set_exception(e)
+                errors = 1
+            else:
+                # Score rows one at a time so an error only fails the row that caused it
+                fallback = True
+                for row, future, _ in batch:
+                    try:
+                        future.set_result(self._score(row.reshape(1, -1))[0])
+                    except Exception as row_error:
+                        future.set_exception(row_error)
+                        errors += 1
+        finished = time.perf_counter()
+
+        size = len(batch)
+        bucket = next((i for i, bound in enumerate(BATCH_SIZE_BUCKETS) if size <= bound), len(BATCH_SIZE_BUCKETS))
+        with self._stats_lock:
+            self._batches += 1
+            self._rows += size
+            self._errors += errors
+            self._fallbacks += fallback
+            self._max_queue_depth = max(self._max_queue_depth, queue_depth + size)
+            self._max_batch_seen = max(self._max_batch_seen, size)
+            self._wait_seconds += sum(started - queued_at for _, _, queued_at in batch)
+            self._score_seconds += finished - started
+            self._histogram[bucket] += 1
+
+    def stats(self, reset=False):
+        """
+        Counters since start or the last reset
+
+        Returns:
+            dict: Queue depth, batch sizes and timings
+        """
+        with self._stats_lock:
+            labels = [str(bound) for bound in BATCH_SIZE_BUCKETS] + [f'>{BATCH_SIZE_BUCKETS[-1]}']
+            stats = {
+                'window_ms': self.window * 1000,
+                'max_batch': self.max_batch,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'requests': self._requests,
+                'batches': self._batches,
+                'rows': self._rows,
+                # Rows whose future got an exception, and batches re-scored row by row
+                'errors': self._errors,
+                'fallback_batches': self._fallbacks,
+                'mean_batch_size': round(self._rows / self._batches, 2) if self._batches else 0,
+                'max_batch_size': self._max_batch_seen,
+                'mean_wait_ms': round(self._wait_seconds / self._rows * 1000, 3) if self._rows else 0,
+                'mean_score_ms': round(self._score_seconds / self._batches * 1000, 3) if self._batches else 0,
+                # Batches per size bucket, keyed by the bucket's upper bound
+                'batch_size_histogram': dict(zip(labels, self._histogram)),
+            }
+            if reset:
+                self._reset_stats()
+        return stats
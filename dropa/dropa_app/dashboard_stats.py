@@ -0,0 +1,54 @@
+"""
+Cached dashboard counters
+One grouped aggregate shared by every dashboard view, cached for a short TTL and
+dropped whenever packages or couriers change
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+from datetime import datetime, timedelta
+from .models import Package, User
+
+CACHE_KEY = 'dropa:dashboard_counts'
+
+
+def get_dashboard_counts():
+    """
+    Get package and courier counters for the dashboards
+
+    Returns:
+        dict: total_packages, in_transit, pending, delivered, delivered_today,
+        active_couriers and delivery_rate
+    """
+    counts = cache.get(CACHE_KEY)
+    if counts is None:
+        counts = compute_dashboard_counts()
+        cache.set(CACHE_KEY, counts, getattr(settings, 'DASHBOARD_STATS_TTL', 15))
+    return counts
+
+
+def compute_dashboard_counts():
+    """Compute every package counter in one grouped aggregate query"""
+    # A range on sign_time can use an index where sign_time__date cannot
+    today_start = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()))
+    counts = Package.objects.aggregate(
+        total_packages=Count('id'),
+        in_transit=Count('id', filter=Q(status='in_transit')),
+        pending=Count('id', filter=Q(status='pending')),
+        delivered=Count('id', filter=Q(status='delivered')),
+        delivered_today=Count('id', filter=Q(
+            status='delivered', sign_time__gte=today_start, sign_time__lt=today_start + timedelta(days=1)
+        )),
+    )
+    counts['active_couriers'] = User.objects.filter(role='courier', is_active=True).count()
+
+    total = counts['total_packages']
+    counts['delivery_rate'] = (counts['delivered'] / total * 100) if total > 0 else 0
+    return counts
+
+
+def invalidate_dashboard_counts():
+    """Drop the cached counters so the next dashboard hit recomputes them"""
+    cache.delete(CACHE_KEY)
@@ -0,0 +1,105 @@
+"""
+Feature builders shared by single-package and bulk ML scoring
+Every builder takes column arrays and returns a float64 matrix in the column order the models were trained with
+"""
+
+import zlib
+import numpy as np
+
+# IsolationForest decision_function score below which a delivery is flagged as anomalous
+ANOMALY_THRESHOLD = -0.5
+
+# Floor applied to delivery time predictions (minutes)
+MIN_PREDICTED_MINUTES = 10
+
+# Serving defaults for anomaly features the Package table does not record
+DEFAULT_DELIVERY_COST = 5000.0
+DEFAULT_PACKAGE_WEIGHT = 1.0
+
+
+# Name of the city_code scheme, recorded with exported models
+CITY_CODE_SCHEME = 'crc32 % 1000'
+
+
+def city_code(city_name):
+    """Simplified numeric city encoding that is identical in every process"""
+    # hash() is salted per interpreter, which made codes differ between workers
+    return zlib.crc32((city_name or '').encode('utf-8')) % 1000
+
+
+def encode_city(city_name, encoding=None):
+    """
+    Encode an origin city with the encoding a model was trained with
+
+    Args:
+        city_name (str): Origin city name
+        encoding (dict): city_encoding recorded with the model, or None for city_code
+
+    Returns:
+        int: The recorded code for cities the model saw in training, city_code otherwise
+    """
+    if encoding:
+        cities = encoding.get('cities', {})
+        if city_name in cities:
+            return cities[city_name]
+        if encoding.get('scheme') != CITY_CODE_SCHEME:
+            raise ValueError(f"City {city_name!r} is not in the model's {encoding.get('scheme')} city encoding")
+    return city_code(city_name)
+
+
+def delivery_time_features(city_codes, courier_ids, poi_lng, poi_lat, sign_lng, sign_lat):
+    """
+    Build the delivery time model input matrix
+
+    Args:
+        city_codes (array): Encoded origin cities
+        courier_ids (array): Delivery user ids (0 when unassigned)
+        poi_lng, poi_lat (array): Pickup coordinates, also used as the receipt point
+        sign_lng, sign_lat (array): Delivery coordinates, NaN where unknown
+
+    Returns:
+        np.ndarray: (n, 8) matrix ordered as from_city_name, delivery_user_id, poi_lng, poi_lat,
+        receipt_lng, receipt_lat, sign_lng, sign_lat
+    """
+    poi_lng = np.asarray(poi_lng, dtype=np.float64)
+    poi_lat = np.asarray(poi_lat, dtype=np.float64)
+    sign_lng = np.asarray(sign_lng, dtype=np.float64)
+    sign_lat = np.asarray(sign_lat, dtype=np.float64)
+
+    return np.column_stack([
+        np.asarray(city_codes, dtype=np.float64),
+        np.asarray(courier_ids, dtype=np.float64),
+        poi_lng,
+        poi_lat,
+        poi_lng,
+        poi_lat,
+        np.where(np.isnan(sign_lng), poi_lng, sign_lng),
+        np.where(np.isnan(sign_lat), poi_lat, sign_lat),
+    ])
+
+
+def anomaly_features(delivery_minutes, delivery_cost=None, package_weight=None):
+    """
+    Build the anomaly detection model input matrix
+
+    Args:
+        delivery_minutes (array): Actual delivery durations in minutes
+        delivery_cost (array): Delivery costs, NaN or None for the serving default
+        package_weight (array): Package weights in kg, NaN or None for the serving default
+
+    Returns:
+        np.ndarray: (n, 3) matrix ordered as delivery_minutes, delivery_cost, package_weight
+    """
+    delivery_minutes = np.asarray(delivery_minutes, dtype=np.float64)
+
+    def column(values, default):
+        if values is None:
+            return np.full(delivery_minutes.shape, default)
+        values = np.asarray(values, dtype=np.float64)
+        return np.where(np.isnan(values), default, values)
+
+    return np.column_stack([
+        delivery_minutes,
+        column(delivery_cost, DEFAULT_DELIVERY_COST),
+        column(package_weight, DEFAULT_PACKAGE_WEIGHT),
+    ])
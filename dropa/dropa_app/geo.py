@@ -0,0 +1,44 @@
+"""
+Vectorized geographic helpers
+Every function accepts scalars or NumPy arrays of coordinates in degrees
+"""
+
+import numpy as np
+
+# Mean Earth radius in kilometers
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """
+    Great-circle distance between two sets of points
+
+    Args:
+        lat1, lng1 (array): Origin coordinates
+        lat2, lng2 (array): Destination coordinates, broadcast against the origins
+
+    Returns:
+        np.ndarray: Distances in kilometers, NaN where any coordinate is NaN
+    """
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lng1, lat2, lng2))
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def package_distance_km(poi_lat, poi_lng, sign_lat, sign_lng):
+    """
+    Pickup to delivery distance as stored in Package.distance_km
+
+    Missing (None/NaN) or zero coordinates mean the point is unknown and give NaN.
+
+    Returns:
+        np.ndarray: Distances in kilometers
+    """
+    # NumPy converts None to NaN for float arrays
+    coordinates = [np.asarray(v, dtype=np.float64) for v in (poi_lat, poi_lng, sign_lat, sign_lng)]
+    unknown = np.zeros(np.broadcast(*coordinates).shape, dtype=bool)
+    for values in coordinates:
+        unknown |= np.isnan(values) | (values == 0)
+
+    return np.where(unknown, np.nan, haversine_km(*coordinates))
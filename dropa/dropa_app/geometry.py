@@ -0,0 +1,104 @@
+"""
+Route geometry helpers for map clients
+Douglas-Peucker simplification with zoom-dependent tolerance and Google encoded polylines
+"""
+
+# Web map zoom levels accepted by the geometry API
+MIN_ZOOM = 0
+MAX_ZOOM = 22
+
+# Map tiles are 256 pixels wide and cover 360 degrees of longitude at zoom 0
+TILE_SIZE = 256
+
+
+def zoom_tolerance(zoom, pixels=1.0):
+    """
+    Simplification tolerance in degrees for a web map zoom level
+
+    Args:
+        zoom (int): Web map zoom level (0-22)
+        pixels (float): Largest allowed deviation in screen pixels
+
+    Returns:
+        float: Tolerance in degrees
+    """
+    zoom = min(max(int(zoom), MIN_ZOOM), MAX_ZOOM)
+    return pixels * 360.0 / (TILE_SIZE * 2 ** zoom)
+
+
+def simplify(points, tolerance):
+    """
+    Simplify a polyline with the Douglas-Peucker algorithm
+
+    Iterative with an explicit stack, so long routes cannot hit the recursion limit; the distance
+    of every point in a span to its chord is computed as one vectorized operation.
+
+    Args:
+        points (array): (n, 2) array of [lat, lng]
+        tolerance (float): Largest allowed deviation in degrees
+
+    Returns:
+        np.ndarray: The retained points, always including the first and last
+    """
+    import numpy as np
+
+    points = np.asarray(points, dtype=np.float64)
+    n = len(points)
+    if n < 3 or tolerance <= 0:
+        return points
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        origin = points[start]
+        chord = points[end] - origin
+        offsets = points[start + 1:end] - origin
+
+        length_sq = chord @ chord
+        if length_sq > 0:
+            # Distance to the closest point of the chord segment
+            t = np.clip(offsets @ chord / length_sq, 0.0, 1.0)
+            offsets = offsets - t[:, None] * chord
+        distances = np.hypot(offsets[:, 0], offsets[:, 1])
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return points[keep]
+
+
+def encode_polyline(points, precision=5):
+    """
+    Encode [lat, lng] points with the Google encoded polyline algorithm
+
+    Args:
+        points (array): (n, 2) array of [lat, lng]
+        precision (int): Decimal places kept (5 for Google Maps and Leaflet plugins)
+
+    Returns:
+        str: Encoded polyline
+    """
+    import numpy as np
+
+    values = np.round(np.asarray(points, dtype=np.float64).reshape(-1, 2) * 10 ** precision).astype(np.int64)
+    deltas = np.diff(values, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    # Zigzag encoding: non-negative ints with the sign in the lowest bit
+    deltas = (deltas << 1) ^ (deltas >> 63)
+
+    chunks = []
+    for value in deltas.tolist():
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return ''.join(chunks)
@@ -0,0 +1,170 @@
+"""
+Buffered courier location ingestion
+Pings are collected in memory and written in bulk: one CourierLog insert batch plus one
+User position update per courier per flush, instead of one INSERT per ping
+"""
+
+import atexit
+import threading
+import logging
+from collections import namedtuple
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .models import User, Package, CourierLog
+from .spatial import courier_locator
+
+logger = logging.getLogger(__name__)
+
+LocationPing = namedtuple('LocationPing', ['courier_id', 'lat', 'lng', 'package_id', 'recorded_at'])
+
+
+def write_pings(pings):
+    """
+    Persist a batch of pings in one transaction
+
+    Pings for unknown couriers are dropped; pings without a known package still move the courier
+    but are not logged, since CourierLog requires a package. A courier only moves for a ping
+    recorded after the one its current position came from.
+
+    Returns:
+        tuple: (CourierLog rows created, couriers moved)
+    """
+    package_ids = set(Package.objects.filter(
+        pk__in={ping.package_id for ping in pings if ping.package_id is not None}
+    ).values_list('id', flat=True))
+
+    with transaction.atomic():
+        # Locked so a concurrent flush cannot move a courier between this read and the update
+        located_at = dict(User.objects.select_for_update().filter(
+            pk__in={ping.courier_id for ping in pings}, role='courier'
+        ).values_list('id', 'last_location_at'))
+
+        logs = []
+        latest = {}
+        for ping in pings:
+            if ping.courier_id not in located_at:
+                continue
+            if ping.package_id in package_ids:
+                logs.append(CourierLog(
+                    courier_id=ping.courier_id,
+                    package_id=ping.package_id,
+                    event='location_update',
+                    log_time=ping.recorded_at,
+                    location_lat=ping.lat,
+                    location_lng=ping.lng,
+                ))
+            current = latest.get(ping.courier_id)
+            if current is None or ping.recorded_at >= current.recorded_at:
+                latest[ping.courier_id] = ping
+
+        # A ping older than the stored position (a late or retried batch) is logged but does not move the courier
+        latest = {
+            courier_id: ping for courier_id, ping in latest.items()
+            if located_at[courier_id] is None or ping.recorded_at > located_at[courier_id]
+        }
+
+        # Only the fields being updated are set, so no User rows need to be fetched
+        now = timezone.now()
+        couriers = [
+            User(pk=courier_id, last_location_lat=ping.lat, last_location_lng=ping.lng,
+                 last_location_at=ping.recorded_at, last_active=now)
+            for courier_id, ping in latest.items()
+        ]
+
+        CourierLog.objects.bulk_create(logs, batch_size=1000)
+        User.objects.bulk_update(
+            couriers, ['last_location_lat', 'last_location_lng', 'last_location_at', 'last_active'], batch_size=500
+        )
+
+    courier_locator.move_couriers((courier_id, ping.lat, ping.lng) for courier_id, ping in latest.items())
+    return len(logs), len(couriers)
+
+
+class LocationBuffer:
+    """In-memory ping buffer flushed every flush_interval_ms or once max_rows pings are waiting"""
+
+    # Failed flushes are retried while fewer than this many multiples of max_rows are waiting
+    MAX_RETAINED_FLUSHES = 10
+
+    def __init__(self, flush_interval_ms=500, max_rows=1000):
+        self.flush_interval_ms = flush_interval_ms
+        self.max_rows = max_rows
+        self._pings = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flusher = None
+
+    def __len__(self):
+        return len(self._pings)
+
+    def add(self, pings):
+        """
+        Queue pings for the next flush
+
+        Args:
+            pings (list): LocationPing tuples
+        """
+        with self._lock:
+            self._pings.extend(pings)
+            full = len(self._pings) >= self.max_rows
+            if self._flusher is None:
+                self._start_flusher()
+
+        # A full buffer is written by the caller, which also slows down producers that outpace the database
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write every buffered ping now"""
+        with self._flush_lock:
+            with self._lock:
+                pings, self._pings = self._pings, []
+            if not pings:
+                return 0
+            try:
+                logged, moved = write_pings(pings)
+                logger.debug(f"Flushed {len(pings)} location pings ({logged} logged, {moved} couriers moved)")
+            except Exception as e:
+                logger.error(f"Error flushing {len(pings)} location pings: {str(e)}")
+                self._requeue(pings)
+                return 0
+            return len(pings)
+
+    def _requeue(self, pings):
+        """Put the pings of a failed flush back in front of newer ones for the next flush"""
+        with self._lock:
+            self._pings[:0] = pings
+            # Bounded so a database outage cannot grow the buffer without limit; the oldest pings go first
+            excess = len(self._pings) - self.max_rows * self.MAX_RETAINED_FLUSHES
+            if excess > 0:
+                del self._pings[:excess]
+                logger.error(f"Dropped {excess} location pings after repeated flush failures")
+
+    def stop(self):
+        """Stop the background flusher and write what is left; pings that still fail are lost"""
+        self._wakeup.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self._wakeup.clear()
+        self.flush()
+
+    def _start_flusher(self):
+        self._flusher = threading.Thread(target=self._run, name='location-flusher', daemon=True)
+        self._flusher.start()
+
+    def _run(self):
+        while not self._wakeup.wait(self.flush_interval_ms / 1000):
+            # The flusher thread keeps its own database connection
+            close_old_connections()
+            self.flush()
+
+
+# Global location buffer instance
+location_buffer = LocationBuffer(
+    flush_interval_ms=getattr(settings, 'LOCATION_FLUSH_INTERVAL_MS', 500),
+    max_rows=getattr(settings, 'LOCATION_FLUSH_MAX_ROWS', 1000),
+)
+atexit.register(location_buffer.stop)
@@ -0,0 +1,205 @@
+"""
+Management command to compare the pickled and native delivery time model artifacts
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+import numpy as np
+from dropa_app.features import city_code, delivery_time_features
+from dropa_app.model_registry import ML_MODELS_DIR, current_version, model_path
+from dropa_app.native_models import DELIVERY_BOOSTER_FILE, load_booster
+
+PICKLE_FILE = 'delivery_time_model.pkl'
+
+# Run in a fresh interpreter so imports and deserialization are both paid, as in a new worker
+COLD_LOAD_SCRIPTS = {
+    'pickle': (
+        'import sys, time\n'
+        'started = time.perf_counter()\n'
+        'import joblib\n'
+        'joblib.load(sys.argv[1])\n'
+        'print(time.perf_counter() - started)\n'
+    ),
+    'native': (
+        'import sys, time\n'
+        'sys.path.insert(0, sys.argv[2])\n'
+        'started = time.perf_counter()\n'
+        'from dropa_app.native_models import load_booster\n'
+        'load_booster(sys.argv[1])\n'
+        'print(time.perf_counter() - started)\n'
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure cold-load time and single-row latency of the pickled and native delivery time models'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model-version',
+            type=str,
+            help='Published model version to benchmark (default: current)',
+        )
+        parser.add_argument(
+            '--models-dir',
+            type=str,
+            default=ML_MODELS_DIR,
+            help=f'ML models directory (default: {ML_MODELS_DIR})',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Cold loads per artifact, each in a new process (default: 5)',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=2000,
+            help='Timed single-row predictions per artifact (default: 2000)',
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Write the results as JSON to this file',
+        )
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1 or options['iterations'] < 1:
+            raise CommandError('--repeat and --iterations must be positive')
+
+        models_dir = options['models_dir']
+        version = options['model_version'] or current_version(models_dir)
+        paths = {
+            'pickle': model_path(PICKLE_FILE, version, models_dir),
+            'native': model_path(DELIVERY_BOOSTER_FILE, version, models_dir),
+        }
+        for kind, path in paths.items():
+            if not os.path.exists(path):
+                raise CommandError(f'No {kind} delivery time model at {path}. Run regenerate_models first.')
+
+        import joblib
+        loaders = {'pickle': joblib.load, 'native': load_booster}
+        models = {kind: loaders[kind](path) for kind, path in paths.items()}
+
+        # One realistic row, built the way serving builds it
+        row = delivery_time_features([city_code('Dar es Salaam')], [1], [39.2083], [-6.7924], [39.28], [-6.82])
+        rows = np.repeat(row, 1000, axis=0) + np.random.default_rng(0).normal(0, 0.05, (1000, row.shape[1]))
+
+        results = {'version': version, 'models': {}}
+        self.stdout.write(f'Benchmarking delivery time model {version or "(flat files)"}')
+        self.stdout.write(f'\n{"artifact":<10}{"size KB":>10}{"cold load ms":>15}{"load ms":>10}{"p50 us":>10}{"p99 us":>10}{"rows/s 1000":>14}')
+
+        for kind, model in models.items():
+            cold = [self.cold_load(kind, paths[kind]) for _ in range(options['repeat'])]
+
+            # Deserialization alone, with every import already done
+            loads = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                loaders[kind](paths[kind])
+                loads.append(time.perf_counter() - started)
+
+            timings = []
+            batch_timings = []
+            with warnings.catch_warnings():
+                # The sklearn wrapper warns on every call without feature names
+                warnings.simplefilter('ignore', UserWarning)
+                model.predict(row)
+                for _ in range(options['iterations']):
+                    started = time.perf_counter()
+                    model.predict(row)
+                    timings.append(time.perf_counter() - started)
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    model.predict(rows)
+                    batch_timings.append(time.perf_counter() - started)
+            timings.sort()
+
+            results['models'][kind] = {
+                'size_bytes': os.path.getsize(paths[kind]),
+                'cold_load_ms': round(statistics.median(cold) * 1000, 2),
+                'load_ms': round(statistics.median(loads) * 1000, 2),
+                'single_row_p50_us': round(timings[len(timings) // 2] * 1e6, 1),
+                'single_row_p99_us': round(timings[int(len(timings) * 0.99)] * 1e6, 1),
+                'batch_rows_per_sec': round(len(rows) / min(batch_timings)),
+            }
+            r = results['models'][kind]
+            self.stdout.write(
+                f'{kind:<10}{r["size_bytes"] / 1024:>10.1f}{r["cold_load_ms"]:>15.2f}{r["load_ms"]:>10.2f}'
+                f'{r["single_row_p50_us"]:>10.1f}'
+                f'{r["single_row_p99_us"]:>10.1f}{r["batch_rows_per_sec"]:>14}'
+            )
+
+        # Both artifacts hold the same trees, so predictions must agree
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            difference = float(np.max(np.abs(models['pickle'].predict(rows) - models['native'].predict(rows))))
+        results['max_prediction_difference'] = difference
+        style = self.style.SUCCESS if difference < 1e-6 else self.style.ERROR
+        self.stdout.write(style(f'\nLargest prediction difference: {difference:.3g} minutes'))
+
+        # Agreement above says nothing if serving feeds both artifacts codes training never used
+        results['encoding'] = self.check_encoding(models)
+        for kind, check in results['encoding'].items():
+            failed = check['mismatched_cities'] or check['max_prediction_difference'] >= 1e-6
+            style = self.style.ERROR if failed else self.style.SUCCESS
+            self.stdout.write(style(
+                f'{kind}: {len(check["mismatched_cities"])} cities encoded differently from training, '
+                f'largest serving vs training prediction difference {check["max_prediction_difference"]:.3g} minutes'
+            ))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def check_encoding(self, models):
+        """
+        Compare serving city codes and predictions with the codes recorded at training time
+
+        The pickle is served with city_code and the native booster with its metadata, so each
+        artifact is checked against the encoding exported with the booster.
+
+        Returns:
+            dict: Per artifact, the mismatched cities and the largest prediction difference
+        """
+        from dropa_app.features import encode_city
+        from dropa_app.ml_service import CITY_COORDS, MLService
+
+        recorded = models['native'].city_encoding
+        if not recorded:
+            raise CommandError('The native model metadata has no city_encoding; re-export it with regenerate_models')
+        cities = recorded['cities']
+        service = MLService()
+
+        checks = {}
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            for kind, serving_encoding in (('pickle', None), ('native', recorded)):
+                mismatched = sorted(city for city, code in cities.items() if encode_city(city, serving_encoding) != code)
+                # Rows as the API builds them, and the same rows with the training-time code
+                origins = [city for city in CITY_COORDS if city in cities]
+                serving = np.array([
+                    service._prepare_delivery_features_v2(city, None, None, serving_encoding) for city in origins
+                ], dtype=np.float64)
+                training = serving.copy()
+                training[:, 0] = [cities[city] for city in origins]
+                difference = float(np.max(np.abs(models[kind].predict(serving) - models[kind].predict(training)))) if origins else 0.0
+                checks[kind] = {'mismatched_cities': mismatched, 'max_prediction_difference': difference}
+        return checks
+
+    def cold_load(self, kind, path):
+        """Seconds to import the loader and deserialize the artifact in a new interpreter"""
+        completed = subprocess.run(
+            [sys.executable, '-c', COLD_LOAD_SCRIPTS[kind], path, str(settings.BASE_DIR)],
+            capture_output=True, text=True, check=True,
+        )
+        return float(completed.stdout.strip().splitlines()[-1])
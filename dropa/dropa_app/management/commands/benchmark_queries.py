@@ -0,0 +1,278 @@
+"""
+Management command to benchmark the hot ORM queries against a seeded throwaway database
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from datetime import datetime, timedelta
+import json
+import statistics
+import time
+import numpy as np
+
+BENCHMARK_CITIES = ['Dar es Salaam', 'Dodoma', 'Arusha', 'Mwanza', 'Zanzibar']
+BENCHMARK_STATUSES = ['pending', 'picked_up', 'in_transit', 'delivered', 'cancelled', 'failed']
+# Mostly delivered, like production history
+BENCHMARK_STATUS_WEIGHTS = [0.05, 0.03, 0.05, 0.8, 0.04, 0.03]
+
+
+def _where(mask, values, other=None):
+    """List of values where mask is set and other elsewhere"""
+    values = values.tolist()
+    return [value if keep else other for keep, value in zip(mask.tolist(), values)]
+
+
+def insert_rows(model, columns):
+    """
+    Insert column lists into a model's table with one parameterized executemany
+
+    Skips model instantiation, which dominates bulk_create at benchmark sizes. Every NOT NULL
+    column without a database default must be present in columns, and datetimes must be naive
+    UTC, which every backend's driver adapts itself under USE_TZ.
+
+    Args:
+        model: Model class whose table receives the rows
+        columns (dict): Field attname -> list of values, all the same length
+    """
+    fields = [model._meta.get_field(name) for name in columns]
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(model._meta.db_table),
+        ', '.join(quote(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(sql, list(zip(*columns.values())))
+
+
+def seed(n_packages, n_couriers, batch_size, seed_value, stdout):
+    """Fill the benchmark database with synthetic couriers, packages and their logs"""
+    from dropa_app.models import User, Package, CourierLog, OTPLog, Anomaly
+
+    rng = np.random.default_rng(seed_value)
+    now = timezone.now()
+
+    User.objects.bulk_create([
+        User(username=f'bench_courier_{i}', role='courier', is_online=bool(i % 3),
+             last_location_lat=-6.8 + rng.normal(0, 0.1), last_location_lng=39.28 + rng.normal(0, 0.1))
+        for i in range(n_couriers)
+    ])
+    courier_ids = np.array(User.objects.filter(role='courier').values_list('id', flat=True))
+
+    # Naive UTC, the form numpy datetimes convert to
+    utc_now = now.replace(tzinfo=None)
+    started = time.perf_counter()
+    for start in range(0, n_packages, batch_size):
+        n = min(batch_size, n_packages - start)
+        statuses = rng.choice(BENCHMARK_STATUSES, n, p=BENCHMARK_STATUS_WEIGHTS)
+        delivered = statuses == 'delivered'
+        durations = rng.uniform(30, 48 * 60, n)
+        poi_lat = -6.8 + rng.normal(0, 0.1, n)
+        poi_lng = 39.28 + rng.normal(0, 0.1, n)
+
+        receipt_offsets = rng.integers(0, 365 * 24 * 60, n).astype('timedelta64[m]')
+        receipt_time = np.datetime64(utc_now, 'us') - receipt_offsets
+        sign_time = receipt_time + (durations * 60e6).astype('timedelta64[us]')
+
+        columns = {
+            'order_id': np.char.add('BENCH', np.char.zfill(np.arange(start, start + n).astype(str), 9)).tolist(),
+            'from_dipan_id': np.arange(start, start + n).astype(str).tolist(),
+            'from_city_name': rng.choice(BENCHMARK_CITIES, n).tolist(),
+            'delivery_user_id': rng.choice(courier_ids, n).tolist(),
+            'poi_lat': poi_lat.tolist(),
+            'poi_lng': poi_lng.tolist(),
+            'sign_lat': _where(delivered, poi_lat + 0.02),
+            'sign_lng': _where(delivered, poi_lng + 0.02),
+            'receipt_time': _where(statuses != 'pending', receipt_time),
+            'sign_time': _where(delivered, sign_time),
+            # Dated like production history rather than all created now
+            'created_at': _where(statuses != 'pending', receipt_time, utc_now),
+            'updated_at': [utc_now] * n,
+            'status': statuses.tolist(),
+            'priority': ['normal'] * n,
+            'predicted_delivery_time': (durations * rng.uniform(0.8, 1.2, n)).tolist(),
+            'distance_km': _where(delivered, np.full(n, 3.1)),
+            'is_anomaly': [False] * n,
+            'aoi_id': [''] * n,
+            'typecode': [''] * n,
+            'ds': [''] * n,
+            'special_instructions': [''] * n,
+        }
+        insert_rows(Package, columns)
+        stdout.write(f'Seeded {start + n} packages ({(start + n) / (time.perf_counter() - started):.0f} rows/sec)')
+
+    # Logs for a sample of packages
+    sample = list(Package.objects.order_by('?').values_list('id', 'delivery_user_id')[:max(n_packages // 10, 1)])
+    OTPLog.objects.bulk_create(
+        [OTPLog(package_id=package_id, otp_code=f'{rng.integers(0, 10 ** 6):06d}') for package_id, _ in sample],
+        batch_size=batch_size,
+    )
+    CourierLog.objects.bulk_create(
+        [CourierLog(package_id=package_id, courier_id=courier_id, event='location_update',
+                    log_time=now - timedelta(minutes=int(rng.integers(0, 30 * 24 * 60))),
+                    location_lat=-6.8, location_lng=39.28)
+         for package_id, courier_id in sample for _ in range(3)],
+        batch_size=batch_size,
+    )
+    Anomaly.objects.bulk_create(
+        [Anomaly(package_id=package_id, courier_id=courier_id, description='Benchmark anomaly')
+         for package_id, courier_id in sample[::20]],
+        batch_size=batch_size,
+    )
+
+    # Give the planner the table statistics a long-lived database would have
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def hot_queries():
+    """
+    The ORM queries issued by the views and models on hot paths
+
+    Returns:
+        list: (name, queryset to EXPLAIN, callable that runs the query) tuples
+    """
+    from dropa_app.models import User, Package, CourierLog, OTPLog, Anomaly, PerformanceMetrics
+    from dropa_app.dashboard_stats import compute_dashboard_counts
+    from dropa_app.pagination import paginate_packages
+    from dropa_app.views import annotate_courier_stats, filter_packages
+
+    today = timezone.localdate()
+    courier_id = User.objects.filter(role='courier').values_list('id', flat=True).first()
+    otp = OTPLog.objects.values_list('package_id', 'otp_code').last()
+    anomaly_package = Anomaly.objects.values_list('package_id', flat=True).first()
+    day_start = timezone.make_aware(datetime.combine(today, datetime.min.time()))
+
+    couriers = annotate_courier_stats(User.objects.filter(role='courier')).order_by('-delivery_count')[:10]
+    recent = Package.objects.select_related('delivery_user').order_by('-receipt_time')[:5]
+    first_page = Package.objects.filter(receipt_time__isnull=False).order_by('-receipt_time', '-id')[:51]
+    status_page = filter_packages(Package.objects.all(), {'status': 'in_transit'})
+    courier_page = filter_packages(Package.objects.all(), {'courier': courier_id})
+    in_transit = Package.objects.filter(status='in_transit')
+    delivered_today = Package.objects.filter(
+        status='delivered', sign_time__gte=day_start, sign_time__lt=day_start + timedelta(days=1)
+    )
+    courier_deliveries = Package.objects.filter(delivery_user_id=courier_id, status='delivered')
+    rollup_range = Package.objects.filter(created_at__gte=day_start - timedelta(days=30))
+    otp_lookup = OTPLog.objects.filter(package_id=otp[0], otp_code=otp[1])
+    courier_logs = CourierLog.objects.filter(courier_id=courier_id).order_by('-log_time')[:50]
+    anomalies = Anomaly.objects.filter(package_id=anomaly_package)
+
+    # Lambdas clone the querysets with .all() so no run is served from a result cache
+    return [
+        ('dashboard_counts', delivered_today, compute_dashboard_counts),
+        ('recent_packages', recent, lambda: list(recent.all())),
+        ('package_list_first_page', first_page, lambda: paginate_packages(Package.objects.all(), None, 50)),
+        ('package_list_status_page', status_page.order_by('-receipt_time', '-id')[:51],
+         lambda: paginate_packages(status_page, None, 50)),
+        ('package_list_courier_page', courier_page.order_by('-receipt_time', '-id')[:51],
+         lambda: paginate_packages(courier_page, None, 50)),
+        ('map_in_transit', in_transit, lambda: list(in_transit.all())),
+        ('courier_stats', couriers, lambda: list(couriers.all())),
+        ('courier_delivered_count', courier_deliveries, courier_deliveries.count),
+        ('metrics_rollup_30d', rollup_range,
+         lambda: PerformanceMetrics.rollup(today - timedelta(days=30), today)),
+        ('otp_verify_lookup', otp_lookup, otp_lookup.first),
+        ('courier_log_history', courier_logs, lambda: list(courier_logs.all())),
+        ('package_anomalies', anomalies, lambda: list(anomalies.all())),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway database with synthetic data and time the hot ORM queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--packages',
+            type=int,
+            default=100000,
+            help='Synthetic packages to seed (default: 100000)',
+        )
+        parser.add_argument(
+            '--couriers',
+            type=int,
+            default=200,
+            help='Synthetic couriers to seed (default: 200)',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Timed runs per query after one warm-up run (default: 5)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for the synthetic data (default: 42)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='Rows per bulk insert while seeding (default: 10000)',
+        )
+        parser.add_argument(
+            '--explain',
+            action='store_true',
+            help='Print the EXPLAIN plan of every query',
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Write the timings as JSON to this file for comparison between runs',
+        )
+
+    def handle(self, *args, **options):
+        if options['packages'] < 1 or options['couriers'] < 1 or options['repeat'] < 1:
+            raise CommandError('--packages, --couriers and --repeat must be positive')
+
+        # The test database machinery gives a fully migrated, disposable database
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write(f'Seeding {options["packages"]} packages on {connection.vendor}...')
+            seed(options['packages'], options['couriers'], options['batch_size'], options['seed'], self.stdout)
+            results = self.run_queries(options['repeat'], options['explain'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'vendor': connection.vendor,
+                    'packages': options['packages'],
+                    'couriers': options['couriers'],
+                    'seed': options['seed'],
+                    'run_at': timezone.now().isoformat(),
+                    'queries': results,
+                }, f, indent=2)
+            self.stdout.write(f'Timings written to {options["output"]}')
+
+    def run_queries(self, repeat, explain):
+        """Time every hot query and optionally print its plan"""
+        results = {}
+        self.stdout.write(f'\n{"query":<28}{"median ms":>12}{"min ms":>10}{"max ms":>10}')
+
+        for name, queryset, run in hot_queries():
+            run()
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - started) * 1000)
+
+            results[name] = {
+                'median_ms': round(statistics.median(timings), 3),
+                'min_ms': round(min(timings), 3),
+                'max_ms': round(max(timings), 3),
+            }
+            self.stdout.write(
+                f'{name:<28}{results[name]["median_ms"]:>12.2f}{results[name]["min_ms"]:>10.2f}'
+                f'{results[name]["max_ms"]:>10.2f}'
+            )
+            if explain:
+                self.stdout.write(self.style.MIGRATE_LABEL(f'  {queryset.explain()}'.replace('\n', '\n  ')))
+
+        return results
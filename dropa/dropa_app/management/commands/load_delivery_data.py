@@ -2,13 +2,197 @@
 Management command to load delivery data from CSV file
 """
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 from django.utils import timezone
-from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import django
+import glob
+import multiprocessing
+import queue
+import threading
+import zlib
+import numpy as np
 import pandas as pd
 import os
-import random
-from dropa_app.models import User, Package
+import time
+from dropa_app.models import User, Package, IngestedFile
+from dropa_app.dashboard_stats import invalidate_dashboard_counts
+from dropa_app.ratings import recompute_courier_ratings
+from dropa_app.geo import package_distance_km
+
+# Statuses assigned to rows without a recorded delivery
+STATUS_OPTIONS = ['pending', 'in_transit', 'delivered', 'cancelled']
+
+# The Tanzania export stores times without a year, e.g. "06-04 10:49:00"
+CSV_TIME_FORMAT = '%m-%d %H:%M:%S'
+
+
+def _column(chunk, names, default=None):
+    """First matching CSV column as a Series, or a constant Series when none is present"""
+    for name in names:
+        if name in chunk.columns:
+            return chunk[name]
+    return pd.Series(default, index=chunk.index)
+
+
+def _parse_times(values):
+    """Parse CSV timestamps to aware datetimes, placing year-less values in the current year"""
+    times = pd.to_datetime(values, format=CSV_TIME_FORMAT, errors='coerce')
+    times = times + pd.DateOffset(years=timezone.now().year - 1900)
+    missing = times.isna() & values.notna()
+    if missing.any():
+        times[missing] = pd.to_datetime(values[missing], errors='coerce')
+    return times.dt.tz_localize(timezone.get_current_timezone(), ambiguous='NaT', nonexistent='NaT')
+
+
+def _nullable(values):
+    """Convert a Series to a list with None in place of NaN/NaT"""
+    return values.astype(object).where(values.notna(), None).tolist()
+
+
+def file_id_prefix(path):
+    """Short stable tag of a file, so generated order ids from different files cannot collide"""
+    return f'{zlib.crc32(os.path.abspath(path).encode("utf-8")):08X}-'
+
+
+def parse_chunk(chunk, courier_ids, seed=None, id_prefix=''):
+    """
+    Convert a CSV chunk into Package field dicts without touching the database
+
+    Args:
+        chunk (pd.DataFrame): Rows read from the delivery CSV
+        courier_ids (list): Courier user ids to assign packages to
+        seed (int): Seed for random courier, status and date assignment
+        id_prefix (str): Inserted into order ids generated for rows without one
+
+    Returns:
+        list: One dict of Package field values per row
+    """
+    rng = np.random.default_rng(seed)
+    n = len(chunk)
+    now = timezone.now()
+
+    order_ids = _column(chunk, ['order_id'])
+    # The chunk index is the row offset in the file
+    generated_ids = pd.Series([f'DR{id_prefix}{str(i + 1).zfill(6)}' for i in chunk.index], index=chunk.index)
+    order_ids = order_ids.where(order_ids.notna(), generated_ids).astype(str)
+
+    from_city = _column(chunk, ['from_city_name', 'from_city'], 'Dar es Salaam').fillna('Dar es Salaam')
+    to_city = _column(chunk, ['to_city_name', 'to_city'])
+
+    # Recorded times where the export has them, random recent dates otherwise
+    receipt_time = _parse_times(_column(chunk, ['receipt_time']))
+    sign_time = _parse_times(_column(chunk, ['sign_time']))
+    random_receipt = pd.Series(now - pd.to_timedelta(rng.integers(0, 31, n), unit='D'), index=chunk.index)
+    receipt_time = receipt_time.where(receipt_time.notna(), random_receipt)
+
+    delivery_hours = pd.to_numeric(_column(chunk, ['delivery_time_hours']), errors='coerce')
+    status = pd.Series(rng.choice(STATUS_OPTIONS, n), index=chunk.index)
+    status[(delivery_hours > 0) | sign_time.notna()] = 'delivered'
+
+    # Delivered rows without a sign time get one from delivery_time_hours or a random 1-48h
+    hours = delivery_hours.where(delivery_hours > 0, pd.Series(rng.uniform(1, 48, n), index=chunk.index))
+    estimated_sign = receipt_time + pd.to_timedelta(hours, unit='h')
+    sign_time = sign_time.where(sign_time.notna() | (status != 'delivered'), estimated_sign)
+
+    poi_lng = pd.to_numeric(_column(chunk, ['poi_lng']), errors='coerce').fillna(0.0)
+    poi_lat = pd.to_numeric(_column(chunk, ['poi_lat']), errors='coerce').fillna(0.0)
+    sign_lng = pd.to_numeric(_column(chunk, ['sign_lng']), errors='coerce')
+    sign_lat = pd.to_numeric(_column(chunk, ['sign_lat']), errors='coerce')
+    distance = pd.Series(package_distance_km(poi_lat, poi_lng, sign_lat, sign_lng), index=chunk.index)
+
+    columns = {
+        'order_id': order_ids.tolist(),
+        'from_dipan_id': _column(chunk, ['from_dipan_id'], '').fillna('').astype(str).tolist(),
+        'from_city_name': from_city.astype(str).tolist(),
+        'to_city_name': _nullable(to_city),
+        'delivery_user_id': rng.choice(courier_ids, n).tolist(),
+        'poi_lng': poi_lng.tolist(),
+        'poi_lat': poi_lat.tolist(),
+        'receipt_lng': _nullable(pd.to_numeric(_column(chunk, ['receipt_lng']), errors='coerce')),
+        'receipt_lat': _nullable(pd.to_numeric(_column(chunk, ['receipt_lat']), errors='coerce')),
+        'sign_lng': _nullable(sign_lng),
+        'sign_lat': _nullable(sign_lat),
+        'distance_km': _nullable(distance),
+        'receipt_time': _nullable(receipt_time.where(receipt_time.notna())),
+        'sign_time': _nullable(sign_time.where(status == 'delivered')),
+        'aoi_id': _column(chunk, ['aoi_id'], '').fillna('').astype(str).tolist(),
+        'typecode': _column(chunk, ['typecode'], '').fillna('').astype(str).tolist(),
+        'ds': _column(chunk, ['ds'], '').fillna('').astype(str).tolist(),
+        'status': status.tolist(),
+        'package_weight': _nullable(pd.to_numeric(
+            _column(chunk, ['package_weight_kg', 'package_weight']), errors='coerce'
+        )),
+        'special_instructions': ['Handle with care'] * n,
+    }
+
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def write_packages(rows):
+    """
+    Insert parsed package rows that are not already in the database
+
+    Args:
+        rows (list): Package field dicts from parse_chunk
+
+    Returns:
+        int: Number of packages inserted
+    """
+    order_ids = list({row['order_id'] for row in rows})
+    with transaction.atomic():
+        # One query per chunk instead of an exists() per row
+        existing = set(Package.objects.filter(order_id__in=order_ids).values_list('order_id', flat=True))
+
+        packages = [Package(**row) for row in rows if row['order_id'] not in existing]
+        # ignore_conflicts covers rows inserted concurrently or duplicated within the chunk
+        Package.objects.bulk_create(packages, batch_size=1000, ignore_conflicts=True)
+
+        # bulk_create returns every submitted object even when a conflict skipped it, so count the
+        # rows that now exist instead (a concurrent writer's rows for the same ids are counted too)
+        return Package.objects.filter(order_id__in=order_ids).count() - len(existing)
+
+
+def _put(batches, message, abort):
+    """Queue a message for the writers, blocking while the queue is full unless the load was aborted"""
+    while True:
+        if abort.is_set():
+            raise RuntimeError('Load aborted after a writer failure')
+        try:
+            batches.put(message, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+def parse_file(path, courier_ids, chunk_size, batches, abort):
+    """
+    Parse one CSV file in a worker process and hand its chunks to the database writers
+
+    Args:
+        path (str): CSV file to parse
+        courier_ids (list): Courier user ids to assign packages to
+        chunk_size (int): Rows per batch
+        batches (Queue): Bounded queue shared with the writers; put() blocks when it is full
+        abort (Event): Set when a writer failed; parsing stops instead of waiting on the queue
+
+    Returns:
+        tuple: (path, rows parsed)
+    """
+    rows_parsed = 0
+    batch_count = 0
+    id_prefix = file_id_prefix(path)
+    for chunk in pd.read_csv(path, chunksize=chunk_size):
+        rows = parse_chunk(chunk, courier_ids, id_prefix=id_prefix)
+        _put(batches, ('rows', path, rows), abort)
+        rows_parsed += len(rows)
+        batch_count += 1
+
+    _put(batches, ('done', path, batch_count), abort)
+    return path, rows_parsed
+
 
 class Command(BaseCommand):
     help = 'Load delivery data from CSV file'
@@ -23,12 +207,58 @@ class Command(BaseCommand):
             '--limit',
             type=int,
             default=100,
-            help='Limit number of records to load (default: 100)',
+            help='Limit number of records to load in single-file mode, 0 for all (default: 100)',
+        )
+        parser.add_argument(
+            '--csv-dir',
+            type=str,
+            help='Load every *.csv file in this directory in parallel',
+        )
+        parser.add_argument(
+            '--csv-glob',
+            type=str,
+            help='Load every file matching this glob pattern in parallel',
+        )
+        parser.add_argument(
+            '--parse-workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Processes parsing CSV files in multi-file mode (default: all cores)',
+        )
+        parser.add_argument(
+            '--writers',
+            type=int,
+            default=1,
+            help='Database writer threads in multi-file mode; always 1 on SQLite (default: 1)',
+        )
+        parser.add_argument(
+            '--queue-size',
+            type=int,
+            default=8,
+            help='Parsed chunks buffered between parsers and writers (default: 8)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Rows read, checked and inserted per transaction (default: 5000)',
         )
 
     def handle(self, *args, **options):
         csv_path = options['csv_path']
         limit = options['limit']
+        chunk_size = options['chunk_size']
+        
+        if options['csv_dir'] or options['csv_glob']:
+            pattern = options['csv_glob'] or os.path.join(options['csv_dir'], '*.csv')
+            paths = sorted(glob.glob(pattern))
+            if not paths:
+                self.stdout.write(self.style.ERROR(f'No CSV files match: {pattern}'))
+                return
+            
+            self.create_sample_users()
+            self.load_files(paths, chunk_size, options['parse_workers'], options['writers'], options['queue_size'])
+            return
         
         if not csv_path:
             # Use the default CSV file
@@ -44,20 +274,12 @@ class Command(BaseCommand):
             return
         
         try:
-            # Load CSV data
-            df = pd.read_csv(csv_path)
-            self.stdout.write(f'Loaded {len(df)} records from CSV')
-            
-            # Limit records if specified
-            if limit and len(df) > limit:
-                df = df.head(limit)
-                self.stdout.write(f'Limited to {limit} records')
-            
             # Create sample users if they don't exist
             self.create_sample_users()
             
-            # Load package data
-            self.load_packages(df)
+            # Stream the CSV in chunks instead of loading it whole
+            chunks = pd.read_csv(csv_path, chunksize=chunk_size, nrows=limit or None)
+            self.load_packages(chunks)
             
             self.stdout.write(
                 self.style.SUCCESS('Successfully loaded delivery data')
@@ -132,88 +354,191 @@ class Command(BaseCommand):
                     password='courier123',
                     first_name=courier_data['first_name'],
                     last_name=courier_data['last_name'],
-                    phone=courier_data['phone'],
+                    phone_number=courier_data['phone'],
                     role='courier',
                     is_active=True
                 )
                 self.stdout.write(f"Created courier: {courier_data['username']}")
 
-    def load_packages(self, df):
-        """Load package data from DataFrame"""
+    def load_packages(self, chunks):
+        """Load package data from an iterable of DataFrame chunks"""
         
         # Get all couriers
-        couriers = list(User.objects.filter(role='courier'))
+        courier_ids = list(User.objects.filter(role='courier').values_list('id', flat=True))
         
-        if not couriers:
+        if not courier_ids:
             self.stdout.write(self.style.WARNING('No couriers found. Creating sample couriers first.'))
             return
         
-        # Status mapping
-        status_options = ['pending', 'in_transit', 'delivered', 'cancelled']
-        
+        rows_read = 0
         packages_created = 0
+        started = time.perf_counter()
+        
+        for chunk in chunks:
+            rows = parse_chunk(chunk, courier_ids)
+            packages_created += write_packages(rows)
+            rows_read += len(rows)
+            
+            elapsed = time.perf_counter() - started
+            rate = rows_read / elapsed if elapsed > 0 else 0
+            self.stdout.write(f'Processed {rows_read} rows, created {packages_created} packages ({rate:.0f} rows/sec)')
+        
+        # bulk_create sends no post_save signals
+        invalidate_dashboard_counts()
+        if packages_created:
+            recompute_courier_ratings(courier_ids)
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully created {packages_created} packages')
+        )
+
+    def load_files(self, paths, chunk_size, parse_workers, writers, queue_size):
+        """Parse many CSV files in a process pool and funnel their chunks to the database writers"""
+        
+        courier_ids = list(User.objects.filter(role='courier').values_list('id', flat=True))
+        if not courier_ids:
+            self.stdout.write(self.style.WARNING('No couriers found. Creating sample couriers first.'))
+            return
+        
+        # Skip files whose size and mtime match the manifest from an earlier run
+        manifest = {entry.path: entry for entry in IngestedFile.objects.filter(path__in=[os.path.abspath(p) for p in paths])}
+        pending_files = {}
+        for path in paths:
+            path = os.path.abspath(path)
+            stat = os.stat(path)
+            modified_at = datetime.fromtimestamp(stat.st_mtime, tz=timezone.get_current_timezone())
+            entry = manifest.get(path)
+            if entry and entry.size == stat.st_size and entry.modified_at == modified_at:
+                self.stdout.write(f'Skipping already ingested file: {path}')
+                continue
+            pending_files[path] = {'size': stat.st_size, 'modified_at': modified_at}
+        
+        if not pending_files:
+            self.stdout.write(self.style.SUCCESS('All files already ingested'))
+            return
+        
+        if connection.vendor == 'sqlite' and writers > 1:
+            self.stdout.write(self.style.WARNING('SQLite supports a single writer; using 1 writer'))
+            writers = 1
+        
+        self.stdout.write(
+            f'Loading {len(pending_files)} files with {parse_workers} parser(s) and {writers} writer(s)'
+        )
+        
+        # Per-file progress shared by the writer threads
+        progress = {path: {'written': 0, 'expected': None, 'rows': 0, 'created': 0, 'failed': False}
+                    for path in pending_files}
+        totals = {'rows': 0, 'created': 0}
+        writer_errors = []
+        lock = threading.Lock()
+        started = time.perf_counter()
+        
+        def finish_file(path):
+            state = progress[path]
+            if state['failed']:
+                self.stdout.write(self.style.WARNING(f'Not recording {path} in the manifest after errors'))
+                return
+            IngestedFile.objects.update_or_create(
+                path=path,
+                defaults={
+                    'size': pending_files[path]['size'],
+                    'modified_at': pending_files[path]['modified_at'],
+                    'rows': state['rows'],
+                    'packages_created': state['created'],
+                }
+            )
+            self.stdout.write(f'Finished {path}: {state["rows"]} rows, {state["created"]} packages created')
         
-        for index, row in df.iterrows():
+        def writer():
             try:
-                # Generate order ID if not present
-                order_id = row.get('order_id', f'DR{str(index + 1).zfill(6)}')
-                
-                # Skip if package already exists
-                if Package.objects.filter(order_id=order_id).exists():
-                    continue
-                
-                # Assign random courier
-                courier = random.choice(couriers)
-                
-                # Determine status based on data or random
-                if 'delivery_time_hours' in row and pd.notna(row['delivery_time_hours']):
-                    # If delivery time is recorded, it's likely delivered
-                    status = 'delivered' if row['delivery_time_hours'] > 0 else random.choice(status_options)
-                else:
-                    status = random.choice(status_options)
-                
-                # Calculate dates
-                base_date = timezone.now() - timedelta(days=random.randint(0, 30))
-                receipt_time = base_date
-                
-                if status == 'delivered':
-                    delivery_hours = row.get('delivery_time_hours', random.uniform(1, 48))
-                    sign_time = receipt_time + timedelta(hours=delivery_hours)
-                else:
-                    sign_time = None
-                
-                # Create package
-                package = Package.objects.create(
-                    order_id=order_id,
-                    from_city_name=row.get('from_city', 'Dar es Salaam'),
-                    to_city_name=row.get('to_city', 'Arusha'),
-                    distance_km=row.get('distance_km', 100.0),
-                    package_weight_kg=row.get('package_weight_kg', 1.0),
-                    vehicle_type=row.get('vehicle_type', 'motorcycle'),
-                    delivery_cost_tsh=row.get('delivery_cost_tsh', 5000.0),
-                    status=status,
-                    receipt_time=receipt_time,
-                    sign_time=sign_time,
-                    delivery_user=courier,
-                    sender_name=f"Sender {index + 1}",
-                    recipient_name=f"Recipient {index + 1}",
-                    sender_phone=f"+25571234{str(index).zfill(4)}",
-                    recipient_phone=f"+25571235{str(index).zfill(4)}",
-                    package_description=f"Package from {row.get('from_city', 'Unknown')} to {row.get('to_city', 'Unknown')}",
-                    special_instructions="Handle with care"
-                )
-                
-                packages_created += 1
-                
-                if packages_created % 10 == 0:
-                    self.stdout.write(f'Created {packages_created} packages...')
+                while not abort.is_set():
+                    try:
+                        message = batches.get(timeout=0.5)
+                    except queue.Empty:
+                        continue
+                    if message is None:
+                        return
+                    
+                    kind, path, payload = message
+                    with lock:
+                        state = progress[path]
+                    
+                    if kind == 'done':
+                        with lock:
+                            state['expected'] = payload
+                            complete = state['written'] == payload
+                    else:
+                        try:
+                            created = write_packages(payload)
+                        except Exception as e:
+                            created = 0
+                            state['failed'] = True
+                            self.stdout.write(self.style.WARNING(f'Error writing batch from {path}: {str(e)}'))
+                        
+                        with lock:
+                            state['written'] += 1
+                            state['rows'] += len(payload)
+                            state['created'] += created
+                            totals['rows'] += len(payload)
+                            totals['created'] += created
+                            complete = state['written'] == state['expected']
+                            rows_done = totals['rows']
+                        
+                        elapsed = time.perf_counter() - started
+                        rate = rows_done / elapsed if elapsed > 0 else 0
+                        self.stdout.write(f'Processed {rows_done} rows ({rate:.0f} rows/sec)')
                     
+                    if complete:
+                        finish_file(path)
             except Exception as e:
-                self.stdout.write(
-                    self.style.WARNING(f'Error creating package {index}: {str(e)}')
-                )
-                continue
+                # Stop the parsers and the other writers rather than leave them blocked on the queue
+                with lock:
+                    writer_errors.append(e)
+                abort.set()
+                self.stdout.write(self.style.ERROR(f'Writer failed, aborting the load: {str(e)}'))
+            finally:
+                # Each writer thread holds its own database connection
+                connection.close()
+        
+        with multiprocessing.Manager() as manager:
+            # Bounded so fast parsers block instead of piling chunks up in memory
+            batches = manager.Queue(maxsize=queue_size)
+            abort = manager.Event()
+            writer_threads = [threading.Thread(target=writer, daemon=True) for _ in range(writers)]
+            for thread in writer_threads:
+                thread.start()
+            
+            with ProcessPoolExecutor(max_workers=parse_workers, initializer=django.setup) as pool:
+                futures = [pool.submit(parse_file, path, courier_ids, chunk_size, batches, abort)
+                           for path in pending_files]
+                for future, path in zip(futures, pending_files):
+                    if abort.is_set():
+                        # Files not started yet are never parsed
+                        for pending in futures:
+                            pending.cancel()
+                    try:
+                        future.result()
+                    except Exception as e:
+                        progress[path]['failed'] = True
+                        if not abort.is_set():
+                            self.stdout.write(self.style.WARNING(f'Error parsing {path}: {str(e)}'))
+            
+            # After an abort the writers exit on their own
+            if not abort.is_set():
+                for _ in writer_threads:
+                    batches.put(None)
+            for thread in writer_threads:
+                thread.join()
+        
+        invalidate_dashboard_counts()
+        if totals['created']:
+            recompute_courier_ratings(courier_ids)
+        
+        if writer_errors:
+            raise CommandError(
+                f'Load aborted after a writer failure ({totals["created"]} packages created): {str(writer_errors[0])}'
+            )
         
         self.stdout.write(
-            self.style.SUCCESS(f'Successfully created {packages_created} packages')
+            self.style.SUCCESS(f'Successfully created {totals["created"]} packages from {len(pending_files)} files')
         )
@@ -0,0 +1,50 @@
+"""
+Management command to list published ML model versions and switch the current one
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from dropa_app.model_registry import ML_MODELS_DIR, activate_version, current_version, list_versions, read_manifest
+
+
+class Command(BaseCommand):
+    help = 'List published ML model versions, or point CURRENT at one of them (e.g. to roll back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--activate',
+            type=str,
+            metavar='VERSION',
+            help='Make this published version current; watching workers swap it in on their next poll',
+        )
+        parser.add_argument(
+            '--models-dir',
+            type=str,
+            default=ML_MODELS_DIR,
+            help=f'ML models directory (default: {ML_MODELS_DIR})',
+        )
+
+    def handle(self, *args, **options):
+        models_dir = options['models_dir']
+
+        if options['activate']:
+            try:
+                activate_version(options['activate'], models_dir)
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"Model version {options['activate']} is now current"))
+            return
+
+        versions = list_versions(models_dir)
+        if not versions:
+            self.stdout.write('No published model versions; models are read from the flat model files')
+            return
+
+        current = current_version(models_dir)
+        for version in versions:
+            manifest = read_manifest(version, models_dir)
+            training = manifest.get('training', {})
+            marker = '*' if version == current else ' '
+            self.stdout.write(
+                f"{marker} {version}  {manifest['created_at']}  {len(manifest['files'])} files  "
+                f"{training.get('rows', '?')} rows ({training.get('source', 'unknown')})"
+            )
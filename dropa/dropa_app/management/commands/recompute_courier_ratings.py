@@ -0,0 +1,36 @@
+"""
+Management command to rebuild courier rating aggregates from delivered packages
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+import time
+from dropa_app.ratings import recompute_courier_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute rating_score_sum, rating_count and rating for every courier'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Couriers aggregated per query (default: 500)',
+        )
+        parser.add_argument(
+            '--courier',
+            type=int,
+            action='append',
+            dest='couriers',
+            help='Only recompute this courier id (may be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        started = time.perf_counter()
+        updated = recompute_courier_ratings(options['couriers'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Recomputed ratings for {updated} couriers in {time.perf_counter() - started:.1f}s'
+        ))
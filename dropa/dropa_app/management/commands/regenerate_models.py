@@ -2,154 +2,178 @@
 Django management command to regenerate ML models with proper serialization
 """
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from concurrent.futures import ProcessPoolExecutor
 import os
-import sys
+import shutil
+import tempfile
+import time
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder, StandardScaler
 from sklearn.ensemble import IsolationForest
 from sklearn.metrics import mean_absolute_error
 import lightgbm as lgb
-import joblib
-import pickle
 from prophet import Prophet
-from datetime import datetime, timedelta
+from dropa_app.features import anomaly_features, city_code, delivery_time_features
+from dropa_app.model_registry import KEEP_VERSIONS, ML_MODELS_DIR, publish_version
+from dropa_app.native_models import DELIVERY_BOOSTER_FILE, export_booster, metadata_path
+from dropa_app.training_data import DEFAULT_CHUNK_SIZE, extract_training_snapshot, load_training_snapshot
 
-class Command(BaseCommand):
-    help = 'Regenerate ML models with proper serialization'
+CITIES = ['Dar es Salaam', 'Arusha', 'Mwanza', 'Dodoma', 'Mbeya']
+CITY_COORDS = {
+    'Dar es Salaam': (-6.7924, 39.2083),
+    'Arusha': (-3.3869, 36.6830), 
+    'Mwanza': (-2.5164, 32.9175),
+    'Dodoma': (-6.1630, 35.7516),
+    'Mbeya': (-8.9094, 33.4607)
+}
 
-    def handle(self, *args, **options):
-        self.stdout.write("Regenerating ML models...")
-        
-        try:
-            # Train and save delivery time model
-            delivery_model = self.train_delivery_time_model()
-            self.save_model(delivery_model, 'delivery_time_model.pkl')
-            self.stdout.write(self.style.SUCCESS("✓ Delivery time model saved"))
-            
-            # Train and save anomaly detection model  
-            anomaly_model = self.train_anomaly_detection_model()
-            self.save_model(anomaly_model, 'anomaly_detection_model.pkl')
-            self.stdout.write(self.style.SUCCESS("✓ Anomaly detection model saved"))
-            
-            # Train and save forecasting model
-            forecasting_model = self.train_forecasting_model()
-            self.save_model(forecasting_model, 'prophet_forecasting_model.pkl')
-            self.stdout.write(self.style.SUCCESS("✓ Forecasting model saved"))
-            
-            self.stdout.write(self.style.SUCCESS("\nAll models regenerated successfully!"))
-            
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Error regenerating models: {str(e)}"))
+def create_sample_data(n_samples=1000, seed=42):
+    """
+    Create synthetic delivery data for model training
+    
+    Every column is drawn as a whole array, so millions of rows take seconds.
+    
+    Args:
+        n_samples (int): Number of deliveries to generate
+        seed (int): Random seed
+    
+    Returns:
+        pd.DataFrame: One row per delivery
+    """
+    rng = np.random.default_rng(seed)
+    coords = np.array([CITY_COORDS[city] for city in CITIES])
+    
+    # Destination is any city other than the origin
+    from_idx = rng.integers(0, len(CITIES), n_samples)
+    to_idx = (from_idx + rng.integers(1, len(CITIES), n_samples)) % len(CITIES)
+    from_coords = coords[from_idx]
+    to_coords = coords[to_idx]
+    
+    # Calculate approximate distance
+    distance_approx = np.hypot(*(from_coords - to_coords).T) * 111  # rough km conversion
+    
+    # Simulate delivery time based on distance with noise
+    base_time = distance_approx * 2 + rng.normal(0, 30, n_samples)  # 2 minutes per km base
+    delivery_minutes = np.maximum(30, base_time)  # minimum 30 minutes
+    
+    return pd.DataFrame({
+        'from_city_name': pd.Categorical.from_codes(from_idx, CITIES),
+        'delivery_user_id': rng.integers(1, 6, n_samples),  # 5 couriers
+        'poi_lng': to_coords[:, 1],
+        'poi_lat': to_coords[:, 0],
+        'receipt_lng': from_coords[:, 1],
+        'receipt_lat': from_coords[:, 0],
+        'sign_lng': to_coords[:, 1],
+        'sign_lat': to_coords[:, 0],
+        'delivery_minutes': delivery_minutes,
+        'delivery_cost': delivery_minutes * 50 + rng.normal(0, 500, n_samples),  # cost correlation
+        'package_weight': rng.uniform(0.5, 10.0, n_samples),
+    })
 
-    def create_sample_data(self):
-        """Create sample data for model training"""
-        np.random.seed(42)
-        
-        cities = ['Dar es Salaam', 'Arusha', 'Mwanza', 'Dodoma', 'Mbeya']
-        city_coords = {
-            'Dar es Salaam': (-6.7924, 39.2083),
-            'Arusha': (-3.3869, 36.6830), 
-            'Mwanza': (-2.5164, 32.9175),
-            'Dodoma': (-6.1630, 35.7516),
-            'Mbeya': (-8.9094, 33.4607)
-        }
-        
-        n_samples = 1000
-        data = []
-        
-        for i in range(n_samples):
-            from_city = np.random.choice(cities)
-            to_city = np.random.choice([c for c in cities if c != from_city])
-            
-            from_coords = city_coords[from_city]
-            to_coords = city_coords[to_city]
-            
-            # Calculate approximate distance
-            lat_diff = abs(from_coords[0] - to_coords[0])
-            lng_diff = abs(from_coords[1] - to_coords[1])
-            distance_approx = np.sqrt(lat_diff**2 + lng_diff**2) * 111  # rough km conversion
-            
-            # Simulate delivery time based on distance with noise
-            base_time = distance_approx * 2 + np.random.normal(0, 30)  # 2 minutes per km base
-            delivery_minutes = max(30, base_time)  # minimum 30 minutes
-            
-            data.append({
-                'from_city_name': from_city,
-                'delivery_user_id': np.random.randint(1, 6),  # 5 couriers
-                'poi_lng': to_coords[1],
-                'poi_lat': to_coords[0],
-                'receipt_lng': from_coords[1], 
-                'receipt_lat': from_coords[0],
-                'sign_lng': to_coords[1],
-                'sign_lat': to_coords[0],
-                'delivery_minutes': delivery_minutes,
-                'delivery_cost': delivery_minutes * 50 + np.random.normal(0, 500),  # cost correlation
-                'package_weight': np.random.uniform(0.5, 10.0)
-            })
-        
-        return pd.DataFrame(data)
+# Columns each model trains on
+DELIVERY_FEATURES = ['from_city_name', 'delivery_user_id', 'poi_lng', 'poi_lat', 'receipt_lng', 'receipt_lat', 'sign_lng', 'sign_lat']
+ANOMALY_FEATURES = ['delivery_minutes', 'delivery_cost', 'package_weight']
 
-    def train_delivery_time_model(self):
-        """Train delivery time prediction model"""
-        self.stdout.write("Training delivery time model...")
-        
-        df = self.create_sample_data()
-        
-        # Prepare features
-        features = ['from_city_name', 'delivery_user_id', 'poi_lng', 'poi_lat', 'receipt_lng', 'receipt_lat', 'sign_lng', 'sign_lat']
-        
-        # Encode categorical features
-        le = LabelEncoder()
-        df['from_city_name'] = le.fit_transform(df['from_city_name'])
-        
-        X = df[features]
-        y = df['delivery_minutes']
-        
-        # Split data
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-        
-        # Train model
-        model = lgb.LGBMRegressor(
-            num_leaves=31,
-            learning_rate=0.1,
-            n_estimators=100,
-            random_state=42
-        )
-        model.fit(X_train, y_train)
-        
-        # Evaluate
-        y_pred = model.predict(X_test)
-        mae = mean_absolute_error(y_test, y_pred)
-        self.stdout.write(f"Delivery time model MAE: {mae:.2f} minutes")
-        
-        return model
+def snapshot_frame(columns):
+    """
+    Build the training frame from training snapshot columns
+    
+    Features are built by the same functions serving uses, so real deliveries are encoded
+    exactly as they will be at prediction time.
+    
+    Args:
+        columns (dict): Column arrays returned by load_training_snapshot
+    
+    Returns:
+        pd.DataFrame: One row per delivery with the model feature columns
+    """
+    df = pd.DataFrame(delivery_time_features(
+        columns['city_code'], columns['delivery_user_id'],
+        columns['poi_lng'], columns['poi_lat'], columns['sign_lng'], columns['sign_lat'],
+    ), columns=DELIVERY_FEATURES)
+    anomaly = anomaly_features(columns['delivery_minutes'], package_weight=columns['package_weight'])
+    for i, name in enumerate(ANOMALY_FEATURES):
+        df[name] = anomaly[:, i]
+    return df
 
-    def train_anomaly_detection_model(self):
-        """Train anomaly detection model"""
-        self.stdout.write("Training anomaly detection model...")
-        
-        df = self.create_sample_data()
-        
-        # Features for anomaly detection
-        features = ['delivery_minutes', 'delivery_cost', 'package_weight']
-        X = df[features]
-        
-        # Train isolation forest
-        model = IsolationForest(
-            contamination=0.1,
-            random_state=42
-        )
-        model.fit(X)
-        
-        self.stdout.write("Anomaly detection model trained")
-        return model
+def daily_volume(receipt_times):
+    """
+    Count deliveries per day for the forecasting model
+    
+    Args:
+        receipt_times (array): Receipt times as Unix seconds
+    
+    Returns:
+        pd.DataFrame: Prophet ds/y frame, or None when there are fewer than two days of history
+    """
+    if len(receipt_times) == 0:
+        return None
+    days = np.asarray(receipt_times) // 86400
+    first = int(days.min())
+    counts = np.bincount(days - first)
+    if len(counts) < 2:
+        return None
+    return pd.DataFrame({
+        'ds': pd.to_datetime(first, unit='D') + pd.to_timedelta(np.arange(len(counts)), unit='D'),
+        'y': counts.astype(np.float64),
+    })
+
+# Output file of each model
+MODEL_FILES = {
+    'delivery_time': 'delivery_time_model.pkl',
+    'anomaly_detection': 'anomaly_detection_model.pkl',
+    'forecasting': 'prophet_forecasting_model.pkl',
+}
+
+# Trainers are module-level functions so a process pool can run them; each returns
+# (model, summary line) and prints nothing itself
 
-    def train_forecasting_model(self):
-        """Train Prophet forecasting model"""
-        self.stdout.write("Training forecasting model...")
+def train_delivery_time_model(df, n_threads=None):
+    """Train delivery time prediction model"""
+    X = df[DELIVERY_FEATURES].copy()
+    if not pd.api.types.is_numeric_dtype(X['from_city_name']):
+        # Encode city names with the serving encoding; snapshot frames arrive encoded
+        cities = X['from_city_name'].astype('category')
+        codes = np.array([city_code(city) for city in cities.cat.categories])
+        X['from_city_name'] = codes[cities.cat.codes]
+    y = df['delivery_minutes']
+    
+    # Split data
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    
+    # Train model
+    model = lgb.LGBMRegressor(
+        num_leaves=31,
+        learning_rate=0.1,
+        n_estimators=100,
+        random_state=42,
+        n_jobs=n_threads or -1,
+        verbose=-1
+    )
+    model.fit(X_train, y_train)
+    
+    # Evaluate
+    y_pred = model.predict(X_test)
+    mae = mean_absolute_error(y_test, y_pred)
+    return model, f"Delivery time model MAE: {mae:.2f} minutes"
+
+def train_anomaly_detection_model(df, n_threads=None):
+    """Train anomaly detection model"""
+    # Train isolation forest
+    model = IsolationForest(
+        contamination=0.1,
+        random_state=42,
+        n_jobs=n_threads
+    )
+    model.fit(df[ANOMALY_FEATURES])
+    return model, "Anomaly detection model trained"
+
+def train_forecasting_model(seed=42, df_prophet=None):
+    """Train Prophet forecasting model, on simulated volume unless a daily ds/y frame is given"""
+    if df_prophet is None:
+        rng = np.random.default_rng(seed)
         
         # Create time series data
         dates = pd.date_range(start='2024-01-01', end='2024-12-31', freq='D')
@@ -159,7 +183,7 @@ class Command(BaseCommand):
         trend = np.linspace(0, 20, len(dates))  # Growing trend
         seasonal = 10 * np.sin(2 * np.pi * np.arange(len(dates)) / 365.25)  # Yearly pattern
         weekly = 5 * np.sin(2 * np.pi * np.arange(len(dates)) / 7)  # Weekly pattern
-        noise = np.random.normal(0, 5, len(dates))
+        noise = rng.normal(0, 5, len(dates))
         
         volume = base_volume + trend + seasonal + weekly + noise
         volume = np.maximum(volume, 0)  # No negative volumes
@@ -169,27 +193,203 @@ class Command(BaseCommand):
             'ds': dates,
             'y': volume
         })
-        
-        # Train Prophet model
-        model = Prophet(
-            daily_seasonality=True,
-            weekly_seasonality=True,
-            yearly_seasonality=True
-        )
-        model.fit(df_prophet)
-        
-        self.stdout.write("Forecasting model trained")
-        return model
+    
+    # Train Prophet model
+    model = Prophet(
+        daily_seasonality=True,
+        weekly_seasonality=True,
+        yearly_seasonality=True
+    )
+    model.fit(df_prophet)
+    return model, "Forecasting model trained"
+
+def run_trainer(name, trainer, *args):
+    """Run one trainer and time it"""
+    started = time.perf_counter()
+    model, summary = trainer(*args)
+    return name, model, summary, time.perf_counter() - started
+
+class Command(BaseCommand):
+    help = 'Regenerate ML models with proper serialization'
 
-    def save_model(self, model, filename):
-        """Save model to the ml/src directory"""
-        # Get the ml/src directory relative to Django project
-        output_dir = os.path.join(
-            os.path.dirname(__file__), 
-            '../../../ml/src/'
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--n-samples',
+            type=int,
+            default=1000,
+            help='Synthetic deliveries to generate for training (default: 1000)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for the synthetic data (default: 42)',
+        )
+        parser.add_argument(
+            '--parquet',
+            type=str,
+            help='Also write the generated training data to this Parquet file',
+        )
+        parser.add_argument(
+            '--data',
+            type=str,
+            help='Train on a Parquet file written by --parquet instead of generating data',
+        )
+        parser.add_argument(
+            '--source',
+            choices=['synthetic', 'db'],
+            default='synthetic',
+            help='Generate synthetic deliveries, or train on delivered packages from the database (default: synthetic)',
+        )
+        parser.add_argument(
+            '--snapshot',
+            type=str,
+            help='Train on this training snapshot; with --source db it is extracted here first and kept',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help=f'Rows per chunk when extracting from the database (default: {DEFAULT_CHUNK_SIZE})',
+        )
+        parser.add_argument(
+            '--output-dir',
+            type=str,
+            default=ML_MODELS_DIR,
+            help=f'ML models directory to publish the new model version in (default: {ML_MODELS_DIR})',
+        )
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=KEEP_VERSIONS,
+            help=f'Published model versions to keep, the new one included (default: {KEEP_VERSIONS})',
+        )
+        parser.add_argument(
+            '--no-activate',
+            action='store_true',
+            help='Publish the new version without making it current',
         )
-        os.makedirs(output_dir, exist_ok=True)
+        parser.add_argument(
+            '--n-jobs',
+            type=int,
+            default=3,
+            help='Models trained concurrently in separate processes; 1 trains in this process (default: 3)',
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            help='Threads per model for LightGBM and IsolationForest (default: CPUs divided by --n-jobs)',
+        )
+
+    def handle(self, *args, **options):
+        n_jobs = options['n_jobs']
+        if n_jobs < 1:
+            raise CommandError('--n-jobs must be positive')
+        if options['keep'] < 1:
+            raise CommandError('--keep must be positive')
+        threads = options['threads'] or max(1, (os.cpu_count() or 1) // min(n_jobs, len(MODEL_FILES)))
         
-        filepath = os.path.join(output_dir, filename)
-        joblib.dump(model, filepath)
-        self.stdout.write(f"Model saved to: {filepath}")
+        self.stdout.write("Regenerating ML models...")
+        pipeline_started = time.perf_counter()
+        
+        scratch_dir = None
+        try:
+            # Build the shared training frame once
+            started = time.perf_counter()
+            df_prophet = None
+            cities = {city: city_code(city) for city in CITIES}
+            snapshot = options['snapshot']
+            if options['source'] == 'db':
+                if snapshot is None:
+                    scratch_dir = tempfile.mkdtemp(prefix='dropa-training-')
+                    snapshot = os.path.join(scratch_dir, 'snapshot')
+                meta = extract_training_snapshot(snapshot, options['chunk_size'])
+                self.stdout.write(f"[data] Extracted {meta['rows']} deliveries in {time.perf_counter() - started:.2f}s")
+            
+            if snapshot:
+                columns, meta = load_training_snapshot(snapshot)
+                if meta['rows'] == 0:
+                    raise CommandError(f"Training snapshot {snapshot} has no deliveries")
+                df = snapshot_frame(columns)
+                cities = meta['cities']
+                df_prophet = daily_volume(columns['receipt_time'])
+                if df_prophet is None:
+                    self.stdout.write(self.style.WARNING("[data] Less than two days of deliveries, forecasting on simulated volume"))
+                del columns
+            elif options['data']:
+                try:
+                    df = pd.read_parquet(options['data'])
+                except ImportError as e:
+                    raise CommandError(f"Reading Parquet needs pyarrow (see requirements.txt): {str(e)}")
+            else:
+                df = create_sample_data(options['n_samples'], options['seed'])
+            self.stdout.write(f"[data] {len(df)} rows ready in {time.perf_counter() - started:.2f}s")
+            
+            if options['parquet']:
+                started = time.perf_counter()
+                try:
+                    df.to_parquet(options['parquet'], index=False)
+                except ImportError as e:
+                    raise CommandError(f"Writing Parquet needs pyarrow (see requirements.txt): {str(e)}")
+                self.stdout.write(f"[data] Wrote {options['parquet']} in {time.perf_counter() - started:.2f}s")
+            
+            # Each trainer only receives the columns it uses
+            jobs = [
+                ('delivery_time', train_delivery_time_model, df[DELIVERY_FEATURES + ['delivery_minutes']], threads),
+                ('anomaly_detection', train_anomaly_detection_model, df[ANOMALY_FEATURES], threads),
+                ('forecasting', train_forecasting_model, options['seed'], df_prophet),
+            ]
+            
+            started = time.perf_counter()
+            self.stdout.write(f"[train] Training {len(jobs)} models with {n_jobs} process(es), {threads} thread(s) each...")
+            if n_jobs == 1:
+                results = [run_trainer(*job) for job in jobs]
+            else:
+                with ProcessPoolExecutor(max_workers=min(n_jobs, len(jobs))) as pool:
+                    futures = [pool.submit(run_trainer, *job) for job in jobs]
+                    results = [future.result() for future in futures]
+            self.stdout.write(f"[train] All models trained in {time.perf_counter() - started:.2f}s")
+            
+            for name, model, summary, seconds in results:
+                self.stdout.write(f"[train] {name}: {summary} ({seconds:.2f}s)")
+            
+            # Publish all models as one version; serving workers pick it up once CURRENT points at it
+            started = time.perf_counter()
+            models = {MODEL_FILES[name]: model for name, model, _, _ in results}
+            # The delivery model also ships as a native booster that loads without pickle or sklearn
+            booster_text, booster_metadata = export_booster(models[MODEL_FILES['delivery_time']], DELIVERY_FEATURES, cities)
+            version = publish_version(
+                models,
+                metadata={
+                    'training': {
+                        'source': 'snapshot' if snapshot else 'parquet' if options['data'] else 'synthetic',
+                        'rows': len(df),
+                        'summaries': {name: summary for name, _, summary, _ in results},
+                    },
+                },
+                models_dir=options['output_dir'],
+                keep=options['keep'],
+                activate=not options['no_activate'],
+                text_files={
+                    DELIVERY_BOOSTER_FILE: booster_text,
+                    metadata_path(DELIVERY_BOOSTER_FILE): booster_metadata,
+                },
+            )
+            self.stdout.write(f"Models published to: {os.path.join(options['output_dir'], 'versions', version)}")
+            if options['no_activate']:
+                self.stdout.write(self.style.SUCCESS(f"✓ Model version {version} published (not activated)"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"✓ Model version {version} published and activated"))
+            self.stdout.write(f"[save] Models saved in {time.perf_counter() - started:.2f}s")
+            
+            self.stdout.write(self.style.SUCCESS(
+                f"\nAll models regenerated successfully in {time.perf_counter() - pipeline_started:.2f}s!"
+            ))
+            
+        except CommandError:
+            raise
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"Error regenerating models: {str(e)}"))
+        finally:
+            if scratch_dir is not None:
+                shutil.rmtree(scratch_dir, ignore_errors=True)
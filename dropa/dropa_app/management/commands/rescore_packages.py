@@ -0,0 +1,266 @@
+"""
+Management command to re-score packages with the current delivery time and anomaly models
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.db.models import Min, Max
+from django.utils import timezone
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import django
+import json
+import os
+import time
+import numpy as np
+from dropa_app.models import Package, Anomaly
+from dropa_app.model_registry import model_registry, model_path
+from dropa_app.ratings import recompute_courier_ratings
+from dropa_app.features import (
+    ANOMALY_THRESHOLD, MIN_PREDICTED_MINUTES, city_code, delivery_time_features, anomaly_features
+)
+
+# Only the columns scoring reads or writes are fetched
+SCORING_FIELDS = (
+    'id', 'order_id', 'from_city_name', 'delivery_user_id', 'poi_lng', 'poi_lat', 'sign_lng', 'sign_lat',
+    'receipt_time', 'sign_time', 'package_weight', 'predicted_delivery_time', 'anomaly_score', 'is_anomaly',
+)
+
+
+def _column(packages, attr):
+    """Float column for a model attribute, with NaN for missing values"""
+    values = (getattr(package, attr) for package in packages)
+    return np.fromiter((np.nan if v is None else v for v in values), dtype=np.float64, count=len(packages))
+
+
+def score_chunk(packages):
+    """
+    Score a chunk of packages as one matrix per model and write the results back in bulk
+
+    Returns:
+        tuple: (packages scored, new anomalies flagged)
+    """
+    delivery_model = model_registry.get(model_path('delivery_time_model.pkl'))
+    anomaly_model = model_registry.get(model_path('anomaly_detection_model.pkl'))
+    update_fields = []
+    new_anomalies = []
+
+    if delivery_model is not None:
+        features = delivery_time_features(
+            np.fromiter((city_code(p.from_city_name) for p in packages), dtype=np.float64, count=len(packages)),
+            np.fromiter((p.delivery_user_id or 0 for p in packages), dtype=np.float64, count=len(packages)),
+            _column(packages, 'poi_lng'),
+            _column(packages, 'poi_lat'),
+            _column(packages, 'sign_lng'),
+            _column(packages, 'sign_lat'),
+        )
+        predictions = np.maximum(MIN_PREDICTED_MINUTES, delivery_model.predict(features))
+        for package, prediction in zip(packages, predictions.tolist()):
+            package.predicted_delivery_time = prediction
+        update_fields.append('predicted_delivery_time')
+
+    if anomaly_model is not None:
+        minutes = np.fromiter(
+            ((p.sign_time - p.receipt_time).total_seconds() / 60 if p.receipt_time and p.sign_time else np.nan
+             for p in packages),
+            dtype=np.float64,
+            count=len(packages),
+        )
+        # Matches Package.detect_anomaly, which skips packages without an actual delivery time
+        rows = np.flatnonzero(np.isfinite(minutes) & (minutes != 0))
+        if rows.size:
+            scores = anomaly_model.decision_function(
+                anomaly_features(minutes[rows], package_weight=_column(packages, 'package_weight')[rows])
+            )
+            for row, score in zip(rows.tolist(), scores.tolist()):
+                package = packages[row]
+                was_anomaly = package.is_anomaly
+                package.anomaly_score = score
+                package.is_anomaly = score < ANOMALY_THRESHOLD
+                # Only newly flagged packages get an Anomaly row so re-runs do not duplicate them
+                if package.is_anomaly and not was_anomaly:
+                    new_anomalies.append(Anomaly(
+                        package=package,
+                        description=f"Anomalous delivery time: {minutes[row]:.1f} minutes (score: {score:.2f})"
+                    ))
+            update_fields.extend(['anomaly_score', 'is_anomaly'])
+
+    if update_fields:
+        with transaction.atomic():
+            Package.objects.bulk_update(packages, update_fields)
+            Anomaly.objects.bulk_create(new_anomalies)
+            if 'predicted_delivery_time' in update_fields:
+                # bulk_update skips the save signals that keep rating aggregates current
+                recompute_courier_ratings({p.delivery_user_id for p in packages if p.delivery_user_id})
+
+    return len(packages), len(new_anomalies)
+
+
+def score_range(start_pk, end_pk, chunk_size):
+    """
+    Score every package with start_pk < pk <= end_pk
+
+    Returns:
+        tuple: (end_pk, packages scored, new anomalies flagged)
+    """
+    queryset = (
+        Package.objects.filter(pk__gt=start_pk, pk__lte=end_pk)
+        .order_by('pk')
+        .only(*SCORING_FIELDS)
+    )
+
+    scored = flagged = 0
+    chunk = []
+    for package in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(package)
+        if len(chunk) >= chunk_size:
+            chunk_scored, chunk_flagged = score_chunk(chunk)
+            scored += chunk_scored
+            flagged += chunk_flagged
+            chunk = []
+
+    if chunk:
+        chunk_scored, chunk_flagged = score_chunk(chunk)
+        scored += chunk_scored
+        flagged += chunk_flagged
+
+    return end_pk, scored, flagged
+
+
+class Command(BaseCommand):
+    help = 'Re-score predicted_delivery_time and anomaly_score for all packages in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Packages scored and written per chunk (default: 2000)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of scoring processes (default: 1)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            type=str,
+            help='File recording the last fully scored primary key; an existing checkpoint is resumed',
+        )
+        parser.add_argument(
+            '--start-after',
+            type=int,
+            help='Only score packages with a primary key above this value (overrides --checkpoint)',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        workers = options['workers']
+        checkpoint_path = options['checkpoint']
+
+        if chunk_size < 1 or workers < 1:
+            raise CommandError('--chunk-size and --workers must be positive')
+
+        if (model_registry.get(model_path('delivery_time_model.pkl')) is None and
+                model_registry.get(model_path('anomaly_detection_model.pkl')) is None):
+            raise CommandError('No delivery time or anomaly detection model found. Run regenerate_models first.')
+
+        bounds = Package.objects.aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+        if bounds['max_pk'] is None:
+            self.stdout.write('No packages to score')
+            return
+
+        start_pk = options['start_after']
+        if start_pk is None and checkpoint_path:
+            start_pk = self.read_checkpoint(checkpoint_path)
+            if start_pk is not None:
+                self.stdout.write(f'Resuming after primary key {start_pk}')
+        if start_pk is None:
+            start_pk = bounds['min_pk'] - 1
+
+        ranges = [
+            (low, min(low + chunk_size, bounds['max_pk']))
+            for low in range(start_pk, bounds['max_pk'], chunk_size)
+        ]
+        if not ranges:
+            self.stdout.write('All packages already scored')
+            return
+
+        if workers > 1 and connection.vendor == 'sqlite':
+            # Concurrent writers only fail with "database is locked" on SQLite
+            self.stdout.write(self.style.WARNING('SQLite supports a single writer; using 1 worker'))
+            workers = 1
+
+        self.stdout.write(f'Scoring packages {start_pk + 1}..{bounds["max_pk"]} in {len(ranges)} chunks '
+                          f'with {workers} worker(s)')
+        self.started = time.perf_counter()
+        self.scored = self.flagged = 0
+
+        if workers == 1:
+            for low, high in ranges:
+                self.record(score_range(low, high, chunk_size), checkpoint_path)
+        else:
+            self.run_parallel(ranges, workers, chunk_size, checkpoint_path)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Scored {self.scored} packages, flagged {self.flagged} new anomalies '
+            f'in {time.perf_counter() - self.started:.1f}s'
+        ))
+
+    def run_parallel(self, ranges, workers, chunk_size, checkpoint_path):
+        """Score ranges in a process pool, checkpointing only below the lowest unfinished range"""
+        # Forked workers must not share the parent's database connection
+        connections.close_all()
+
+        done = {}
+        next_range = 0
+        pending = {}
+        queued = iter(enumerate(ranges))
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+            # Keep a bounded number of ranges in flight
+            for index, (low, high) in queued:
+                pending[pool.submit(score_range, low, high, chunk_size)] = index
+                if len(pending) >= workers * 2:
+                    break
+
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done[pending.pop(future)] = future.result()
+
+                while next_range in done:
+                    self.record(done.pop(next_range), checkpoint_path)
+                    next_range += 1
+
+                for index, (low, high) in queued:
+                    pending[pool.submit(score_range, low, high, chunk_size)] = index
+                    if len(pending) >= workers * 2:
+                        break
+
+    def record(self, result, checkpoint_path):
+        """Accumulate a finished range and advance the checkpoint"""
+        end_pk, scored, flagged = result
+        self.scored += scored
+        self.flagged += flagged
+
+        if checkpoint_path:
+            self.write_checkpoint(checkpoint_path, end_pk)
+
+        elapsed = time.perf_counter() - self.started
+        rate = self.scored / elapsed if elapsed > 0 else 0
+        self.stdout.write(f'Scored {self.scored} packages up to pk {end_pk} ({rate:.0f} rows/sec)')
+
+    def read_checkpoint(self, path):
+        """Read the last fully scored primary key, if a checkpoint exists"""
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)['last_pk']
+
+    def write_checkpoint(self, path, last_pk):
+        """Atomically replace the checkpoint file"""
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'last_pk': last_pk, 'updated_at': timezone.now().isoformat()}, f)
+        os.replace(tmp_path, path)
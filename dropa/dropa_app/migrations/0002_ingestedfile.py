@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dropa_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=512, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('modified_at', models.DateTimeField(help_text='File modification time when it was ingested')),
+                ('rows', models.IntegerField(default=0)),
+                ('packages_created', models.IntegerField(default=0)),
+                ('ingested_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-ingested_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:31
+
+from django.db import migrations, models
+
+# Frozen copy of ratings.performance_score as of this migration; later scoring changes must not alter it
+DEFAULT_DELIVERY_MINUTES = 60
+
+
+def performance_score(predicted_minutes, actual_minutes):
+    predicted_minutes = predicted_minutes or DEFAULT_DELIVERY_MINUTES
+    actual_minutes = actual_minutes or DEFAULT_DELIVERY_MINUTES
+    return min(5.0, max(1.0, 5.0 - abs(actual_minutes - predicted_minutes) / 30))
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    """Seed the running aggregates from packages delivered before they existed"""
+    User = apps.get_model('dropa_app', 'User')
+    Package = apps.get_model('dropa_app', 'Package')
+
+    totals = {}
+    deliveries = Package.objects.filter(status='delivered', delivery_user__role='courier').values_list(
+        'delivery_user_id', 'predicted_delivery_time', 'receipt_time', 'sign_time'
+    )
+    for courier_id, predicted, receipt_time, sign_time in deliveries.iterator():
+        actual = (sign_time - receipt_time).total_seconds() / 60 if receipt_time and sign_time else None
+        score_sum, count = totals.get(courier_id, (0.0, 0))
+        totals[courier_id] = (score_sum + performance_score(predicted, actual), count + 1)
+
+    for courier_id, (score_sum, count) in totals.items():
+        User.objects.filter(pk=courier_id).update(rating_score_sum=score_sum, rating_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dropa_app', '0002_ingestedfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='rating_count',
+            field=models.IntegerField(default=0, help_text='Number of deliveries in rating_score_sum'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='rating_score_sum',
+            field=models.FloatField(default=0, help_text='Sum of per-delivery performance scores'),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
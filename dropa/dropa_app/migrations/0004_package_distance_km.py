@@ -0,0 +1,58 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:32
+
+from django.db import migrations, models
+import numpy as np
+
+BACKFILL_CHUNK_SIZE = 5000
+
+# Frozen copy of geo.package_distance_km as of this migration; later changes to geo.py must not alter it
+EARTH_RADIUS_KM = 6371.0
+
+
+def package_distance_km(poi_lat, poi_lng, sign_lat, sign_lng):
+    coordinates = [np.asarray(v, dtype=np.float64) for v in (poi_lat, poi_lng, sign_lat, sign_lng)]
+    unknown = np.zeros(np.broadcast(*coordinates).shape, dtype=bool)
+    for values in coordinates:
+        unknown |= np.isnan(values) | (values == 0)
+
+    lat1, lng1, lat2, lng2 = (np.radians(values) for values in coordinates)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return np.where(unknown, np.nan, 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0))))
+
+
+def backfill_distance_km(apps, schema_editor):
+    """Fill distance_km for existing packages in primary key chunks"""
+    Package = apps.get_model('dropa_app', 'Package')
+
+    last_pk = 0
+    while True:
+        rows = list(
+            Package.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'poi_lat', 'poi_lng', 'sign_lat', 'sign_lng')[:BACKFILL_CHUNK_SIZE]
+        )
+        if not rows:
+            break
+
+        pks, poi_lat, poi_lng, sign_lat, sign_lng = zip(*rows)
+        distances = package_distance_km(poi_lat, poi_lng, sign_lat, sign_lng).tolist()
+        Package.objects.bulk_update(
+            [Package(pk=pk, distance_km=None if d != d else d) for pk, d in zip(pks, distances)],
+            ['distance_km'],
+        )
+        last_pk = pks[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dropa_app', '0003_user_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='package',
+            name='distance_km',
+            field=models.FloatField(blank=True, db_index=True, editable=False, help_text='Pickup to delivery haversine distance in kilometers', null=True),
+        ),
+        migrations.RunPython(backfill_distance_km, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:34
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dropa_app', '0004_package_distance_km'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='courierlog',
+            name='log_time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
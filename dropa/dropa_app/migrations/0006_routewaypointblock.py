@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dropa_app', '0005_courierlog_log_time_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteWaypointBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('point_count', models.IntegerField()),
+                ('points', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waypoint_blocks', to='dropa_app.deliveryroute')),
+            ],
+            options={
+                'ordering': ['route', 'id'],
+            },
+        ),
+    ]
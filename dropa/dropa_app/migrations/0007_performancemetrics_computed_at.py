@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dropa_app', '0006_routewaypointblock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='performancemetrics',
+            name='computed_at',
+            field=models.DateTimeField(blank=True, help_text='When the rollup last computed this row', null=True),
+        ),
+    ]
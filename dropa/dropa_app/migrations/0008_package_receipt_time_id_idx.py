@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dropa_app', '0007_performancemetrics_computed_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['-receipt_time', '-id'], name='package_receipt_time_id_idx'),
+        ),
+    ]
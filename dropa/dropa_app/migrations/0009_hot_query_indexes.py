@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dropa_app', '0008_package_receipt_time_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='courierlog',
+            index=models.Index(fields=['courier', '-log_time'], name='courierlog_courier_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='otplog',
+            index=models.Index(fields=['package', 'otp_code'], name='otplog_package_code_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['status', '-receipt_time', '-id'], name='package_status_receipt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['status', 'sign_time'], name='package_status_sign_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['status', '-created_at'], name='package_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['created_at'], name='package_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['delivery_user', 'status'], name='package_courier_status_idx'),
+        ),
+    ]
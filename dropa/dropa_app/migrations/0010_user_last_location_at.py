@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dropa_app', '0009_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='last_location_at',
+            field=models.DateTimeField(blank=True, help_text='Recording time of the ping last_location_lat/lng came from', null=True),
+        ),
+    ]
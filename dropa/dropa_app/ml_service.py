@@ -4,76 +4,186 @@ Integrates trained ML models for delivery predictions, anomaly detection, and fo
 """
 
 import os
-import pickle
-import pandas as pd
-import numpy as np
+import threading
+from collections import namedtuple
 from datetime import datetime, timedelta
 from django.conf import settings
-import joblib
-from prophet import Prophet
 import logging
+from .model_registry import model_registry, current_version, flat_signature, model_path
+from .native_models import DELIVERY_BOOSTER_FILE
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on packages scored per batch request
+MAX_BATCH_SIZE = 10000
+
+# Days of demand forecast computed per model version per day and sliced per request
+FORECAST_HORIZON_DAYS = 365
+
+# Model name -> file in the ML models directory
+MODEL_FILES = {
+    'delivery_time': 'delivery_time_model.pkl',
+    'anomaly_detection': 'anomaly_detection_model.pkl',
+    'forecasting': 'prophet_forecasting_model.pkl',
+}
+
+# Native exports loaded in preference to the pickled model when a version includes them
+NATIVE_MODEL_FILES = {
+    'delivery_time': DELIVERY_BOOSTER_FILE,
+}
+
+# Default coordinates for major Tanzanian cities, the origins and destinations the API can place
+CITY_COORDS = {
+    'Dar es Salaam': {'lat': -6.7924, 'lng': 39.2083},
+    'Arusha': {'lat': -3.3869, 'lng': 36.6830},
+    'Mwanza': {'lat': -2.5164, 'lng': 32.9175},
+    'Dodoma': {'lat': -6.1630, 'lng': 35.7516},
+    'Mbeya': {'lat': -8.9094, 'lng': 33.4607}
+}
+
+# A loaded model set; signature is the published version, or the flat file stats without one
+ModelSet = namedtuple('ModelSet', ['signature', 'models'])
+
 class MLService:
     """Service class to handle ML model operations"""
     
     def __init__(self):
         self.ml_models_path = os.path.join(settings.BASE_DIR, '../ml/src/')
         self.data_path = os.path.join(settings.BASE_DIR, '../data/')
-        self.models = {}
-        self.load_models()
+        self._model_set = None
+        # Signature of the last set that failed to load, so requests do not retry it every time
+        self._rejected_signature = None
+        self._load_lock = threading.Lock()
+        self._forecast_cache = None
+        self._forecast_lock = threading.Lock()
+        self._watcher = None
+        self._watcher_stop = threading.Event()
+        self._batchers = {}
+        self._batchers_lock = threading.Lock()
+    
+    @property
+    def models(self):
+        """Trained models, loaded on first use so importing this module stays cheap"""
+        return self._get_model_set().models
+    
+    @property
+    def model_version(self):
+        """Published version of the models in use, or None for flat model files"""
+        signature = self._get_model_set().signature
+        return signature if isinstance(signature, str) else None
+    
+    def _get_model_set(self):
+        # Read once: a reload may swap in a new set at any time
+        model_set = self._model_set
+        if model_set is None:
+            with self._load_lock:
+                if self._model_set is None:
+                    self.load_models()
+                model_set = self._model_set
+        elif model_set.signature != self._artifact_signature():
+            # One CURRENT read or a few stats, so every request serves the published set
+            # like Package.predict_delivery_time does, with or without the watcher
+            self.reload_if_changed()
+            model_set = self._model_set
+        return model_set
+    
+    def _artifact_signature(self):
+        filenames = list(MODEL_FILES.values()) + list(NATIVE_MODEL_FILES.values())
+        return current_version(self.ml_models_path) or flat_signature(filenames, self.ml_models_path)
     
     def load_models(self):
-        """Load all trained ML models"""
-        try:
-            # Load delivery time prediction model
-            delivery_model_path = os.path.join(self.ml_models_path, 'delivery_time_model.pkl')
-            if os.path.exists(delivery_model_path):
-                try:
-                    with open(delivery_model_path, 'rb') as f:
-                        self.models['delivery_time'] = pickle.load(f)
-                    logger.info("Delivery time model loaded successfully")
-                except Exception as e:
-                    logger.error(f"Error loading delivery time model: {str(e)}")
-                    # Try with joblib
-                    try:
-                        self.models['delivery_time'] = joblib.load(delivery_model_path)
-                        logger.info("Delivery time model loaded successfully with joblib")
-                    except Exception as e2:
-                        logger.error(f"Error loading delivery time model with joblib: {str(e2)}")
-            
-            # Load anomaly detection model
-            anomaly_model_path = os.path.join(self.ml_models_path, 'anomaly_detection_model.pkl')
-            if os.path.exists(anomaly_model_path):
-                try:
-                    self.models['anomaly_detection'] = joblib.load(anomaly_model_path)
-                    logger.info("Anomaly detection model loaded successfully with joblib")
-                except Exception as e:
-                    logger.error(f"Error loading anomaly detection model with joblib: {str(e)}")
-                    try:
-                        with open(anomaly_model_path, 'rb') as f:
-                            self.models['anomaly_detection'] = pickle.load(f)
-                        logger.info("Anomaly detection model loaded successfully with pickle")
-                    except Exception as e2:
-                        logger.error(f"Error loading anomaly detection model with pickle: {str(e2)}")
-            
-            # Load Prophet forecasting model
-            forecasting_model_path = os.path.join(self.ml_models_path, 'prophet_forecasting_model.pkl')
-            if os.path.exists(forecasting_model_path):
+        """
+        Load the current model set through the shared model registry and swap it in
+        
+        Every model comes from the same published version. On a reload the new set, and
+        today's forecast for it, are built before the swap, so requests keep using the
+        old set until the new one is ready.
+        """
+        signature = self._artifact_signature()
+        version = signature if isinstance(signature, str) else None
+        
+        models = {}
+        for name, filename in MODEL_FILES.items():
+            for candidate in filter(None, (NATIVE_MODEL_FILES.get(name), filename)):
+                path = model_path(candidate, version, self.ml_models_path)
                 try:
-                    self.models['forecasting'] = joblib.load(forecasting_model_path)
-                    logger.info("Forecasting model loaded successfully with joblib")
+                    model = model_registry.get(path)
+                    if model is not None:
+                        models[name] = model
+                        logger.info(f"{candidate} loaded successfully")
+                        break
                 except Exception as e:
-                    logger.error(f"Error loading forecasting model with joblib: {str(e)}")
-                    try:
-                        self.models['forecasting'] = joblib.load(forecasting_model_path)
-                        logger.info("Forecasting model loaded successfully with joblib")
-                    except Exception as e2:
-                        logger.error(f"Error loading forecasting model with joblib: {str(e2)}")
-                
-        except Exception as e:
-            logger.error(f"Error loading ML models: {str(e)}")
+                    logger.error(f"Error loading {candidate}: {str(e)}")
+        
+        previous = self._model_set
+        if previous is not None and not set(previous.models) <= set(models):
+            logger.error(f"Model set {signature} is missing models, keeping the loaded set")
+            self._rejected_signature = signature
+            return False
+        
+        forecast = None
+        if previous is not None and 'forecasting' in models:
+            forecast = self._build_forecast(models['forecasting'], (signature, datetime.now().date()), FORECAST_HORIZON_DAYS)
+        
+        with self._forecast_lock:
+            self._model_set = ModelSet(signature, models)
+            if forecast is not None:
+                self._forecast_cache = forecast
+        if previous is not None:
+            logger.info(f"Model set swapped to {signature}")
+        return True
+    
+    def reload_if_changed(self):
+        """
+        Load and swap in the model set if a different one was published
+        
+        Returns:
+            bool: Whether a new model set was swapped in
+        """
+        signature = self._artifact_signature()
+        model_set = self._model_set
+        if model_set is not None and signature in (model_set.signature, self._rejected_signature):
+            return False
+        with self._load_lock:
+            signature = self._artifact_signature()
+            if self._model_set is not None and signature in (self._model_set.signature, self._rejected_signature):
+                return False
+            return self.load_models()
+    
+    def start_watcher(self, interval=None):
+        """
+        Poll the model artifacts in a background thread and hot-swap newly published models
+        
+        Args:
+            interval (float): Seconds between polls (default: settings.ML_MODEL_WATCH_SECONDS)
+        """
+        if self._watcher is not None:
+            return
+        interval = interval or getattr(settings, 'ML_MODEL_WATCH_SECONDS', 0) or 30
+        self._watcher_stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name='ml-model-watcher', daemon=True)
+        self._watcher.start()
+    
+    def stop_watcher(self):
+        """Stop the background model watcher"""
+        if self._watcher is not None:
+            self._watcher_stop.set()
+            self._watcher.join()
+            self._watcher = None
+    
+    def _watch(self, interval):
+        while not self._watcher_stop.wait(interval):
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                logger.error(f"Error reloading ML models: {str(e)}")
+    
+    def warm_up(self):
+        """Load models and their heavy dependencies ahead of the first request"""
+        models = self.models
+        # Also builds today's forecast cache, importing pandas and Prophet on the way
+        self._get_forecast(FORECAST_HORIZON_DAYS)
+        logger.info(f"ML service warmed up with models: {', '.join(models) or 'none'}")
     
     def predict_delivery_time(self, distance_km=None, package_weight=None, from_city=None, to_city=None, vehicle_type=None):
         """
@@ -93,16 +203,14 @@ class MLService:
             if 'delivery_time' not in self.models:
                 return {'error': 'Delivery time model not loaded'}
             
-            model = self.models['delivery_time']
-            
             # Prepare input features based on the actual model training
             # The model expects: ['from_city_name', 'delivery_user_id', 'poi_lng', 'poi_lat', 'receipt_lng', 'receipt_lat', 'sign_lng', 'sign_lat']
             features = self._prepare_delivery_features_v2(
-                from_city, to_city, distance_km
+                from_city, to_city, distance_km, getattr(self.models['delivery_time'], 'city_encoding', None)
             )
             
             # Make prediction (result is in minutes)
-            predicted_minutes = model.predict([features])[0]
+            predicted_minutes = self._predict_row('delivery_time', features)
             predicted_hours = predicted_minutes / 60
             
             # Calculate estimated delivery time
@@ -119,6 +227,88 @@ class MLService:
             logger.error(f"Error predicting delivery time: {str(e)}")
             return {'error': str(e)}
     
+    def predict_delivery_time_batch(self, packages):
+        """
+        Predict delivery times for many packages with a single model call
+        
+        Args:
+            packages (list): Package dicts accepting the same keys as predict_delivery_time
+            
+        Returns:
+            dict: Per-row results in input order, each with either a prediction or an error
+        """
+        try:
+            import numpy as np
+            
+            if 'delivery_time' not in self.models:
+                return {'error': 'Delivery time model not loaded'}
+            
+            if not isinstance(packages, (list, tuple)):
+                return {'error': 'packages must be a list'}
+            
+            if len(packages) > MAX_BATCH_SIZE:
+                return {'error': f'Batch too large: {len(packages)} packages (max {MAX_BATCH_SIZE})'}
+            
+            model = self.models['delivery_time']
+            # Native boosters record the city codes they were trained with
+            city_encoding = getattr(model, 'city_encoding', None)
+            results = [None] * len(packages)
+            
+            # Validate rows individually so one bad entry does not fail the whole batch
+            valid_rows = []
+            feature_rows = []
+            for index, package in enumerate(packages):
+                if not isinstance(package, dict):
+                    results[index] = {'index': index, 'error': 'Package entry must be an object'}
+                    continue
+                
+                from_city = package.get('from_city')
+                to_city = package.get('to_city')
+                if any(city is not None and not isinstance(city, str) for city in (from_city, to_city)):
+                    results[index] = {'index': index, 'error': 'from_city and to_city must be strings'}
+                    continue
+                
+                feature_rows.append(self._prepare_delivery_features_v2(
+                    from_city, to_city, package.get('distance_km'), city_encoding
+                ))
+                valid_rows.append(index)
+            
+            if valid_rows:
+                # One (n, 8) matrix and a single predict call for the whole batch
+                features = np.asarray(feature_rows, dtype=np.float64)
+                predicted_minutes = np.asarray(model.predict(features), dtype=np.float64)
+                predicted_hours = predicted_minutes / 60
+                rounded_minutes = np.round(predicted_minutes, 2)
+                rounded_hours = np.round(predicted_hours, 2)
+                finite = np.isfinite(predicted_minutes)
+                now = datetime.now()
+                
+                for row, index in enumerate(valid_rows):
+                    if not finite[row]:
+                        results[index] = {'index': index, 'error': 'Model returned a non-finite prediction'}
+                        continue
+                    
+                    results[index] = {
+                        'index': index,
+                        'predicted_hours': float(rounded_hours[row]),
+                        'predicted_minutes': float(rounded_minutes[row]),
+                        'estimated_delivery': (now + timedelta(hours=float(predicted_hours[row]))).isoformat(),
+                        'confidence': 'high' if predicted_minutes[row] > 0 else 'low'
+                    }
+            
+            error_count = sum(1 for result in results if 'error' in result)
+            
+            return {
+                'predictions': results,
+                'count': len(results),
+                'succeeded': len(results) - error_count,
+                'failed': error_count
+            }
+            
+        except Exception as e:
+            logger.error(f"Error predicting delivery time batch: {str(e)}")
+            return {'error': str(e)}
+    
     def detect_anomalies(self, delivery_data):
         """
         Detect anomalies in delivery data
@@ -133,14 +323,11 @@ class MLService:
             if 'anomaly_detection' not in self.models:
                 return {'error': 'Anomaly detection model not loaded'}
             
-            model = self.models['anomaly_detection']
-            
             # Prepare features for anomaly detection
             features = self._prepare_anomaly_features(delivery_data)
             
             # Detect anomalies (-1 for anomaly, 1 for normal)
-            prediction = model.predict([features])[0]
-            anomaly_score = model.decision_function([features])[0]
+            prediction, anomaly_score = self._predict_row('anomaly_detection', features)
             
             is_anomaly = prediction == -1
             
@@ -155,49 +342,108 @@ class MLService:
             logger.error(f"Error detecting anomalies: {str(e)}")
             return {'error': str(e)}
     
-    def forecast_demand(self, days_ahead=30):
+    def _score(self, name, X):
+        """Score feature rows with the current model; anomaly rows get (prediction, score) pairs"""
+        model = self.models[name]
+        if name == 'anomaly_detection':
+            return list(zip(model.predict(X), model.decision_function(X)))
+        return model.predict(X)
+    
+    def _predict_row(self, name, features):
+        """Score one feature row, through the model's micro-batcher when batching is enabled"""
+        batcher = self._get_batcher(name)
+        if batcher is not None:
+            return batcher.predict(features)
+        return self._score(name, [features])[0]
+    
+    def _get_batcher(self, name):
+        if not getattr(settings, 'ML_MICRO_BATCHING', False):
+            return None
+        batcher = self._batchers.get(name)
+        if batcher is None:
+            with self._batchers_lock:
+                batcher = self._batchers.get(name)
+                if batcher is None:
+                    from .batching import MicroBatcher
+                    
+                    # Each batch scores with whichever model set is current when it runs
+                    batcher = MicroBatcher(
+                        lambda X, name=name: self._score(name, X),
+                        window_ms=getattr(settings, 'ML_BATCH_WINDOW_MS', 2.0),
+                        max_batch=getattr(settings, 'ML_BATCH_MAX_SIZE', 64),
+                        name=name,
+                    )
+                    self._batchers[name] = batcher
+        return batcher
+    
+    def batching_stats(self, reset=False):
+        """
+        Micro-batching metrics of this process
+        
+        Args:
+            reset (bool): Zero the counters after reading them
+            
+        Returns:
+            dict: Whether batching is enabled plus queue depth and batch size stats per model
+        """
+        return {
+            'enabled': getattr(settings, 'ML_MICRO_BATCHING', False),
+            'pid': os.getpid(),
+            'models': {name: batcher.stats(reset) for name, batcher in list(self._batchers.items())},
+        }
+    
+    def forecast_demand(self, days_ahead=30, columnar=False):
         """
         Forecast delivery demand using Prophet model
         
         Args:
             days_ahead (int): Number of days to forecast
+            columnar (bool): Return parallel per-field arrays instead of one object per day
             
         Returns:
             dict: Forecasting results
         """
         try:
-            if 'forecasting' not in self.models:
-                return {'error': 'Forecasting model not loaded'}
-            
-            model = self.models['forecasting']
+            if days_ahead < 1:
+                return {'error': 'days_ahead must be at least 1'}
             
-            # Create future dates
-            future_dates = pd.date_range(
-                start=datetime.now().date(),
-                periods=days_ahead,
-                freq='D'
-            )
-            
-            future_df = pd.DataFrame({'ds': future_dates})
+            forecast = self._get_forecast(days_ahead)
+            if forecast is None:
+                return {'error': 'Forecasting model not loaded'}
             
-            # Make forecast
-            forecast = model.predict(future_df)
+            # Every column is pre-formatted in the cache, so a request only slices lists
+            dates = forecast['dates'][:days_ahead]
+            predicted_demand = forecast['predicted_demand'][:days_ahead]
+            lower_bound = forecast['lower_bound'][:days_ahead]
+            upper_bound = forecast['upper_bound'][:days_ahead]
+            total_predicted_volume = forecast['cumulative_demand'][days_ahead - 1]
             
-            # Format results
-            forecast_data = []
-            for i, row in forecast.iterrows():
-                forecast_data.append({
-                    'date': row['ds'].strftime('%Y-%m-%d'),
-                    'predicted_demand': max(0, round(row['yhat'])),
-                    'lower_bound': max(0, round(row['yhat_lower'])),
-                    'upper_bound': max(0, round(row['yhat_upper'])),
-                    'confidence_interval': f"{round(row['yhat_lower'])}-{round(row['yhat_upper'])}"
-                })
+            if columnar:
+                forecast_data = {
+                    'date': dates,
+                    'predicted_demand': predicted_demand,
+                    'lower_bound': lower_bound,
+                    'upper_bound': upper_bound,
+                }
+            else:
+                forecast_data = [
+                    {
+                        'date': date,
+                        'predicted_demand': demand,
+                        'lower_bound': lower,
+                        'upper_bound': upper,
+                        'confidence_interval': interval
+                    }
+                    for date, demand, lower, upper, interval in zip(
+                        dates, predicted_demand, lower_bound, upper_bound,
+                        forecast['confidence_interval'][:days_ahead]
+                    )
+                ]
             
             return {
                 'forecast': forecast_data,
-                'total_predicted_volume': sum([d['predicted_demand'] for d in forecast_data]),
-                'average_daily_demand': round(sum([d['predicted_demand'] for d in forecast_data]) / days_ahead),
+                'total_predicted_volume': total_predicted_volume,
+                'average_daily_demand': round(total_predicted_volume / days_ahead),
                 'forecast_period': f"{days_ahead} days"
             }
             
@@ -205,6 +451,61 @@ class MLService:
             logger.error(f"Error forecasting demand: {str(e)}")
             return {'error': str(e)}
     
+    def _get_forecast(self, days_ahead):
+        """
+        Get the cached forecast covering at least days_ahead days from today
+        
+        Prophet is run once per model set per day for the longest horizon and
+        every request is served as a slice of the resulting columns.
+        
+        Returns:
+            dict: Formatted per-day columns plus cumulative demand, or None without a model
+        """
+        model_set = self._get_model_set()
+        model = model_set.models.get('forecasting')
+        if model is None:
+            return None
+        
+        key = (model_set.signature, datetime.now().date())
+        cached = self._forecast_cache
+        if cached is not None and cached['key'] == key and len(cached['dates']) >= days_ahead:
+            return cached
+        
+        with self._forecast_lock:
+            cached = self._forecast_cache
+            if cached is not None and cached['key'] == key and len(cached['dates']) >= days_ahead:
+                return cached
+            
+            cached = self._build_forecast(model, key, max(FORECAST_HORIZON_DAYS, days_ahead))
+            self._forecast_cache = cached
+            return cached
+    
+    def _build_forecast(self, model, key, horizon):
+        """Run Prophet for horizon days from key's date and format the columns the cache holds"""
+        import numpy as np
+        import pandas as pd
+        
+        future_df = pd.DataFrame({'ds': pd.date_range(start=key[1], periods=horizon, freq='D')})
+        forecast = model.predict(future_df)
+        
+        # np.rint rounds half to even like round(), so values match the old per-row formatting
+        yhat = np.rint(forecast['yhat'].to_numpy()).astype(np.int64)
+        yhat_lower = np.rint(forecast['yhat_lower'].to_numpy()).astype(np.int64)
+        yhat_upper = np.rint(forecast['yhat_upper'].to_numpy()).astype(np.int64)
+        predicted_demand = np.maximum(yhat, 0)
+        
+        logger.info(f"Forecast cache rebuilt for {key[1]} ({horizon} days)")
+        return {
+            'key': key,
+            'dates': forecast['ds'].dt.strftime('%Y-%m-%d').tolist(),
+            'predicted_demand': predicted_demand.tolist(),
+            'lower_bound': np.maximum(yhat_lower, 0).tolist(),
+            'upper_bound': np.maximum(yhat_upper, 0).tolist(),
+            'confidence_interval': [f"{lower}-{upper}" for lower, upper in zip(yhat_lower.tolist(), yhat_upper.tolist())],
+            # Prefix sums give the total for any horizon without another pass
+            'cumulative_demand': np.cumsum(predicted_demand).tolist(),
+        }
+    
     def get_delivery_insights(self, package_data):
         """
         Get comprehensive delivery insights combining all models
@@ -264,32 +565,17 @@ class MLService:
         ]
         return features
     
-    def _prepare_delivery_features_v2(self, from_city, to_city, distance_km):
+    def _prepare_delivery_features_v2(self, from_city, to_city, distance_km, city_encoding=None):
         """Prepare features matching the actual trained model"""
-        # City name encoding (simplified - in production use the same LabelEncoder)
-        city_encoding = {
-            'Dar es Salaam': 0,
-            'Arusha': 1, 
-            'Mwanza': 2,
-            'Dodoma': 3,
-            'Mbeya': 4
-        }
-        
-        # Default coordinates for major Tanzanian cities
-        city_coords = {
-            'Dar es Salaam': {'lat': -6.7924, 'lng': 39.2083},
-            'Arusha': {'lat': -3.3869, 'lng': 36.6830},
-            'Mwanza': {'lat': -2.5164, 'lng': 32.9175},
-            'Dodoma': {'lat': -6.1630, 'lng': 35.7516},
-            'Mbeya': {'lat': -8.9094, 'lng': 33.4607}
-        }
+        from .features import encode_city
         
-        from_city_encoded = city_encoding.get(from_city, 0)
+        # Same encoding the delivery time model was trained with
+        from_city_encoded = encode_city(from_city if from_city in CITY_COORDS else 'Dar es Salaam', city_encoding)
         delivery_user_id = 1  # Default courier ID
         
         # Get coordinates
-        from_coords = city_coords.get(from_city, city_coords['Dar es Salaam'])
-        to_coords = city_coords.get(to_city, city_coords['Arusha'])
+        from_coords = CITY_COORDS.get(from_city, CITY_COORDS['Dar es Salaam'])
+        to_coords = CITY_COORDS.get(to_city, CITY_COORDS['Arusha'])
         
         # Features: ['from_city_name', 'delivery_user_id', 'poi_lng', 'poi_lat', 'receipt_lng', 'receipt_lat', 'sign_lng', 'sign_lat']
         features = [
@@ -0,0 +1,249 @@
+"""
+Process-wide ML model registry
+Deserializes each model file once per process and reloads it only when the file changes on disk
+
+Trained model sets are published as immutable version directories under versions/, each with a
+manifest.json, and the CURRENT file names the version in use. Publishing writes the whole version
+before CURRENT is switched with an atomic rename, so readers never see a half-written model set.
+Without a CURRENT file, models are read flat from the ML models directory.
+"""
+
+import os
+import json
+import shutil
+import pickle
+import hashlib
+import threading
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Shared directory of trained models used by both the Django app and the ML pipeline
+ML_MODELS_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), '../../ml/src'))
+
+
+VERSIONS_DIR = 'versions'
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+
+# Published versions kept on disk, the current one included
+KEEP_VERSIONS = 5
+
+
+def current_version(models_dir=ML_MODELS_DIR):
+    """Model set version named by the CURRENT file, or None when models are stored flat"""
+    try:
+        with open(os.path.join(models_dir, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def version_dir(version, models_dir=ML_MODELS_DIR):
+    """Directory holding a published model set version"""
+    return os.path.join(models_dir, VERSIONS_DIR, version)
+
+
+def model_path(filename, version=None, models_dir=ML_MODELS_DIR):
+    """
+    Absolute path of a model file
+
+    Args:
+        filename (str): Model file name
+        version (str): Published version; defaults to the current one
+        models_dir (str): ML models directory
+
+    Returns:
+        str: Path inside the version directory, or inside models_dir when models are stored flat
+    """
+    version = version or current_version(models_dir)
+    if version:
+        return os.path.join(version_dir(version, models_dir), filename)
+    return os.path.join(models_dir, filename)
+
+
+def flat_signature(filenames, models_dir=ML_MODELS_DIR):
+    """(mtime_ns, size) of each flat model file, to notice files replaced in place"""
+    signature = []
+    for filename in filenames:
+        try:
+            stat = os.stat(os.path.join(models_dir, filename))
+            signature.append((filename, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append((filename, None, None))
+    return tuple(signature)
+
+
+def read_manifest(version, models_dir=ML_MODELS_DIR):
+    """Manifest of a published version"""
+    with open(os.path.join(version_dir(version, models_dir), MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def list_versions(models_dir=ML_MODELS_DIR):
+    """Published versions, oldest first"""
+    try:
+        names = os.listdir(os.path.join(models_dir, VERSIONS_DIR))
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if not name.startswith('.'))
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def activate_version(version, models_dir=ML_MODELS_DIR):
+    """Point CURRENT at a published version with an atomic rename"""
+    if not os.path.isfile(os.path.join(version_dir(version, models_dir), MANIFEST_FILE)):
+        raise ValueError(f"Model version {version} is not published")
+
+    pointer = os.path.join(models_dir, CURRENT_FILE)
+    staging = f'{pointer}.tmp-{os.getpid()}'
+    with open(staging, 'w') as f:
+        f.write(version + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(staging, pointer)
+    logger.info(f"Model version {version} activated")
+
+
+def publish_version(models, metadata=None, models_dir=ML_MODELS_DIR, keep=KEEP_VERSIONS, activate=True, text_files=None):
+    """
+    Publish a model set as a new immutable version
+
+    Args:
+        models (dict): Model file name -> model object
+        metadata (dict): Extra fields recorded in the manifest, e.g. training summaries
+        models_dir (str): ML models directory
+        keep (int): Published versions to keep; older ones are deleted
+        activate (bool): Point CURRENT at the new version
+        text_files (dict): File name -> text content published as is, e.g. native model exports
+
+    Returns:
+        str: The new version
+    """
+    import joblib
+
+    created_at = datetime.now(timezone.utc)
+    version = f"{created_at:%Y%m%dT%H%M%S}-{os.urandom(3).hex()}"
+    staging = os.path.join(models_dir, VERSIONS_DIR, f'.staging-{version}')
+    os.makedirs(staging)
+
+    try:
+        files = {}
+        for filename, model in models.items():
+            path = os.path.join(staging, filename)
+            joblib.dump(model, path)
+            files[filename] = {'sha256': _sha256(path), 'size': os.path.getsize(path)}
+        for filename, text in (text_files or {}).items():
+            path = os.path.join(staging, filename)
+            with open(path, 'w') as f:
+                f.write(text)
+            files[filename] = {'sha256': _sha256(path), 'size': os.path.getsize(path)}
+
+        with open(os.path.join(staging, MANIFEST_FILE), 'w') as f:
+            json.dump({
+                'version': version,
+                'created_at': created_at.isoformat(),
+                'files': files,
+                **(metadata or {}),
+            }, f, indent=2)
+        os.replace(staging, version_dir(version, models_dir))
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    if activate:
+        activate_version(version, models_dir)
+    prune_versions(keep, models_dir)
+    return version
+
+
+def prune_versions(keep=KEEP_VERSIONS, models_dir=ML_MODELS_DIR):
+    """Delete the oldest published versions beyond keep, never the current one"""
+    current = current_version(models_dir)
+    stale = [version for version in list_versions(models_dir) if version != current]
+    for version in stale[:max(len(stale) - max(keep - 1, 0), 0)]:
+        shutil.rmtree(version_dir(version, models_dir), ignore_errors=True)
+        logger.info(f"Model version {version} pruned")
+
+
+class ModelRegistry:
+    """Lazily populated model cache keyed by file path and modification time"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """
+        Get the model stored at a path, loading it on first use or after the file changed
+
+        Args:
+            path (str): Path to a joblib or pickle model file
+
+        Returns:
+            object: The deserialized model, or None if the file does not exist
+        """
+        key = os.path.realpath(path)
+        try:
+            stat = os.stat(key)
+        except FileNotFoundError:
+            return None
+
+        version = (stat.st_mtime_ns, stat.st_size)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        with self._lock:
+            # Another thread may have loaded it while we waited for the lock
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+
+            model = self._load(key)
+            # Drop superseded copies of the same model from other version directories
+            filename = os.path.basename(key)
+            for other in [other for other in self._entries if os.path.basename(other) == filename]:
+                del self._entries[other]
+            self._entries[key] = (version, model)
+            logger.info(f"Loaded model {os.path.basename(key)}")
+            return model
+
+    def version(self, path):
+        """Get the (mtime_ns, size) version of the cached model at a path, if loaded"""
+        entry = self._entries.get(os.path.realpath(path))
+        return entry[0] if entry is not None else None
+
+    def clear(self):
+        """Drop every cached model"""
+        with self._lock:
+            self._entries.clear()
+
+    def _load(self, path):
+        """Deserialize a model file, trying joblib first and plain pickle second"""
+        from .native_models import BOOSTER_SUFFIX, load_booster
+
+        if path.endswith(BOOSTER_SUFFIX):
+            return load_booster(path)
+
+        # joblib pulls in numpy, so it is only imported once a model is actually needed
+        import joblib
+
+        try:
+            return joblib.load(path)
+        except Exception as e:
+            logger.warning(f"joblib could not load {os.path.basename(path)}, trying pickle: {str(e)}")
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+
+
+# Global model registry instance
+model_registry = ModelRegistry()
@@ -1,11 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser, Group, Permission
 from django.utils import timezone
-from datetime import timedelta
-import os
-import pickle
-import pandas as pd
-import numpy as np
+from django.utils.functional import cached_property
+from datetime import datetime, time, timedelta
+from .model_registry import model_registry, model_path
+
+# Storage format of RouteWaypointBlock.points (sub-metre precision at our latitudes)
+WAYPOINT_DTYPE = '<f4'
 
 class User(AbstractUser):
     ROLE_CHOICES = [
@@ -17,10 +18,13 @@ class User(AbstractUser):
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='sender')
     phone_number = models.CharField(max_length=15, blank=True, null=True)
     rating = models.FloatField(default=5.0)
+    rating_score_sum = models.FloatField(default=0, help_text="Sum of per-delivery performance scores")
+    rating_count = models.IntegerField(default=0, help_text="Number of deliveries in rating_score_sum")
     total_deliveries = models.IntegerField(default=0)
     is_online = models.BooleanField(default=False)
     last_location_lat = models.FloatField(null=True, blank=True)
     last_location_lng = models.FloatField(null=True, blank=True)
+    last_location_at = models.DateTimeField(null=True, blank=True, help_text="Recording time of the ping last_location_lat/lng came from")
     last_active = models.DateTimeField(auto_now=True)
     
     groups = models.ManyToManyField(
@@ -38,6 +42,9 @@ class User(AbstractUser):
         verbose_name='user permissions'
     )
     
+    # Maintained by UPDATE ... F() statements in ratings.py, read-only in the admin
+    RATING_FIELDS = ('rating', 'rating_score_sum', 'rating_count')
+    
     def __str__(self):
         return f"{self.username} ({self.role})"
     
@@ -46,19 +53,13 @@ class User(AbstractUser):
         return f"{self.first_name} {self.last_name}".strip() or self.username
     
     def update_rating(self):
-        """Update courier rating based on delivery performance"""
+        """Update courier rating from the running delivery performance aggregates"""
         if self.role == 'courier':
-            deliveries = self.deliveries.filter(status='delivered')
-            if deliveries.exists():
-                # Calculate rating based on delivery time performance
-                avg_rating = 0
-                for delivery in deliveries:
-                    predicted_time = delivery.predicted_delivery_time or 60
-                    actual_time = delivery.actual_delivery_time or 60
-                    performance = min(5.0, max(1.0, 5.0 - abs(actual_time - predicted_time) / 30))
-                    avg_rating += performance
-                self.rating = avg_rating / deliveries.count()
-                self.save()
+            # Computed in the database from the current aggregates, not from this instance's copies
+            User.objects.filter(pk=self.pk, rating_count__gt=0).update(
+                rating=models.F('rating_score_sum') / models.F('rating_count')
+            )
+            self.refresh_from_db(fields=list(self.RATING_FIELDS))
 
 class Package(models.Model):
     STATUS_CHOICES = [
@@ -117,12 +118,50 @@ class Package(models.Model):
     package_value = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     special_instructions = models.TextField(blank=True)
     
+    # Derived fields, kept in sync by save() and the bulk loaders
+    distance_km = models.FloatField(
+        null=True, blank=True, editable=False, db_index=True,
+        help_text="Pickup to delivery haversine distance in kilometers"
+    )
+    
+    # Coordinates distance_km is derived from
+    DISTANCE_FIELDS = {'poi_lat', 'poi_lng', 'sign_lat', 'sign_lng'}
+    
+    # Status as last read from or written to the database (None for new packages)
+    _loaded_status = None
+    
+    # Fields a delivered package's rating credit is computed from (see ratings.delivery_credit)
+    RATING_INPUT_FIELDS = ('status', 'delivery_user_id', 'predicted_delivery_time', 'receipt_time', 'sign_time')
+    
+    # Stored values of RATING_INPUT_FIELDS that were loaded (None for new packages)
+    _loaded_rating_inputs = None
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Serves the keyset-paginated package listings
+            models.Index(fields=['-receipt_time', '-id'], name='package_receipt_time_id_idx'),
+            # Indexes below were chosen from benchmark_queries EXPLAIN output
+            models.Index(fields=['status', '-receipt_time', '-id'], name='package_status_receipt_idx'),
+            models.Index(fields=['status', 'sign_time'], name='package_status_sign_time_idx'),
+            models.Index(fields=['status', '-created_at'], name='package_status_created_idx'),
+            models.Index(fields=['created_at'], name='package_created_at_idx'),
+            models.Index(fields=['delivery_user', 'status'], name='package_courier_status_idx'),
+        ]
     
     def __str__(self):
         return f"Package {self.order_id} - {self.status}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored status so saves can detect transitions
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_rating_inputs = {
+            name: instance.__dict__[name] for name in cls.RATING_INPUT_FIELDS if name in instance.__dict__
+        }
+        return instance
+    
     @property
     def actual_delivery_time(self):
         """Calculate actual delivery time in minutes"""
@@ -130,46 +169,44 @@ class Package(models.Model):
             return (self.sign_time - self.receipt_time).total_seconds() / 60
         return None
     
-    @property
-    def distance_km(self):
-        """Calculate approximate distance using haversine formula"""
-        if all([self.poi_lat, self.poi_lng, self.sign_lat, self.sign_lng]):
-            from math import radians, cos, sin, asin, sqrt
-            
-            lat1, lon1 = radians(self.poi_lat), radians(self.poi_lng)
-            lat2, lon2 = radians(self.sign_lat), radians(self.sign_lng)
-            
-            dlat = lat2 - lat1
-            dlon = lon2 - lon1
-            a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-            c = 2 * asin(sqrt(a))
-            r = 6371  # Earth's radius in km
-            return c * r
-        return None
+    def update_distance(self):
+        """Recompute the stored pickup to delivery distance from the coordinates"""
+        from .geo import package_distance_km
+        
+        distance = float(package_distance_km(self.poi_lat, self.poi_lng, self.sign_lat, self.sign_lng))
+        self.distance_km = None if distance != distance else distance
+        return self.distance_km
+    
+    def save(self, *args, **kwargs):
+        # Skip when coordinates are deferred so a partial save does not trigger extra queries
+        if not self.DISTANCE_FIELDS & self.get_deferred_fields():
+            self.update_distance()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and self.DISTANCE_FIELDS & set(update_fields):
+                kwargs['update_fields'] = set(update_fields) | {'distance_km'}
+        super().save(*args, **kwargs)
     
     def predict_delivery_time(self):
         """Predict delivery time using ML model"""
         try:
-            # Load the trained model
-            model_path = os.path.join(os.path.dirname(__file__), '../../ml/src/delivery_time_model.pkl')
-            if os.path.exists(model_path):
-                with open(model_path, 'rb') as f:
-                    model = pickle.load(f)
-                
-                # Prepare features for prediction
-                features = np.array([[
-                    hash(self.from_city_name) % 1000,  # Simplified city encoding
-                    self.delivery_user.id if self.delivery_user else 0,
-                    self.poi_lng,
-                    self.poi_lat,
-                    self.poi_lng,  # Use poi as receipt initially
-                    self.poi_lat,
-                    self.sign_lng or self.poi_lng,
-                    self.sign_lat or self.poi_lat
-                ]])
+            # Imported lazily so loading models.py does not pull in numpy
+            from .features import MIN_PREDICTED_MINUTES, city_code, delivery_time_features
+            
+            # Resolve the trained model through the shared registry
+            model = model_registry.get(model_path('delivery_time_model.pkl'))
+            if model is not None:
+                # Prepare features for prediction (poi doubles as receipt point initially)
+                features = delivery_time_features(
+                    [city_code(self.from_city_name)],
+                    [self.delivery_user_id or 0],
+                    [self.poi_lng],
+                    [self.poi_lat],
+                    [self.sign_lng if self.sign_lng is not None else float('nan')],
+                    [self.sign_lat if self.sign_lat is not None else float('nan')],
+                )
                 
                 prediction = model.predict(features)[0]
-                self.predicted_delivery_time = max(10, prediction)  # Minimum 10 minutes
+                self.predicted_delivery_time = max(MIN_PREDICTED_MINUTES, float(prediction))
                 self.save()
                 return self.predicted_delivery_time
         except Exception as e:
@@ -187,21 +224,19 @@ class Package(models.Model):
     def detect_anomaly(self):
         """Detect if this delivery is anomalous using ML model"""
         try:
-            model_path = os.path.join(os.path.dirname(__file__), '../../ml/src/anomaly_detection_model.pkl')
-            if os.path.exists(model_path) and self.actual_delivery_time:
-                with open(model_path, 'rb') as f:
-                    model = pickle.load(f)
-                
-                features = np.array([[
-                    hash(self.from_city_name) % 1000,
-                    self.delivery_user.id if self.delivery_user else 0,
-                    self.actual_delivery_time,
-                    self.distance_km or 0
-                ]])
+            from .features import ANOMALY_THRESHOLD, anomaly_features
+            
+            model = model_registry.get(model_path('anomaly_detection_model.pkl'))
+            if model is not None and self.actual_delivery_time:
+                # Same features the anomaly model was trained on
+                features = anomaly_features(
+                    [self.actual_delivery_time],
+                    package_weight=[self.package_weight if self.package_weight is not None else float('nan')],
+                )
                 
                 anomaly_score = model.decision_function(features)[0]
                 self.anomaly_score = float(anomaly_score)
-                self.is_anomaly = anomaly_score < -0.5  # Threshold for anomaly
+                self.is_anomaly = anomaly_score < ANOMALY_THRESHOLD
                 self.save()
                 
                 if self.is_anomaly:
@@ -225,7 +260,8 @@ class CourierLog(models.Model):
     
     courier = models.ForeignKey(User, on_delete=models.CASCADE, related_name='courier_logs')
     package = models.ForeignKey(Package, on_delete=models.CASCADE, related_name='logs')
-    log_time = models.DateTimeField(auto_now_add=True)
+    # Defaults to now but accepts the device timestamp for buffered location pings
+    log_time = models.DateTimeField(default=timezone.now)
     event = models.CharField(max_length=50, choices=EVENT_CHOICES)
     location_lat = models.FloatField(null=True, blank=True)
     location_lng = models.FloatField(null=True, blank=True)
@@ -233,6 +269,9 @@ class CourierLog(models.Model):
     
     class Meta:
         ordering = ['-log_time']
+        indexes = [
+            models.Index(fields=['courier', '-log_time'], name='courierlog_courier_time_idx'),
+        ]
     
     def __str__(self):
         return f"{self.courier.username} - {self.event} - {self.package.order_id}"
@@ -245,6 +284,11 @@ class OTPLog(models.Model):
     verified_at = models.DateTimeField(null=True, blank=True)
     attempts = models.IntegerField(default=0)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['package', 'otp_code'], name='otplog_package_code_idx'),
+        ]
+    
     def __str__(self):
         return f"OTP {self.otp_code} for {self.package.order_id}"
 
@@ -329,6 +373,13 @@ class PerformanceMetrics(models.Model):
     active_couriers = models.IntegerField(default=0)
     customer_satisfaction = models.FloatField(null=True, blank=True)
     revenue = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    computed_at = models.DateTimeField(null=True, blank=True, help_text="When the rollup last computed this row")
+    
+    # Fields recomputed by rollup()
+    ROLLUP_FIELDS = [
+        'total_packages', 'delivered_packages', 'failed_packages', 'average_delivery_time',
+        'average_distance', 'total_couriers', 'active_couriers', 'computed_at',
+    ]
     
     class Meta:
         ordering = ['-date']
@@ -342,37 +393,84 @@ class PerformanceMetrics(models.Model):
         if date is None:
             date = timezone.now().date()
         
-        packages = Package.objects.filter(created_at__date=date)
-        delivered = packages.filter(status='delivered')
-        failed = packages.filter(status='failed')
+        return cls.rollup(date, date)[0]
+    
+    @classmethod
+    def rollup(cls, start_date, end_date, computed_at=None):
+        """
+        Calculate and upsert metrics for every date from start_date to end_date inclusive
         
-        metrics, created = cls.objects.get_or_create(
-            date=date,
-            defaults={
-                'total_packages': packages.count(),
-                'delivered_packages': delivered.count(),
-                'failed_packages': failed.count(),
-                'average_delivery_time': delivered.aggregate(
-                    avg_time=models.Avg('predicted_delivery_time')
-                )['avg_time'],
-                'total_couriers': User.objects.filter(role='courier').count(),
-                'active_couriers': User.objects.filter(
-                    role='courier',
-                    last_active__date=date
-                ).count(),
-            }
+        Package figures come from one aggregate grouped by creation date, active couriers from
+        one grouped count, and all rows are written with a single bulk upsert.
+        
+        Args:
+            computed_at (datetime): Recorded on the rows; defaults to now, taken before any query
+            
+        Returns:
+            list: PerformanceMetrics for each date in the range, oldest first
+        """
+        from django.db.models.functions import TruncDate
+        
+        # Changes committed while the aggregates run are newer than computed_at, so the next
+        # incremental rollup still picks them up
+        if computed_at is None:
+            computed_at = timezone.now()
+        
+        # Half-open datetime bounds let the created_at index be used
+        tz = timezone.get_current_timezone()
+        range_start = timezone.make_aware(datetime.combine(start_date, time.min), tz)
+        range_end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min), tz)
+        
+        delivered = models.Q(status='delivered')
+        package_rows = (
+            Package.objects.filter(created_at__gte=range_start, created_at__lt=range_end)
+            .annotate(day=TruncDate('created_at', tzinfo=tz))
+            .values('day')
+            .order_by()
+            .annotate(
+                total_packages=models.Count('id'),
+                delivered_packages=models.Count('id', filter=delivered),
+                failed_packages=models.Count('id', filter=models.Q(status='failed')),
+                average_delivery_time=models.Avg('predicted_delivery_time', filter=delivered),
+                average_distance=models.Avg('distance_km', filter=delivered),
+            )
+        )
+        by_day = {row.pop('day'): row for row in package_rows}
+        
+        active_by_day = dict(
+            User.objects.filter(role='courier', last_active__gte=range_start, last_active__lt=range_end)
+            .annotate(day=TruncDate('last_active', tzinfo=tz))
+            .values('day')
+            .order_by()
+            .annotate(active=models.Count('id'))
+            .values_list('day', 'active')
         )
+        total_couriers = User.objects.filter(role='courier').count()
         
-        if not created:
-            # Update existing metrics
-            metrics.total_packages = packages.count()
-            metrics.delivered_packages = delivered.count()
-            metrics.failed_packages = failed.count()
-            metrics.average_delivery_time = delivered.aggregate(
-                avg_time=models.Avg('predicted_delivery_time')
-            )['avg_time']
-            metrics.save()
+        metrics = []
+        day = start_date
+        while day <= end_date:
+            row = by_day.get(day, {})
+            metrics.append(cls(
+                date=day,
+                total_packages=row.get('total_packages', 0),
+                delivered_packages=row.get('delivered_packages', 0),
+                failed_packages=row.get('failed_packages', 0),
+                average_delivery_time=row.get('average_delivery_time'),
+                average_distance=row.get('average_distance'),
+                total_couriers=total_couriers,
+                active_couriers=active_by_day.get(day, 0),
+                computed_at=computed_at,
+            ))
+            day += timedelta(days=1)
         
+        cls.objects.bulk_create(
+            metrics,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['date'],
+            update_fields=cls.ROLLUP_FIELDS,
+        )
         return metrics
 
 
@@ -472,8 +570,37 @@ class DeliveryRoute(models.Model):
     
     def add_waypoint(self, lat, lng):
         """Add a waypoint to the route"""
-        self.waypoints.append([lat, lng])
-        self.save()
+        self.add_waypoints([(lat, lng)])
+    
+    def add_waypoints(self, points):
+        """
+        Append a batch of [lat, lng] waypoints as one packed block
+        
+        Cost depends only on the batch size, not on how many points the route already has.
+        """
+        import numpy as np
+        
+        points = np.asarray(points, dtype=WAYPOINT_DTYPE)
+        if points.size == 0:
+            return 0
+        if points.ndim != 2 or points.shape[1] != 2:
+            raise ValueError("Waypoints must be [lat, lng] pairs")
+        
+        RouteWaypointBlock.objects.create(route=self, point_count=len(points), points=points.tobytes())
+        # Decoded on next access
+        self.__dict__.pop('waypoint_array', None)
+        return len(points)
+    
+    @cached_property
+    def waypoint_array(self):
+        """All waypoints as an (n, 2) float array of [lat, lng], legacy JSON points first"""
+        import numpy as np
+        
+        blocks = self.waypoint_blocks.order_by('id').values_list('points', flat=True)
+        packed = np.frombuffer(b''.join(bytes(block) for block in blocks), dtype=WAYPOINT_DTYPE).reshape(-1, 2)
+        if not self.waypoints:
+            return packed
+        return np.concatenate([np.asarray(self.waypoints, dtype=np.float64).reshape(-1, 2), packed])
     
     def get_route_efficiency(self):
         """Calculate route efficiency compared to estimates"""
@@ -487,3 +614,33 @@ class DeliveryRoute(models.Model):
                 'overall_efficiency': (distance_efficiency + time_efficiency) / 2
             }
         return None
+
+
+class RouteWaypointBlock(models.Model):
+    """Append-only block of route waypoints packed as little-endian float32 [lat, lng] pairs"""
+    route = models.ForeignKey(DeliveryRoute, on_delete=models.CASCADE, related_name='waypoint_blocks')
+    point_count = models.IntegerField()
+    points = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['route', 'id']
+    
+    def __str__(self):
+        return f"{self.point_count} waypoints for route {self.route_id}"
+
+
+class IngestedFile(models.Model):
+    """Manifest of delivery CSV files already loaded by load_delivery_data"""
+    path = models.CharField(max_length=512, unique=True)
+    size = models.BigIntegerField()
+    modified_at = models.DateTimeField(help_text="File modification time when it was ingested")
+    rows = models.IntegerField(default=0)
+    packages_created = models.IntegerField(default=0)
+    ingested_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-ingested_at']
+    
+    def __str__(self):
+        return f"Ingested {self.path} ({self.rows} rows)"
@@ -0,0 +1,92 @@
+"""
+Native LightGBM booster artifacts
+The delivery time model is also published as LightGBM's own text model plus a JSON sidecar with
+its feature names and city encoding. Loading it needs neither pickle nor the sklearn wrapper,
+and predictions go straight to the booster on a contiguous float64 matrix.
+"""
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Native booster file of the delivery time model and the suffix of its metadata sidecar
+DELIVERY_BOOSTER_FILE = 'delivery_time_booster.txt'
+BOOSTER_SUFFIX = '_booster.txt'
+METADATA_SUFFIX = '.meta.json'
+
+
+def metadata_path(booster_path):
+    """Path of the metadata sidecar of a booster file"""
+    return booster_path[:-len('.txt')] + METADATA_SUFFIX
+
+
+def export_booster(model, feature_names, cities):
+    """
+    Serialize a fitted LGBMRegressor as a native booster
+
+    Args:
+        model: Fitted lightgbm.LGBMRegressor
+        feature_names (list): Input columns in the order the model expects
+        cities (dict): City name -> code used for the from_city_name feature
+
+    Returns:
+        tuple: (booster text model, metadata JSON)
+    """
+    import lightgbm as lgb
+    from .features import CITY_CODE_SCHEME
+
+    booster = model.booster_
+    metadata = {
+        'format': 'lightgbm-text',
+        'lightgbm_version': lgb.__version__,
+        'objective': booster.params.get('objective', model.objective or 'regression'),
+        'num_trees': booster.num_trees(),
+        'feature_names': list(feature_names),
+        'city_encoding': {
+            'scheme': CITY_CODE_SCHEME,
+            'cities': dict(sorted(cities.items())),
+        },
+    }
+    return booster.model_to_string(), json.dumps(metadata, indent=2)
+
+
+def load_booster(path):
+    """Load a native booster file and its metadata sidecar"""
+    import lightgbm as lgb
+
+    with open(metadata_path(path)) as f:
+        metadata = json.load(f)
+    return NativeBoosterModel(lgb.Booster(model_file=path), metadata)
+
+
+class NativeBoosterModel:
+    """LightGBM booster predicting directly on float64 rows, with the sklearn predict signature"""
+
+    def __init__(self, booster, metadata):
+        self.booster = booster
+        self.metadata = metadata
+        self.feature_names = metadata['feature_names']
+        self.n_features = len(self.feature_names)
+        # Codes of the cities seen in training, used to build serving features
+        self.city_encoding = metadata.get('city_encoding')
+        if booster.num_feature() != self.n_features:
+            raise ValueError(
+                f"Booster expects {booster.num_feature()} features but its metadata lists {self.n_features}"
+            )
+
+    def predict(self, X):
+        """
+        Predict on an (n, n_features) matrix, or on one row
+
+        Returns:
+            np.ndarray: One prediction per row
+        """
+        import numpy as np
+
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got {X.shape[1]}")
+        return self.booster.predict(X)
@@ -0,0 +1,83 @@
+"""
+Keyset (cursor) pagination for package listings
+Packages are ordered newest receipt_time first, then by id, with unreceived packages last.
+Each page continues from the last row of the previous one, so no page needs an OFFSET scan.
+"""
+
+import base64
+import json
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(package):
+    """Opaque cursor pointing just after a package"""
+    receipt_time = package.receipt_time.isoformat() if package.receipt_time else None
+    payload = json.dumps([receipt_time, package.id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor from encode_cursor
+
+    Returns:
+        tuple: (receipt_time or None, package id)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        receipt_time, package_id = json.loads(payload)
+        if receipt_time is not None:
+            receipt_time = parse_datetime(receipt_time)
+            if receipt_time is None:
+                raise ValueError
+        return receipt_time, int(package_id)
+    except (TypeError, ValueError, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError('Invalid cursor')
+
+
+def paginate_packages(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Fetch one page of packages after a cursor
+
+    Packages with a receipt_time are read first through the (receipt_time, id) index, then
+    packages without one in id order, so both phases are plain index range scans.
+
+    Args:
+        queryset (QuerySet): Filtered packages
+        cursor (str): Cursor from the previous page, or None for the first page
+        page_size (int): Packages per page
+
+    Returns:
+        tuple: (list of packages, next cursor or None on the last page)
+    """
+    receipt_time = package_id = None
+    if cursor:
+        receipt_time, package_id = decode_cursor(cursor)
+
+    page = []
+    if cursor is None or receipt_time is not None:
+        timed = queryset.filter(receipt_time__isnull=False).order_by('-receipt_time', '-id')
+        if cursor is not None:
+            # The leading range keeps this an index range scan; the OR only breaks ties
+            timed = timed.filter(receipt_time__lte=receipt_time).filter(
+                Q(receipt_time__lt=receipt_time) | Q(id__lt=package_id)
+            )
+        page = list(timed[:page_size + 1])
+
+    if len(page) <= page_size:
+        untimed = queryset.filter(receipt_time__isnull=True).order_by('-id')
+        if cursor is not None and receipt_time is None:
+            untimed = untimed.filter(id__lt=package_id)
+        page += list(untimed[:page_size + 1 - len(page)])
+
+    if len(page) > page_size:
+        page = page[:page_size]
+        return page, encode_cursor(page[-1])
+    return page, None
@@ -0,0 +1,152 @@
+"""
+Courier rating aggregates
+A courier's rating is the mean per-delivery performance score, kept as a running sum and count.
+Saving or deleting a Package moves its credit with F() updates when it enters or leaves 'delivered',
+changes courier or changes its times. Writes that bypass save(), such as QuerySet.update() or
+bulk_create(), are repaired with recompute_courier_ratings (the recompute_courier_ratings command).
+"""
+
+from django.db.models import Case, Count, F, FloatField, Func, Sum, Value, When
+from django.db.models.functions import Abs, Coalesce, Greatest, Least, NullIf
+from .models import User, Package
+
+# Minutes assumed when a delivery has no predicted or actual time
+DEFAULT_DELIVERY_MINUTES = 60
+
+
+def performance_score(predicted_minutes, actual_minutes):
+    """Score a delivery from 1 to 5 by how close it came to the predicted time"""
+    predicted_minutes = predicted_minutes or DEFAULT_DELIVERY_MINUTES
+    actual_minutes = actual_minutes or DEFAULT_DELIVERY_MINUTES
+    return min(5.0, max(1.0, 5.0 - abs(actual_minutes - predicted_minutes) / 30))
+
+
+class MinutesBetween(Func):
+    """Minutes from a start to an end datetime column, NULL when either is missing"""
+    arity = 2
+    output_field = FloatField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        start, start_params = compiler.compile(self.source_expressions[0])
+        end, end_params = compiler.compile(self.source_expressions[1])
+        if connection.vendor == 'sqlite':
+            return f'((julianday({end}) - julianday({start})) * 1440.0)', (*end_params, *start_params)
+        if connection.vendor == 'mysql':
+            return f'(TIMESTAMPDIFF(MICROSECOND, {start}, {end}) / 60000000.0)', (*start_params, *end_params)
+        return f'(EXTRACT(EPOCH FROM ({end} - {start})) / 60.0)', (*end_params, *start_params)
+
+
+def delivery_credit(status, delivery_user_id, predicted_delivery_time, receipt_time, sign_time):
+    """(courier id, score) a package adds to the rating aggregates, or None when it adds nothing"""
+    if status != 'delivered' or not delivery_user_id:
+        return None
+    actual = (sign_time - receipt_time).total_seconds() / 60 if receipt_time and sign_time else None
+    return delivery_user_id, performance_score(predicted_delivery_time, actual)
+
+
+def adjust_courier_rating(courier_id, score, deliveries):
+    """
+    Add (or with deliveries=-1, remove) a delivery score in one UPDATE
+
+    Right-hand sides see the pre-update column values, so concurrent adjustments never lose each other.
+    """
+    count = F('rating_count') + deliveries
+    User.objects.filter(pk=courier_id, role='courier').update(
+        rating_score_sum=F('rating_score_sum') + score * deliveries,
+        rating_count=count,
+        # A courier left without deliveries keeps the last rating
+        rating=Case(
+            When(rating_count__gt=-deliveries, then=(F('rating_score_sum') + score * deliveries) / count),
+            default=F('rating'),
+        ),
+    )
+
+
+def record_delivery(package):
+    """Add a delivered package to its courier's running rating aggregates"""
+    credit = delivery_credit(*(getattr(package, name) for name in Package.RATING_INPUT_FIELDS))
+    if credit is not None:
+        adjust_courier_rating(*credit, 1)
+
+
+def stored_delivery_credit(package, current):
+    """delivery_credit of a package's values as last read from or written to the database"""
+    loaded = package._loaded_rating_inputs
+    if loaded is None:
+        return None
+    # Fields deferred at load time were not changed, so their current value is the stored one
+    return delivery_credit(**{**current, **loaded})
+
+
+def sync_delivery_credit(package):
+    """Move a saved package's rating credit from its previously stored values to its current ones"""
+    current = {name: getattr(package, name) for name in Package.RATING_INPUT_FIELDS}
+    previous = stored_delivery_credit(package, current)
+    credit = delivery_credit(**current)
+    if previous != credit:
+        if previous is not None:
+            adjust_courier_rating(*previous, -1)
+        if credit is not None:
+            adjust_courier_rating(*credit, 1)
+    package._loaded_rating_inputs = current
+
+
+def withdraw_delivery_credit(package):
+    """Remove a deleted package's stored rating credit from its courier"""
+    current = {name: getattr(package, name) for name in Package.RATING_INPUT_FIELDS}
+    previous = stored_delivery_credit(package, current)
+    if previous is not None:
+        adjust_courier_rating(*previous, -1)
+
+
+def delivery_score():
+    """performance_score of a Package row as a database expression"""
+    default = Value(float(DEFAULT_DELIVERY_MINUTES))
+    predicted = Coalesce(NullIf(F('predicted_delivery_time'), Value(0.0)), default)
+    actual = Coalesce(NullIf(MinutesBetween('receipt_time', 'sign_time'), Value(0.0)), default)
+    return Least(
+        Value(5.0),
+        Greatest(Value(1.0), Value(5.0) - Abs(actual - predicted) / Value(30.0)),
+        output_field=FloatField(),
+    )
+
+
+def recompute_courier_ratings(courier_ids=None, batch_size=500):
+    """
+    Rebuild rating aggregates from delivered packages, one aggregate query per batch of couriers
+
+    Args:
+        courier_ids (list): Couriers to recompute, or None for every courier
+        batch_size (int): Couriers aggregated per query
+
+    Returns:
+        int: Number of couriers updated
+    """
+    if courier_ids is None:
+        courier_ids = User.objects.filter(role='courier').values_list('id', flat=True)
+    courier_ids = sorted(courier_ids)
+
+    updated = 0
+    for start in range(0, len(courier_ids), batch_size):
+        batch = courier_ids[start:start + batch_size]
+
+        # Scores are summed in the database; one row per courier comes back
+        totals = {
+            row['delivery_user']: (row['score_sum'], row['deliveries'])
+            for row in Package.objects.filter(status='delivered', delivery_user_id__in=batch)
+            .values('delivery_user')
+            .annotate(score_sum=Sum(delivery_score()), deliveries=Count('id'))
+            .order_by()
+        }
+
+        couriers = list(User.objects.filter(pk__in=batch).only('id', 'rating'))
+        for courier in couriers:
+            score_sum, count = totals.get(courier.id, (0.0, 0))
+            courier.rating_score_sum = float(score_sum or 0.0)
+            courier.rating_count = count
+            if count:
+                courier.rating = courier.rating_score_sum / count
+        User.objects.bulk_update(couriers, ['rating_score_sum', 'rating_count', 'rating'])
+        updated += len(couriers)
+
+    return updated
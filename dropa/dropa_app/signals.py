@@ -0,0 +1,48 @@
+"""
+Model signal handlers
+"""
+
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from .models import Package, User
+from .dashboard_stats import invalidate_dashboard_counts
+from .ratings import sync_delivery_credit, withdraw_delivery_credit
+from .spatial import courier_locator
+
+
+@receiver(post_save, sender=Package)
+def package_saved(sender, instance, **kwargs):
+    """Refresh dashboard counters and move the package's rating credit between couriers"""
+    invalidate_dashboard_counts()
+
+    sync_delivery_credit(instance)
+    instance._loaded_status = instance.status
+
+
+@receiver(post_delete, sender=Package)
+def package_deleted(sender, instance, **kwargs):
+    """Package counts feed the dashboard counters"""
+    invalidate_dashboard_counts()
+
+
+@receiver(pre_delete, sender=Package)
+def package_deleting(sender, instance, **kwargs):
+    """Delivered packages leave their courier's rating (runs in the delete transaction, before the row goes)"""
+    withdraw_delivery_credit(instance)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    """Active courier counts feed the dashboard counters; positions feed the courier index"""
+    if instance.role == 'courier':
+        invalidate_dashboard_counts()
+        courier_locator.update_courier(instance)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    """Deleted couriers leave the dashboard counters and the courier index"""
+    if instance.role == 'courier':
+        invalidate_dashboard_counts()
+        if courier_locator.loaded:
+            courier_locator.get_index().remove(instance.id)
@@ -0,0 +1,241 @@
+"""
+In-process spatial index over online couriers
+Couriers are bucketed into a uniform latitude/longitude grid so nearest-courier lookups only
+look at cells around the query point instead of scanning every courier
+"""
+
+import math
+import threading
+import time
+import logging
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+
+# Kilometers per degree of latitude
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def _haversine_km(lat1, lng1, lat2, lng2):
+    """Scalar haversine distance; candidate sets are small enough that NumPy would only add overhead"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+class CourierGridIndex:
+    """Uniform grid of courier positions supporting k-nearest and within-radius queries"""
+
+    def __init__(self, cell_size_deg=0.05):
+        self.cell_size_deg = cell_size_deg
+        self._cells = {}
+        self._positions = {}
+        # (min_row, max_row, min_col, max_col) of occupied cells; only ever widened between rebuilds
+        self._bounds = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, courier_id):
+        return courier_id in self._positions
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_size_deg), math.floor(lng / self.cell_size_deg))
+
+    def update(self, courier_id, lat, lng):
+        """Insert a courier or move it to a new position"""
+        cell = self._cell(lat, lng)
+        with self._lock:
+            previous = self._positions.get(courier_id)
+            if previous is not None:
+                previous_cell = self._cell(*previous)
+                if previous_cell != cell:
+                    self._discard(previous_cell, courier_id)
+            self._positions[courier_id] = (lat, lng)
+            self._cells.setdefault(cell, set()).add(courier_id)
+            self._widen(cell)
+
+    def remove(self, courier_id):
+        """Drop a courier from the index, e.g. when it goes offline"""
+        with self._lock:
+            previous = self._positions.pop(courier_id, None)
+            if previous is not None:
+                self._discard(self._cell(*previous), courier_id)
+
+    def replace(self, positions):
+        """
+        Rebuild the whole index in one step
+
+        Args:
+            positions (iterable): (courier_id, lat, lng) tuples
+        """
+        cells = {}
+        index = {}
+        for courier_id, lat, lng in positions:
+            index[courier_id] = (lat, lng)
+            cells.setdefault(self._cell(lat, lng), set()).add(courier_id)
+
+        with self._lock:
+            self._cells = cells
+            self._positions = index
+            self._bounds = None
+            for cell in cells:
+                self._widen(cell)
+
+    def _widen(self, cell):
+        row, col = cell
+        if self._bounds is None:
+            self._bounds = (row, row, col, col)
+        else:
+            min_row, max_row, min_col, max_col = self._bounds
+            self._bounds = (min(min_row, row), max(max_row, row), min(min_col, col), max(max_col, col))
+
+    def _discard(self, cell, courier_id):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(courier_id)
+            if not members:
+                del self._cells[cell]
+
+    def _ring(self, center, radius):
+        """Cells on the square ring `radius` cells away from the center cell"""
+        row, col = center
+        if radius == 0:
+            yield center
+            return
+        for d in range(-radius, radius + 1):
+            yield (row - radius, col + d)
+            yield (row + radius, col + d)
+        for d in range(-radius + 1, radius):
+            yield (row + d, col - radius)
+            yield (row + d, col + radius)
+
+    def _ring_reach_km(self, lat, radius):
+        """Distance from the query point that is guaranteed covered once `radius` rings were searched"""
+        # A longitude degree shrinks with latitude, so use the narrower of the two cell sides
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + radius * self.cell_size_deg, 90.0))), 1e-6)
+        return radius * self.cell_size_deg * KM_PER_DEGREE * cos_lat
+
+    def nearest(self, lat, lng, k=5, radius_km=None):
+        """
+        Find the k couriers closest to a point
+
+        Args:
+            lat, lng (float): Query point
+            k (int): Maximum number of couriers to return
+            radius_km (float): Optional search radius
+
+        Returns:
+            list: (courier_id, distance_km) tuples ordered by distance
+        """
+        center = self._cell(lat, lng)
+        found = []
+
+        with self._lock:
+            if not self._positions or k < 1:
+                return []
+
+            # Beyond this many rings every indexed courier has been visited
+            min_row, max_row, min_col, max_col = self._bounds
+            max_radius = max(
+                abs(center[0] - min_row), abs(center[0] - max_row),
+                abs(center[1] - min_col), abs(center[1] - max_col),
+            )
+
+            radius = 0
+            while radius <= max_radius:
+                for cell in self._ring(center, radius):
+                    for courier_id in self._cells.get(cell, ()):
+                        distance = _haversine_km(lat, lng, *self._positions[courier_id])
+                        if radius_km is None or distance <= radius_km:
+                            found.append((courier_id, distance))
+
+                # Any courier in an unsearched ring is at least this far away
+                reach = self._ring_reach_km(lat, radius)
+                if radius_km is not None and reach >= radius_km:
+                    break
+                if len(found) >= k:
+                    found.sort(key=lambda item: item[1])
+                    if found[k - 1][1] <= reach:
+                        break
+                radius += 1
+
+        found.sort(key=lambda item: item[1])
+        return found[:k]
+
+    def within_radius(self, lat, lng, radius_km):
+        """
+        Find every courier within a radius of a point
+
+        Returns:
+            list: (courier_id, distance_km) tuples ordered by distance
+        """
+        return self.nearest(lat, lng, k=len(self._positions), radius_km=radius_km)
+
+
+class CourierLocator:
+    """Lazily built, periodically refreshed CourierGridIndex of online couriers"""
+
+    def __init__(self):
+        self._index = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._index is not None
+
+    def get_index(self):
+        """Get the index, building it from the database on first use or when it is stale"""
+        refresh_seconds = getattr(settings, 'COURIER_INDEX_REFRESH_SECONDS', 60)
+        if self._index is None or time.monotonic() - self._built_at > refresh_seconds:
+            with self._lock:
+                if self._index is None or time.monotonic() - self._built_at > refresh_seconds:
+                    self.refresh()
+        return self._index
+
+    def refresh(self):
+        """Reload every online courier position from the database"""
+        from .models import User
+
+        positions = User.objects.filter(
+            role='courier',
+            is_online=True,
+            last_location_lat__isnull=False,
+            last_location_lng__isnull=False,
+        ).values_list('id', 'last_location_lat', 'last_location_lng')
+
+        index = self._index or CourierGridIndex(getattr(settings, 'COURIER_INDEX_CELL_DEGREES', 0.05))
+        index.replace(positions.iterator())
+        self._index = index
+        self._built_at = time.monotonic()
+        logger.info(f"Courier index built with {len(index)} online couriers")
+
+    def update_courier(self, courier):
+        """Apply a courier's current online state and position, if the index is loaded"""
+        if self._index is None:
+            return
+        if courier.is_online and courier.last_location_lat is not None and courier.last_location_lng is not None:
+            self._index.update(courier.id, courier.last_location_lat, courier.last_location_lng)
+        else:
+            self._index.remove(courier.id)
+
+    def move_couriers(self, positions):
+        """
+        Move couriers that are already indexed as online, if the index is loaded
+
+        Args:
+            positions (iterable): (courier_id, lat, lng) tuples
+        """
+        if self._index is None:
+            return
+        for courier_id, lat, lng in positions:
+            if courier_id in self._index:
+                self._index.update(courier_id, lat, lng)
+
+
+# Global courier locator instance
+courier_locator = CourierLocator()
@@ -0,0 +1,1123 @@
+import importlib
+import math
+import os
+import random
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Avg
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from .models import User, Package, Anomaly, DeliveryRoute, IngestedFile, PerformanceMetrics
+from .batching import MicroBatcher
+from .dashboard_stats import compute_dashboard_counts, get_dashboard_counts
+from .features import CITY_CODE_SCHEME, city_code
+from .geo import package_distance_km
+from .geometry import encode_polyline, simplify, zoom_tolerance
+from .locations import LocationPing, write_pings
+from .management.commands.load_delivery_data import parse_chunk
+from .ml_service import MLService
+from .pagination import decode_cursor, paginate_packages
+from .model_registry import activate_version, current_version, list_versions, model_registry, publish_version
+from .admin import UserAdmin
+from .ratings import performance_score, recompute_courier_ratings
+from .spatial import CourierGridIndex, CourierLocator
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class CourierStatsQueryCountTests(TestCase):
+    """Courier list and dashboard queries must not grow with the number of couriers"""
+
+    # Couriers per test; the query counts below hold for any number
+    COURIERS = 6
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        for i in range(self.COURIERS):
+            courier = User.objects.create_user(username=f'courier{i}', password='courier123', role='courier')
+            for j in range(i + 1):
+                delivered = j % 2 == 0
+                Package.objects.create(
+                    order_id=f'TEST{i:02d}{j:02d}',
+                    from_dipan_id=str(j),
+                    from_city_name='Arusha',
+                    delivery_user=courier,
+                    poi_lat=-3.3869,
+                    poi_lng=36.6830,
+                    receipt_time=now - timedelta(days=j * 10),
+                    sign_time=now - timedelta(days=j * 10) + timedelta(hours=2) if delivered else None,
+                    status='delivered' if delivered else 'in_transit',
+                )
+        self.admin = User.objects.create_user(username='admin', password='admin123', role='admin')
+        self.client.force_login(self.admin)
+
+    def test_courier_list_uses_one_stats_query(self):
+        # Session and user lookups plus one annotated courier query
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('api_couriers'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), self.COURIERS)
+
+        busiest = response.json()[0]
+        self.assertEqual(busiest['username'], f'courier{self.COURIERS - 1}')
+        self.assertEqual(busiest['deliveries'], self.COURIERS)
+        self.assertEqual(busiest['completed_deliveries'], (self.COURIERS + 1) // 2)
+
+    def test_dashboard_data_query_count(self):
+        # Session, user, two dashboard counter queries, recent packages and top couriers
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('api_dashboard_data'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['top_couriers']), 3)
+        self.assertEqual(response.json()['stats']['total_packages'], self.COURIERS * (self.COURIERS + 1) // 2)
+
+        # Cached counters leave only the per-request queries
+        with self.assertNumQueries(4):
+            self.client.get(reverse('api_dashboard_data'))
+
+    def test_query_count_independent_of_courier_count(self):
+        User.objects.bulk_create([User(username=f'extra{i}', role='courier') for i in range(20)])
+        with self.assertNumQueries(3):
+            self.client.get(reverse('api_couriers'))
+        cache.clear()
+        with self.assertNumQueries(6):
+            self.client.get(reverse('api_dashboard_data'))
+
+
+class RatingAggregateTests(TestCase):
+    """Running rating aggregates must follow package changes and match a full recompute"""
+
+    def setUp(self):
+        now = timezone.now()
+        self.courier = User.objects.create(username='courier', role='courier')
+        self.packages = [
+            Package.objects.create(
+                order_id=f'RATE{i:02d}',
+                from_dipan_id=str(i),
+                delivery_user=self.courier,
+                poi_lat=-6.7924,
+                poi_lng=39.2083,
+                predicted_delivery_time=predicted,
+                receipt_time=now - timedelta(hours=5),
+                sign_time=now - timedelta(hours=5) + timedelta(minutes=actual),
+                status='delivered',
+            )
+            for i, (predicted, actual) in enumerate([(60.0, 60), (30.0, 120), (None, 90), (0.0, 45)])
+        ]
+
+    def assertMatchesRecompute(self):
+        courier = User.objects.get(pk=self.courier.pk)
+        recompute_courier_ratings([self.courier.pk])
+        self.courier.refresh_from_db()
+        self.assertEqual(courier.rating_count, self.courier.rating_count)
+        self.assertAlmostEqual(courier.rating_score_sum, self.courier.rating_score_sum, places=4)
+        self.assertAlmostEqual(courier.rating, self.courier.rating, places=4)
+
+    def test_full_save_writes_rating_fields(self):
+        courier = User.objects.get(pk=self.courier.pk)
+        courier.rating = 4.5
+        courier.save()
+
+        self.assertEqual(User.objects.get(pk=self.courier.pk).rating, 4.5)
+
+    def test_admin_rating_fields_are_read_only(self):
+        self.assertEqual(set(UserAdmin.readonly_fields), set(User.RATING_FIELDS))
+
+    def test_leaving_delivered_withdraws_score(self):
+        package = Package.objects.get(pk=self.packages[1].pk)
+        package.status = 'failed'
+        package.save()
+
+        self.assertEqual(User.objects.get(pk=self.courier.pk).rating_count, len(self.packages) - 1)
+        self.assertMatchesRecompute()
+
+    def test_edited_times_and_reassignment_move_score(self):
+        other = User.objects.create(username='other', role='courier')
+        package = Package.objects.get(pk=self.packages[0].pk)
+        package.sign_time += timedelta(minutes=90)
+        package.save()
+        self.assertMatchesRecompute()
+
+        package.delivery_user = other
+        package.save()
+        self.assertEqual(User.objects.get(pk=other.pk).rating_count, 1)
+        self.assertEqual(User.objects.get(pk=self.courier.pk).rating_count, len(self.packages) - 1)
+        self.assertMatchesRecompute()
+
+    def test_deleting_last_delivery_keeps_rating(self):
+        *others, last = Package.objects.filter(delivery_user=self.courier).only('id')
+        for package in others:
+            package.delete()
+        rating = User.objects.get(pk=self.courier.pk).rating
+        last.delete()
+
+        courier = User.objects.get(pk=self.courier.pk)
+        self.assertEqual(courier.rating_count, 0)
+        self.assertAlmostEqual(courier.rating_score_sum, 0.0, places=4)
+        self.assertEqual(courier.rating, rating)
+
+    def test_recompute_matches_performance_score(self):
+        expected = [performance_score(p.predicted_delivery_time, p.actual_delivery_time) for p in self.packages]
+
+        self.assertEqual(recompute_courier_ratings(), 1)
+
+        self.courier.refresh_from_db()
+        self.assertEqual(self.courier.rating_count, len(expected))
+        self.assertAlmostEqual(self.courier.rating_score_sum, sum(expected), places=4)
+        self.assertAlmostEqual(self.courier.rating, sum(expected) / len(expected), places=4)
+
+
+def scalar_distance_km(poi_lat, poi_lng, sign_lat, sign_lng):
+    """The per-instance haversine Package.distance_km used to compute"""
+    if not all([poi_lat, poi_lng, sign_lat, sign_lng]):
+        return None
+    lat1, lng1, lat2, lng2 = map(math.radians, (poi_lat, poi_lng, sign_lat, sign_lng))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * math.asin(math.sqrt(a)) * 6371
+
+
+class DistanceTests(TestCase):
+    """The stored distance_km must equal the haversine it replaced"""
+
+    POINTS = [
+        (-6.7924, 39.2083, -6.8160, 39.2803),
+        (-3.3869, 36.6830, -2.5164, 32.9175),
+        (-6.1630, 35.7516, -6.1630, 35.7516),
+        (-6.7924, 39.2083, None, None),
+        (0.0, 39.2083, -6.8160, 39.2803),
+    ]
+
+    def test_vectorized_matches_scalar(self):
+        distances = package_distance_km(*zip(*self.POINTS))
+        for point, distance in zip(self.POINTS, distances.tolist()):
+            expected = scalar_distance_km(*point)
+            if expected is None:
+                self.assertTrue(math.isnan(distance))
+            else:
+                self.assertAlmostEqual(distance, expected, places=9)
+
+    def test_backfill_migration_matches_geo(self):
+        migration = importlib.import_module('dropa_app.migrations.0004_package_distance_km')
+        np.testing.assert_array_equal(
+            migration.package_distance_km(*zip(*self.POINTS)), package_distance_km(*zip(*self.POINTS))
+        )
+
+    def test_save_keeps_distance_in_sync(self):
+        poi_lat, poi_lng, sign_lat, sign_lng = self.POINTS[0]
+        package = Package.objects.create(order_id='DIST01', from_dipan_id='1', poi_lat=poi_lat, poi_lng=poi_lng)
+        self.assertIsNone(Package.objects.get(pk=package.pk).distance_km)
+
+        package.sign_lat, package.sign_lng = sign_lat, sign_lng
+        package.save(update_fields=['sign_lat', 'sign_lng'])
+        stored = Package.objects.get(pk=package.pk).distance_km
+        self.assertAlmostEqual(stored, scalar_distance_km(*self.POINTS[0]), places=9)
+        self.assertTrue(Package.objects.filter(distance_km__lt=10).exists())
+
+        # Saving with the coordinates deferred leaves the stored distance alone
+        deferred = Package.objects.only('id', 'status').get(pk=package.pk)
+        deferred.status = 'in_transit'
+        deferred.save(update_fields=['status'])
+        self.assertEqual(Package.objects.get(pk=package.pk).distance_km, stored)
+
+
+class CourierGridIndexTests(TestCase):
+    """Grid lookups must return what a scan over every courier returns"""
+
+    CITIES = [(-6.7924, 39.2083), (-3.3869, 36.6830), (-2.5164, 32.9175), (-6.1630, 35.7516), (-8.9094, 33.4608)]
+
+    def setUp(self):
+        rng = random.Random(7)
+        self.positions = {}
+        for courier_id in range(400):
+            lat, lng = rng.choice(self.CITIES)
+            self.positions[courier_id] = (lat + rng.uniform(-0.3, 0.3), lng + rng.uniform(-0.3, 0.3))
+        self.index = CourierGridIndex(0.05)
+        self.index.replace((courier_id, lat, lng) for courier_id, (lat, lng) in self.positions.items())
+        self.queries = [
+            (lat + rng.uniform(-0.5, 0.5), lng + rng.uniform(-0.5, 0.5))
+            for lat, lng in (rng.choice(self.CITIES) for _ in range(60))
+        ] + [(-1.2921, 36.8219), (-6.7924, 39.2083)]
+
+    def brute_force(self, lat, lng):
+        distances = [
+            (courier_id, scalar_distance_km(lat, lng, *position)) for courier_id, position in self.positions.items()
+        ]
+        return sorted(distances, key=lambda item: item[1])
+
+    def assertSameMatches(self, actual, expected):
+        self.assertEqual([courier_id for courier_id, _ in actual], [courier_id for courier_id, _ in expected])
+        for (_, distance), (_, expected_distance) in zip(actual, expected):
+            self.assertAlmostEqual(distance, expected_distance, places=6)
+
+    def test_nearest_matches_brute_force(self):
+        for lat, lng in self.queries:
+            expected = self.brute_force(lat, lng)
+            for k in (1, 5, 20):
+                self.assertSameMatches(self.index.nearest(lat, lng, k=k), expected[:k])
+
+    def test_within_radius_matches_brute_force(self):
+        for lat, lng in self.queries:
+            for radius_km in (2.0, 15.0, 60.0):
+                expected = [match for match in self.brute_force(lat, lng) if match[1] <= radius_km]
+                self.assertSameMatches(self.index.within_radius(lat, lng, radius_km), expected)
+
+    def test_moved_and_removed_couriers(self):
+        lat, lng = self.CITIES[0]
+        nearest_id = self.index.nearest(lat, lng, k=1)[0][0]
+
+        self.index.update(nearest_id, -5.0, 37.5)
+        self.positions[nearest_id] = (-5.0, 37.5)
+        self.assertSameMatches(self.index.nearest(lat, lng, k=5), self.brute_force(lat, lng)[:5])
+        self.assertEqual(self.index.nearest(-5.0, 37.5, k=1)[0][0], nearest_id)
+
+        self.index.remove(nearest_id)
+        del self.positions[nearest_id]
+        self.assertSameMatches(self.index.nearest(-5.0, 37.5, k=3), self.brute_force(-5.0, 37.5)[:3])
+
+    def test_api_returns_nearest_online_couriers(self):
+        lat, lng = self.CITIES[0]
+        near = User.objects.create(username='near', role='courier', is_online=True,
+                                   last_location_lat=lat + 0.01, last_location_lng=lng)
+        far = User.objects.create(username='far', role='courier', is_online=True,
+                                  last_location_lat=lat + 0.2, last_location_lng=lng)
+        User.objects.create(username='offline', role='courier', is_online=False,
+                            last_location_lat=lat, last_location_lng=lng)
+        self.client.force_login(near)
+
+        with mock.patch('dropa_app.views.courier_locator', CourierLocator()) as locator, \
+                mock.patch('dropa_app.signals.courier_locator', locator):
+            response = self.client.get(reverse('api_couriers_nearest'), {'lat': lat, 'lng': lng, 'k': 5})
+            self.assertEqual([courier['id'] for courier in response.json()['couriers']], [near.id, far.id])
+
+            # The save signal updates the loaded index without a rebuild
+            near.is_online = False
+            near.save()
+            response = self.client.get(reverse('api_couriers_nearest'), {'lat': lat, 'lng': lng, 'radius_km': 50})
+            self.assertEqual([courier['id'] for courier in response.json()['couriers']], [far.id])
+
+
+class RouteWaypointTests(TestCase):
+    """Waypoints packed into append-only blocks must read back in order"""
+
+    def setUp(self):
+        courier = User.objects.create(username='courier', role='courier')
+        package = Package.objects.create(order_id='ROUTE01', from_dipan_id='1', poi_lat=-6.7924, poi_lng=39.2083)
+        self.route = DeliveryRoute.objects.create(
+            package=package, courier=courier, start_lat=-6.7924, start_lng=39.2083, end_lat=-6.8160, end_lng=39.2803,
+            estimated_distance_km=8.3, estimated_duration_minutes=25,
+        )
+
+    def test_blocks_round_trip_after_legacy_points(self):
+        legacy = [[-6.7924, 39.2083], [-6.7930, 39.2090]]
+        self.route.waypoints = legacy
+        self.route.save()
+        batch = np.column_stack([np.linspace(-6.80, -6.81, 50), np.linspace(39.21, 39.28, 50)])
+
+        self.route.add_waypoints(batch[:20])
+        self.route.add_waypoint(*batch[20])
+        self.route.add_waypoints(batch[21:].tolist())
+
+        points = DeliveryRoute.objects.get(pk=self.route.pk).waypoint_array
+        self.assertEqual(points.shape, (52, 2))
+        np.testing.assert_array_equal(points[:2], legacy)
+        # float32 keeps waypoints within a few decimeters
+        np.testing.assert_allclose(points[2:], batch, rtol=0, atol=4e-6)
+        self.assertEqual(self.route.waypoint_blocks.count(), 3)
+
+    def test_append_cost_does_not_grow_and_cache_refreshes(self):
+        self.route.add_waypoints(np.zeros((5000, 2)))
+        self.assertEqual(len(self.route.waypoint_array), 5000)
+
+        with self.assertNumQueries(1):
+            self.route.add_waypoint(-6.8, 39.2)
+        np.testing.assert_allclose(self.route.waypoint_array[-1], [-6.8, 39.2], atol=4e-6)
+
+    def test_rejects_malformed_points(self):
+        self.assertEqual(self.route.add_waypoints([]), 0)
+        with self.assertRaises(ValueError):
+            self.route.add_waypoints([[-6.8, 39.2, 10.0]])
+
+
+def decode_polyline(polyline, precision=5):
+    """Reference decoder for Google encoded polylines"""
+    values, value, shift = [], 0, 0
+    for char in polyline:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1f) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    return (np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision).tolist()
+
+
+def reference_simplify(points, tolerance):
+    """Recursive Douglas-Peucker over point-to-segment distances"""
+    if len(points) < 3:
+        return list(points)
+    (x1, y1), (x2, y2) = points[0], points[-1]
+    distances = []
+    for x, y in points[1:-1]:
+        dx, dy = x2 - x1, y2 - y1
+        t = 0.0 if dx == dy == 0 else min(max(((x - x1) * dx + (y - y1) * dy) / (dx * dx + dy * dy), 0.0), 1.0)
+        distances.append(math.hypot(x - x1 - t * dx, y - y1 - t * dy))
+    farthest = max(range(len(distances)), key=distances.__getitem__)
+    if distances[farthest] <= tolerance:
+        return [points[0], points[-1]]
+    split = farthest + 1
+    return reference_simplify(points[:split + 1], tolerance)[:-1] + reference_simplify(points[split:], tolerance)
+
+
+class RouteGeometryTests(TestCase):
+    """Simplified, encoded route geometry"""
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        steps = rng.normal(0, 0.001, (400, 2)) + [0.0005, 0.001]
+        self.points = np.cumsum(steps, axis=0) + [-6.7924, 39.2083]
+
+    def test_polyline_round_trips(self):
+        # The example from the format's documentation
+        self.assertEqual(encode_polyline([(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        np.testing.assert_allclose(decode_polyline(encode_polyline(self.points)), np.round(self.points, 5), atol=1e-9)
+
+    def test_simplify_matches_reference(self):
+        for zoom in (6, 9, 12, 16):
+            tolerance = zoom_tolerance(zoom)
+            expected = reference_simplify(self.points.tolist(), tolerance)
+            np.testing.assert_array_equal(simplify(self.points, tolerance), expected)
+
+        line = np.column_stack([np.linspace(0, 1, 50), np.linspace(0, 2, 50)])
+        np.testing.assert_array_equal(simplify(line, 1e-9), line[[0, -1]])
+
+    def test_api_serves_geometry_for_current_waypoints(self):
+        cache.clear()
+        courier = User.objects.create(username='courier', role='courier')
+        package = Package.objects.create(order_id='GEOM01', from_dipan_id='1', poi_lat=-6.7924, poi_lng=39.2083)
+        route = DeliveryRoute.objects.create(
+            package=package, courier=courier, start_lat=-6.7924, start_lng=39.2083, end_lat=-6.5, end_lng=39.6,
+            estimated_distance_km=50, estimated_duration_minutes=90,
+        )
+        route.add_waypoints(self.points[:200])
+        self.client.force_login(courier)
+        url = reverse('api_route_geometry', args=[route.id])
+
+        geometry = self.client.get(url, {'zoom': 14}).json()
+        self.assertEqual(geometry['point_count'], 200)
+        self.assertEqual(len(decode_polyline(geometry['polyline'])), geometry['simplified_count'])
+
+        route.add_waypoints(self.points[200:])
+        geometry = self.client.get(url, {'zoom': 14}).json()
+        self.assertEqual(geometry['point_count'], 400)
+        np.testing.assert_allclose(decode_polyline(geometry['polyline'])[-1], self.points[-1], atol=1e-5)
+
+
+class LocationPingTests(TestCase):
+    """Buffered pings must never move a courier back to an older position"""
+
+    def test_older_ping_is_logged_but_does_not_move_courier(self):
+        courier = User.objects.create(username='courier', role='courier')
+        package = Package.objects.create(
+            order_id='PING01', from_dipan_id='1', delivery_user=courier, poi_lat=-6.7924, poi_lng=39.2083,
+        )
+        recorded_at = timezone.now()
+
+        self.assertEqual(write_pings([LocationPing(courier.id, -6.80, 39.28, package.id, recorded_at)]), (1, 1))
+        late = LocationPing(courier.id, -3.38, 36.68, package.id, recorded_at - timedelta(minutes=5))
+        self.assertEqual(write_pings([late]), (1, 0))
+
+        courier.refresh_from_db()
+        self.assertEqual((courier.last_location_lat, courier.last_location_lng), (-6.80, 39.28))
+        self.assertEqual(courier.last_location_at, recorded_at)
+
+    def test_unrelated_save_does_not_block_later_pings(self):
+        courier = User.objects.create(username='courier', role='courier')
+        recorded_at = timezone.now()
+        write_pings([LocationPing(courier.id, -6.80, 39.28, None, recorded_at)])
+
+        # A profile edit moves the auto_now last_active past the next ping's time
+        courier.first_name = 'Renamed'
+        courier.save()
+        self.assertEqual(write_pings([LocationPing(courier.id, -6.81, 39.29, None, recorded_at + timedelta(microseconds=1))]), (0, 1))
+
+        courier.refresh_from_db()
+        self.assertEqual((courier.last_location_lat, courier.last_location_lng), (-6.81, 39.29))
+
+    @override_settings(LOCATION_MAX_CLOCK_SKEW_SECONDS=120)
+    def test_future_timestamp_is_rejected(self):
+        courier = User.objects.create(username='courier', role='courier')
+        self.client.force_login(courier)
+        now = timezone.now()
+        pings = [
+            {'courier_id': courier.id, 'lat': -6.80, 'lng': 39.28, 'timestamp': (now + timedelta(days=365)).isoformat()},
+            {'courier_id': courier.id, 'lat': -6.81, 'lng': 39.29, 'timestamp': (now + timedelta(seconds=30)).isoformat()},
+        ]
+        with mock.patch('dropa_app.views.location_buffer') as buffer:
+            response = self.client.post(reverse('api_courier_locations'), {'pings': pings}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['rejected'], 1)
+        self.assertEqual(response.json()['errors'][0]['index'], 0)
+        accepted = buffer.add.call_args[0][0]
+        self.assertEqual([(ping.lat, ping.lng) for ping in accepted], [(-6.81, 39.29)])
+
+
+class DeliveryFeatureEncodingTests(TestCase):
+    """Serving must encode cities the way the delivery time model was trained"""
+
+    def test_api_features_use_training_city_codes(self):
+        service = MLService()
+        for city in ['Dar es Salaam', 'Arusha', 'Mwanza', 'Dodoma', 'Mbeya']:
+            self.assertEqual(service._prepare_delivery_features_v2(city, 'Arusha', None)[0], city_code(city))
+        # Unknown origins fall back to Dar es Salaam, like their coordinates
+        self.assertEqual(service._prepare_delivery_features_v2('Kigoma', None, None)[0], city_code('Dar es Salaam'))
+
+    def test_recorded_city_encoding_takes_precedence(self):
+        service = MLService()
+        encoding = {'scheme': 'label', 'cities': {'Dar es Salaam': 0, 'Arusha': 1}}
+        self.assertEqual(service._prepare_delivery_features_v2('Arusha', None, None, encoding)[0], 1)
+        # A city outside a non-crc32 encoding has no code the model knows
+        with self.assertRaises(ValueError):
+            service._prepare_delivery_features_v2('Mwanza', None, None, encoding)
+        # Cities missing from a city_code encoding still get their city_code
+        encoding = {'scheme': CITY_CODE_SCHEME, 'cities': {'Arusha': city_code('Arusha')}}
+        self.assertEqual(service._prepare_delivery_features_v2('Mwanza', None, None, encoding)[0], city_code('Mwanza'))
+
+
+class ConstantRegressor:
+    """Picklable stand-in for a trained model that predicts one value for every row"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def predict(self, X):
+        return np.full(len(X), self.value, dtype=np.float64)
+
+    def decision_function(self, X):
+        return np.zeros(len(X))
+
+
+class ConstantForecast(ConstantRegressor):
+    """Picklable stand-in for the Prophet model"""
+
+    def predict(self, future_df):
+        values = np.full(len(future_df), self.value, dtype=np.float64)
+        return pd.DataFrame({'ds': future_df['ds'], 'yhat': values, 'yhat_lower': values - 1, 'yhat_upper': values + 1})
+
+
+class RampForecast(ConstantRegressor):
+    """Picklable stand-in for the Prophet model with a different, partly negative value every day"""
+
+    calls = 0
+
+    def predict(self, future_df):
+        type(self).calls += 1
+        values = np.arange(len(future_df), dtype=np.float64) * 1.5 - 3
+        return pd.DataFrame({'ds': future_df['ds'], 'yhat': values, 'yhat_lower': values - 2.5, 'yhat_upper': values + 2.5})
+
+
+class ForecastCacheTests(TestCase):
+    """Forecasts are sliced from one Prophet run per model set and day"""
+
+    def setUp(self):
+        models_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, models_dir, ignore_errors=True)
+        publish_version({
+            'delivery_time_model.pkl': ConstantRegressor(0.0),
+            'anomaly_detection_model.pkl': ConstantRegressor(0.0),
+            'prophet_forecasting_model.pkl': RampForecast(0.0),
+        }, models_dir=models_dir)
+        self.service = MLService()
+        self.service.ml_models_path = models_dir
+        RampForecast.calls = 0
+
+    def test_slices_match_per_day_formatting(self):
+        for days in (1, 7, 30):
+            result = self.service.forecast_demand(days)
+            values = [i * 1.5 - 3 for i in range(days)]
+            self.assertEqual([day['predicted_demand'] for day in result['forecast']], [max(0, round(v)) for v in values])
+            self.assertEqual([day['lower_bound'] for day in result['forecast']], [max(0, round(v - 2.5)) for v in values])
+            self.assertEqual(result['forecast'][0]['confidence_interval'], f'{round(-5.5)}-{round(-0.5)}')
+            self.assertEqual(result['total_predicted_volume'], sum(max(0, round(v)) for v in values))
+            self.assertEqual(result['forecast'][0]['date'], datetime.now().date().isoformat())
+
+        columnar = self.service.forecast_demand(7, columnar=True)['forecast']
+        self.assertEqual(columnar['predicted_demand'], [day['predicted_demand'] for day in self.service.forecast_demand(7)['forecast']])
+        self.assertEqual(RampForecast.calls, 1)
+
+    def test_rebuilds_for_longer_horizon_and_new_day(self):
+        self.service.forecast_demand(7)
+        self.assertEqual(len(self.service.forecast_demand(400)['forecast']), 400)
+        self.assertEqual(RampForecast.calls, 2)
+        self.service.forecast_demand(30)
+        self.assertEqual(RampForecast.calls, 2)
+
+        tomorrow = datetime.now() + timedelta(days=1)
+        with mock.patch('dropa_app.ml_service.datetime', wraps=datetime) as clock:
+            clock.now.return_value = tomorrow
+            result = self.service.forecast_demand(7)
+
+        self.assertEqual(RampForecast.calls, 3)
+        self.assertEqual(result['forecast'][0]['date'], tomorrow.date().isoformat())
+
+
+class ModelVersionSwitchTests(TestCase):
+    """A newly published model set must be served without a restart or the watcher"""
+
+    def setUp(self):
+        self.models_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.models_dir, ignore_errors=True)
+
+    def publish(self, value):
+        return publish_version({
+            'delivery_time_model.pkl': ConstantRegressor(value),
+            'anomaly_detection_model.pkl': ConstantRegressor(0.0),
+            'prophet_forecasting_model.pkl': ConstantForecast(value),
+        }, models_dir=self.models_dir)
+
+    def test_forecast_and_predictions_follow_current_version(self):
+        service = MLService()
+        service.ml_models_path = self.models_dir
+
+        first = self.publish(100.0)
+        self.assertEqual(service.forecast_demand(3)['forecast'][0]['predicted_demand'], 100)
+        self.assertEqual(service.predict_delivery_time(from_city='Arusha')['predicted_minutes'], 100.0)
+        self.assertEqual(service.model_version, first)
+
+        second = self.publish(200.0)
+        self.assertNotEqual(first, second)
+        self.assertEqual(service.forecast_demand(3)['forecast'][0]['predicted_demand'], 200)
+        self.assertEqual(service.predict_delivery_time(from_city='Arusha')['predicted_minutes'], 200.0)
+        self.assertEqual(service.model_version, second)
+
+    def test_incomplete_version_keeps_loaded_set(self):
+        service = MLService()
+        service.ml_models_path = self.models_dir
+        first = self.publish(100.0)
+        self.assertEqual(service.predict_delivery_time(from_city='Arusha')['predicted_minutes'], 100.0)
+
+        publish_version({'delivery_time_model.pkl': ConstantRegressor(300.0)}, models_dir=self.models_dir)
+        self.assertEqual(service.predict_delivery_time(from_city='Arusha')['predicted_minutes'], 100.0)
+        self.assertEqual(service.model_version, first)
+
+        third = self.publish(400.0)
+        self.assertEqual(service.predict_delivery_time(from_city='Arusha')['predicted_minutes'], 400.0)
+        self.assertEqual(service.model_version, third)
+
+    def test_rollback_and_pruning(self):
+        service = MLService()
+        service.ml_models_path = self.models_dir
+        versions = [self.publish(value) for value in (100.0, 200.0, 300.0)]
+
+        activate_version(versions[1], models_dir=self.models_dir)
+        self.assertEqual(service.predict_delivery_time(from_city='Arusha')['predicted_minutes'], 200.0)
+        with self.assertRaises(ValueError):
+            activate_version('missing', models_dir=self.models_dir)
+
+        # Pruning never deletes the version CURRENT points at, even when it is the oldest kept
+        publish_version({'delivery_time_model.pkl': ConstantRegressor(0.0)}, models_dir=self.models_dir, keep=2, activate=False)
+        self.assertEqual(current_version(self.models_dir), versions[1])
+        self.assertIn(versions[1], list_versions(self.models_dir))
+        self.assertEqual(len(list_versions(self.models_dir)), 2)
+
+
+class RowSumRegressor(ConstantRegressor):
+    """Picklable stand-in whose prediction depends on every feature"""
+
+    def predict(self, X):
+        return np.asarray(X, dtype=np.float64).sum(axis=1) / 1000
+
+
+class BatchPredictionTests(TestCase):
+    """A batch must predict exactly what single requests predict, row by row"""
+
+    def setUp(self):
+        models_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, models_dir, ignore_errors=True)
+        publish_version({
+            'delivery_time_model.pkl': RowSumRegressor(0.0),
+            'anomaly_detection_model.pkl': ConstantRegressor(0.0),
+            'prophet_forecasting_model.pkl': ConstantForecast(0.0),
+        }, models_dir=models_dir)
+        self.service = MLService()
+        self.service.ml_models_path = models_dir
+
+    def test_batch_matches_single_predictions(self):
+        packages = [
+            {'from_city': 'Arusha', 'to_city': 'Mwanza', 'distance_km': 12.5},
+            {'from_city': 'Dodoma'},
+            {'from_city': 42},
+            {'from_city': 'Mbeya', 'to_city': 'Dar es Salaam', 'distance_km': 300},
+        ]
+
+        batch = self.service.predict_delivery_time_batch(packages)
+
+        self.assertEqual((batch['count'], batch['succeeded'], batch['failed']), (4, 3, 1))
+        self.assertEqual(batch['predictions'][2], {'index': 2, 'error': 'from_city and to_city must be strings'})
+        for index in (0, 1, 3):
+            single = self.service.predict_delivery_time(**packages[index])
+            row = batch['predictions'][index]
+            self.assertEqual(row['index'], index)
+            self.assertEqual(row['predicted_minutes'], single['predicted_minutes'])
+            self.assertEqual(row['predicted_hours'], single['predicted_hours'])
+
+    def test_api_accepts_bare_list(self):
+        with mock.patch('dropa_app.views.ml_service', self.service):
+            response = self.client.post(
+                reverse('api_predict_batch'), [{'from_city': 'Arusha'}], content_type='application/json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['succeeded'], 1)
+
+
+class SlowDeliveryDetector(ConstantRegressor):
+    """Picklable stand-in anomaly model that flags deliveries over 90 minutes"""
+
+    def decision_function(self, X):
+        return 1 - np.asarray(X, dtype=np.float64)[:, 0] / 60
+
+
+class RescorePackagesTests(TestCase):
+    """Bulk re-scoring must write what the per-package methods compute"""
+
+    def setUp(self):
+        models = {
+            'delivery_time_model.pkl': RowSumRegressor(0.0),
+            'anomaly_detection_model.pkl': SlowDeliveryDetector(0.0),
+        }
+        patcher = mock.patch.object(model_registry, 'get', side_effect=lambda path: models.get(os.path.basename(path)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        courier = User.objects.create(username='courier', role='courier')
+        now = timezone.now()
+        for i, (city, minutes) in enumerate([('Arusha', 30), ('Mwanza', 120), ('Dodoma', None), ('Mbeya', 200), ('Kigoma', 45)]):
+            Package.objects.create(
+                order_id=f'RESCORE{i}', from_dipan_id=str(i), from_city_name=city,
+                delivery_user=courier if i % 2 else None,
+                poi_lat=-6.79 - i / 10, poi_lng=39.20 + i / 10, sign_lat=-6.70 if i != 4 else None, sign_lng=39.30,
+                package_weight=1.5 * i if i != 2 else None,
+                receipt_time=now - timedelta(hours=5) if minutes else None,
+                sign_time=now - timedelta(hours=5) + timedelta(minutes=minutes) if minutes else None,
+            )
+
+    def scores(self):
+        return list(Package.objects.order_by('pk').values_list('predicted_delivery_time', 'anomaly_score', 'is_anomaly'))
+
+    def test_bulk_rescore_matches_per_package_scoring(self):
+        for package in Package.objects.order_by('pk'):
+            package.predict_delivery_time()
+            package.detect_anomaly()
+        expected = self.scores()
+        flagged = Anomaly.objects.count()
+        self.assertEqual(flagged, 2)
+
+        Package.objects.update(predicted_delivery_time=None, anomaly_score=None, is_anomaly=False)
+        Anomaly.objects.all().delete()
+        call_command('rescore_packages', chunk_size=2, stdout=StringIO())
+
+        actual = self.scores()
+        for (exp_minutes, exp_score, exp_flag), (minutes, score, flag) in zip(expected, actual):
+            self.assertAlmostEqual(minutes, exp_minutes, places=6)
+            self.assertEqual(score is None, exp_score is None)
+            if score is not None:
+                self.assertAlmostEqual(score, exp_score, places=6)
+            self.assertEqual(flag, exp_flag)
+        self.assertEqual(Anomaly.objects.count(), flagged)
+
+    def test_rerun_does_not_duplicate_anomalies(self):
+        call_command('rescore_packages', stdout=StringIO())
+        call_command('rescore_packages', stdout=StringIO())
+
+        self.assertEqual(Anomaly.objects.count(), 2)
+
+
+def finite_row_sums(X):
+    """Batch scorer that, like the models, rejects rows it cannot score"""
+    if not np.isfinite(X).all():
+        raise ValueError('Input contains NaN')
+    return X.sum(axis=1)
+
+
+class MicroBatcherTests(TestCase):
+    """One malformed request must not fail the requests batched with it"""
+
+    def test_batched_service_predictions_match_unbatched(self):
+        models_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, models_dir, ignore_errors=True)
+        publish_version({
+            'delivery_time_model.pkl': RowSumRegressor(0.0),
+            'anomaly_detection_model.pkl': SlowDeliveryDetector(0.0),
+            'prophet_forecasting_model.pkl': ConstantForecast(0.0),
+        }, models_dir=models_dir)
+        cities = ['Arusha', 'Mwanza', 'Dodoma', 'Mbeya', 'Dar es Salaam'] * 4
+        deliveries = [{'delivery_time_hours': hours / 4} for hours in range(1, 21)]
+
+        def run(service):
+            with ThreadPoolExecutor(len(cities)) as pool:
+                minutes = list(pool.map(lambda city: service.predict_delivery_time(from_city=city)['predicted_minutes'], cities))
+                anomalies = list(pool.map(lambda data: service.detect_anomalies(data)['anomaly_score'], deliveries))
+            return minutes, anomalies
+
+        expected = run(self.make_service(models_dir))
+        with override_settings(ML_MICRO_BATCHING=True, ML_BATCH_WINDOW_MS=50):
+            service = self.make_service(models_dir)
+            self.assertEqual(run(service), expected)
+            stats = service.batching_stats()['models']
+
+        # Concurrent requests really were scored together
+        self.assertGreater(stats['delivery_time']['batches'], 0)
+        self.assertLess(stats['delivery_time']['batches'], len(cities))
+        self.assertEqual(stats['anomaly_detection']['requests'], len(deliveries))
+
+    def make_service(self, models_dir):
+        service = MLService()
+        service.ml_models_path = models_dir
+        return service
+
+    def test_non_numeric_row_raises_in_caller(self):
+        batcher = MicroBatcher(finite_row_sums, name='test')
+        with self.assertRaises(ValueError):
+            batcher.submit([1.0, 'abc'])
+        self.assertEqual(batcher.stats()['requests'], 0)
+
+    def test_unscorable_row_fails_alone_in_concurrent_batch(self):
+        # A long window so every row lands in the same batch
+        batcher = MicroBatcher(finite_row_sums, window_ms=200, max_batch=16, name='test')
+        rows = [[float(i), 1.0] for i in range(7)] + [[None, 1.0]]
+
+        with ThreadPoolExecutor(len(rows)) as pool:
+            futures = [pool.submit(batcher.predict, row, 5) for row in rows]
+            outcomes = []
+            for future in futures:
+                try:
+                    outcomes.append(future.result())
+                except ValueError as e:
+                    outcomes.append(e)
+
+        self.assertEqual(outcomes[:7], [i + 1.0 for i in range(7)])
+        self.assertIsInstance(outcomes[7], ValueError)
+        stats = batcher.stats()
+        self.assertEqual(stats['errors'], 1)
+        self.assertGreaterEqual(stats['fallback_batches'], 1)
+
+
+class DashboardCountsTests(TestCase):
+    """Dashboard counters computed in one aggregate"""
+
+    def create_package(self, order_id, sign_time, status='delivered'):
+        return Package.objects.create(
+            order_id=order_id, from_dipan_id='1', poi_lat=-6.7924, poi_lng=39.2083,
+            receipt_time=sign_time - timedelta(hours=1), sign_time=sign_time, status=status,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_counts_match_per_status_filters(self):
+        now = timezone.now()
+        for i, status in enumerate(['pending', 'pending', 'in_transit', 'delivered', 'cancelled']):
+            self.create_package(f'COUNT{i}', now - timedelta(days=2), status)
+        User.objects.create(username='active', role='courier')
+        User.objects.create(username='inactive', role='courier', is_active=False)
+
+        counts = compute_dashboard_counts()
+        for status in ('pending', 'in_transit', 'delivered'):
+            self.assertEqual(counts[status], Package.objects.filter(status=status).count())
+        self.assertEqual(counts['total_packages'], 5)
+        self.assertEqual(counts['active_couriers'], 1)
+        self.assertEqual(counts['delivery_rate'], 20.0)
+
+    def test_cached_counts_invalidate_on_changes(self):
+        package = self.create_package('CACHED', timezone.now(), 'pending')
+        self.assertEqual(get_dashboard_counts()['pending'], 1)
+        with self.assertNumQueries(0):
+            get_dashboard_counts()
+
+        package.status = 'in_transit'
+        package.save()
+        self.assertEqual((get_dashboard_counts()['pending'], get_dashboard_counts()['in_transit']), (0, 1))
+
+        User.objects.create(username='courier', role='courier')
+        self.assertEqual(get_dashboard_counts()['active_couriers'], 1)
+
+        package.delete()
+        self.assertEqual(get_dashboard_counts()['total_packages'], 0)
+
+    def test_delivered_today_counts_only_today(self):
+        today_start = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()))
+        self.create_package('TODAY', today_start + timedelta(hours=1))
+        self.create_package('YESTERDAY', today_start - timedelta(hours=1))
+        # The loader and seeders write sign times in the future
+        self.create_package('TOMORROW', today_start + timedelta(days=1, hours=1))
+
+        counts = compute_dashboard_counts()
+        self.assertEqual(counts['delivered'], 3)
+        self.assertEqual(counts['delivered_today'], 1)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LoadDeliveryDataTests(TestCase):
+    """Chunked CSV ingestion"""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir, ignore_errors=True)
+
+    def write_csv(self, name, frame):
+        path = os.path.join(self.data_dir, name)
+        frame.to_csv(path, index=False)
+        return path
+
+    def test_created_count_excludes_skipped_rows(self):
+        path = self.write_csv('deliveries.csv', pd.DataFrame({
+            'order_id': ['A1', 'A1', 'A2', 'A3', 'A4'],
+            'from_city_name': ['Arusha'] * 5,
+            'poi_lat': [-3.38] * 5,
+            'poi_lng': [36.68] * 5,
+        }))
+
+        out = StringIO()
+        call_command('load_delivery_data', csv_path=path, limit=0, chunk_size=2, stdout=out)
+        self.assertIn('Successfully created 4 packages', out.getvalue())
+        self.assertEqual(Package.objects.count(), 4)
+
+        out = StringIO()
+        call_command('load_delivery_data', csv_path=path, limit=0, chunk_size=2, stdout=out)
+        self.assertIn('Successfully created 0 packages', out.getvalue())
+
+    def test_parse_chunk_uses_recorded_times(self):
+        chunk = pd.DataFrame({
+            'order_id': ['T1', 'T2', 'T3'],
+            'receipt_time': ['06-04 10:00:00', '06-04 10:00:00', None],
+            'sign_time': ['06-04 12:30:00', None, None],
+            'delivery_time_hours': [None, 3.0, None],
+            'poi_lat': [-6.79, -6.79, None],
+            'poi_lng': [39.20, 39.20, None],
+        })
+
+        rows = parse_chunk(chunk, [1], seed=0)
+
+        receipt = rows[0]['receipt_time']
+        self.assertEqual((receipt.year, receipt.month, receipt.day, receipt.hour), (timezone.now().year, 6, 4, 10))
+        self.assertEqual(rows[0]['sign_time'] - receipt, timedelta(hours=2, minutes=30))
+        self.assertEqual(rows[0]['status'], 'delivered')
+        # A delivery duration without a sign time marks the row delivered at receipt + duration
+        self.assertEqual(rows[1]['status'], 'delivered')
+        self.assertEqual(rows[1]['sign_time'] - rows[1]['receipt_time'], timedelta(hours=3))
+        self.assertIsNotNone(rows[2]['receipt_time'])
+        self.assertEqual((rows[2]['poi_lat'], rows[2]['poi_lng']), (0.0, 0.0))
+
+    def test_chunked_load_matches_single_chunk_and_rates_couriers(self):
+        frame = pd.DataFrame({
+            'order_id': [f'C{i}' for i in range(7)],
+            'from_city_name': ['Arusha', 'Mwanza', 'Dodoma', 'Mbeya', 'Arusha', 'Mwanza', 'Dodoma'],
+            'poi_lat': [-3.38 - i / 100 for i in range(7)],
+            'poi_lng': [36.68 + i / 100 for i in range(7)],
+            'sign_lat': [-3.30] * 7,
+            'sign_lng': [36.70] * 7,
+            'delivery_time_hours': [1.0, 2.0, None, 4.0, 0.5, None, 8.0],
+        })
+        path = self.write_csv('deliveries.csv', frame)
+        fields = ('order_id', 'from_city_name', 'poi_lat', 'poi_lng', 'distance_km')
+
+        call_command('load_delivery_data', csv_path=path, limit=0, chunk_size=3, stdout=StringIO())
+        chunked = list(Package.objects.order_by('order_id').values_list(*fields))
+        Package.objects.all().delete()
+        call_command('load_delivery_data', csv_path=path, limit=0, chunk_size=100, stdout=StringIO())
+
+        self.assertEqual(chunked, list(Package.objects.order_by('order_id').values_list(*fields)))
+        # bulk_create skips the save signals, so the load rebuilds the rating aggregates
+        for courier in User.objects.filter(role='courier'):
+            delivered = Package.objects.filter(delivery_user=courier, status='delivered').count()
+            self.assertEqual(courier.rating_count, delivered)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LoadDeliveryFilesTests(TransactionTestCase):
+    """Parallel multi-file ingestion; writer threads need committed data, hence TransactionTestCase"""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir, ignore_errors=True)
+        for name, rows in [('a.csv', 5), ('b.csv', 3)]:
+            # No order_id column, so every file generates DR000001, DR000002, ... with its own prefix
+            pd.DataFrame({
+                'from_city_name': ['Arusha'] * rows,
+                'poi_lat': [-3.38] * rows,
+                'poi_lng': [36.68] * rows,
+            }).to_csv(os.path.join(self.data_dir, name), index=False)
+
+    def load(self):
+        out = StringIO()
+        call_command('load_delivery_data', csv_dir=self.data_dir, parse_workers=2, chunk_size=2, stdout=out)
+        return out.getvalue()
+
+    def test_generated_ids_do_not_collide_across_files(self):
+        self.assertIn('Successfully created 8 packages from 2 files', self.load())
+        self.assertEqual(Package.objects.count(), 8)
+        self.assertEqual(
+            dict(IngestedFile.objects.values_list('path', 'packages_created')),
+            {os.path.join(self.data_dir, 'a.csv'): 5, os.path.join(self.data_dir, 'b.csv'): 3},
+        )
+
+    def test_rerun_skips_unchanged_files(self):
+        self.load()
+        self.assertIn('All files already ingested', self.load())
+
+        # A row appended to b.csv: only that file is read again and only the new row is inserted
+        pd.DataFrame({
+            'from_city_name': ['Mwanza'], 'poi_lat': [-2.52], 'poi_lng': [32.90],
+        }).to_csv(os.path.join(self.data_dir, 'b.csv'), mode='a', header=False, index=False)
+        out = self.load()
+
+        self.assertIn('Skipping already ingested file', out)
+        self.assertIn('Successfully created 1 packages from 1 files', out)
+        self.assertEqual(Package.objects.count(), 9)
+
+
+class RollupMetricsTests(TestCase):
+    """Bulk PerformanceMetrics rollups"""
+
+    def create_package(self, order_id, created_at, status='pending', **fields):
+        package = Package.objects.create(
+            order_id=order_id, from_dipan_id='1', poi_lat=-6.7924, poi_lng=39.2083, status=status, **fields
+        )
+        # created_at is auto_now_add
+        Package.objects.filter(pk=package.pk).update(created_at=created_at)
+        return Package.objects.get(pk=package.pk)
+
+    def per_day_metrics(self, date):
+        """The per-day queries calculate_daily_metrics ran before the bulk rollup"""
+        packages = Package.objects.filter(created_at__date=date)
+        delivered = packages.filter(status='delivered')
+        averages = delivered.aggregate(avg_time=Avg('predicted_delivery_time'), avg_distance=Avg('distance_km'))
+        return {
+            'total_packages': packages.count(),
+            'delivered_packages': delivered.count(),
+            'failed_packages': packages.filter(status='failed').count(),
+            'average_delivery_time': averages['avg_time'],
+            'average_distance': averages['avg_distance'],
+            'total_couriers': User.objects.filter(role='courier').count(),
+            'active_couriers': User.objects.filter(role='courier', last_active__date=date).count(),
+        }
+
+    @override_settings(TIME_ZONE='Africa/Dar_es_Salaam')
+    def test_range_rollup_matches_per_day_queries(self):
+        start = timezone.localdate() - timedelta(days=9)
+        midnight = timezone.make_aware(datetime.combine(start, datetime.min.time()))
+        rng = random.Random(11)
+        for i in range(60):
+            # Some packages land minutes either side of local midnight
+            created_at = midnight + timedelta(days=rng.randrange(10), minutes=rng.choice([-3, 2, 300, 1100]))
+            self.create_package(
+                f'ROLLUP{i}', created_at, rng.choice(['pending', 'delivered', 'delivered', 'failed']),
+                predicted_delivery_time=rng.uniform(10, 120), sign_lat=-6.8 + rng.uniform(-0.1, 0.1), sign_lng=39.25,
+            )
+        for i in range(6):
+            courier = User.objects.create(username=f'courier{i}', role='courier')
+            User.objects.filter(pk=courier.pk).update(last_active=midnight + timedelta(days=i * 2, hours=1))
+
+        metrics = PerformanceMetrics.rollup(start, start + timedelta(days=9))
+
+        self.assertEqual([m.date for m in metrics], [start + timedelta(days=i) for i in range(10)])
+        self.assertEqual(PerformanceMetrics.objects.count(), 10)
+        for stored in PerformanceMetrics.objects.all():
+            expected = self.per_day_metrics(stored.date)
+            for field, value in expected.items():
+                if isinstance(value, float):
+                    self.assertAlmostEqual(getattr(stored, field), value, places=6)
+                else:
+                    self.assertEqual(getattr(stored, field), value, (stored.date, field))
+
+        # Re-running upserts the same rows
+        PerformanceMetrics.calculate_daily_metrics(start)
+        self.assertEqual(PerformanceMetrics.objects.count(), 10)
+
+    def test_incremental_run_sees_changes_made_during_previous_run(self):
+        day = timezone.now() - timedelta(days=5)
+        first = self.create_package('ROLL1', day)
+        second = self.create_package('ROLL2', day)
+        call_command('rollup_metrics', stdout=StringIO())
+
+        first.status = 'delivered'
+        first.save()
+        rollup = PerformanceMetrics.rollup
+
+        def rollup_then_deliver(start, end, **kwargs):
+            metrics = rollup(start, end, **kwargs)
+            # A write landing after the first range was computed but before the run finished
+            if second.status != 'delivered':
+                second.status = 'delivered'
+                second.save()
+            return metrics
+
+        with mock.patch.object(PerformanceMetrics, 'rollup', side_effect=rollup_then_deliver):
+            call_command('rollup_metrics', incremental=True, stdout=StringIO())
+        self.assertEqual(PerformanceMetrics.objects.get(date=timezone.localdate(day)).delivered_packages, 1)
+
+        call_command('rollup_metrics', incremental=True, stdout=StringIO())
+        self.assertEqual(PerformanceMetrics.objects.get(date=timezone.localdate(day)).delivered_packages, 2)
+
+
+class KeysetPaginationTests(TestCase):
+    """Walking cursor pages must visit every package exactly once, in order"""
+
+    def setUp(self):
+        base = timezone.now() - timedelta(days=1)
+        # Few distinct receipt times, so most pages start and end inside a tie
+        receipt_times = [base + timedelta(minutes=i % 4) for i in range(30)] + [None] * 8
+        random.Random(5).shuffle(receipt_times)
+        for i, receipt_time in enumerate(receipt_times):
+            Package.objects.create(
+                order_id=f'PAGE{i:02d}', from_dipan_id='1', poi_lat=-6.7924, poi_lng=39.2083,
+                receipt_time=receipt_time, status='delivered' if i % 3 else 'pending',
+            )
+
+    def expected_ids(self, queryset):
+        timed = sorted(queryset.filter(receipt_time__isnull=False), key=lambda p: (p.receipt_time, p.id), reverse=True)
+        untimed = queryset.filter(receipt_time__isnull=True).order_by('-id')
+        return [p.id for p in timed] + [p.id for p in untimed]
+
+    def walk(self, queryset, page_size):
+        ids, cursor = [], None
+        while True:
+            page, cursor = paginate_packages(queryset, cursor, page_size)
+            self.assertLessEqual(len(page), page_size)
+            ids += [p.id for p in page]
+            if cursor is None:
+                return ids
+
+    def test_pages_have_no_duplicates_or_gaps(self):
+        for page_size in (1, 3, 7, 30, 38, 50):
+            self.assertEqual(self.walk(Package.objects.all(), page_size), self.expected_ids(Package.objects.all()))
+
+        delivered = Package.objects.filter(status='delivered')
+        self.assertEqual(self.walk(delivered, 4), self.expected_ids(delivered))
+
+    def test_api_follows_next_cursor(self):
+        self.client.force_login(User.objects.create(username='staff', role='admin'))
+        ids, params = [], {'limit': 6}
+        while True:
+            response = self.client.get(reverse('api_packages'), params)
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.json()]
+            if 'X-Next-Cursor' not in response:
+                break
+            params['cursor'] = response['X-Next-Cursor']
+
+        self.assertEqual(ids, self.expected_ids(Package.objects.all()))
+        self.assertEqual(self.client.get(reverse('api_packages'), {'cursor': 'not-a-cursor'}).status_code, 400)
+        with self.assertRaises(ValueError):
+            decode_cursor('not-a-cursor')
+
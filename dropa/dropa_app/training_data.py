@@ -0,0 +1,184 @@
+"""
+Columnar training snapshots of delivered packages
+Delivered rows are streamed from the database in chunks and appended to one raw binary file per
+column, so millions of deliveries can be extracted and trained on without holding ORM objects
+or the whole table in memory. load_training_snapshot memory-maps them back.
+"""
+
+import json
+import os
+import shutil
+import time
+import logging
+from itertools import islice
+import numpy as np
+from django.db.models import F
+from django.utils import timezone
+from .features import city_code
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_META_FILE = 'meta.json'
+
+# Column name -> little-endian dtype of its file; NaN marks unknown floats
+SNAPSHOT_COLUMNS = {
+    'city_code': '<i4',
+    'delivery_user_id': '<i8',
+    'poi_lng': '<f8',
+    'poi_lat': '<f8',
+    'sign_lng': '<f8',
+    'sign_lat': '<f8',
+    'package_weight': '<f8',
+    'receipt_time': '<i8',
+    'delivery_minutes': '<f8',
+}
+
+DEFAULT_CHUNK_SIZE = 20000
+
+
+def delivered_packages(since=None):
+    """Delivered packages with a usable delivery duration, in primary key order"""
+    from .models import Package
+
+    packages = Package.objects.filter(
+        status='delivered',
+        receipt_time__isnull=False,
+        sign_time__isnull=False,
+        sign_time__gte=F('receipt_time'),
+    )
+    if since is not None:
+        packages = packages.filter(receipt_time__gte=since)
+    return packages.order_by('pk')
+
+
+def _float_column(values):
+    """Float64 array with None as NaN"""
+    return np.array(values, dtype=np.float64)
+
+
+def chunk_columns(rows, cities):
+    """
+    Convert one chunk of value rows to snapshot columns
+
+    Args:
+        rows (list): (from_city_name, delivery_user_id, poi_lng, poi_lat, sign_lng, sign_lat,
+            package_weight, receipt_time, sign_time) tuples
+        cities (dict): City name -> code, extended with names seen for the first time
+
+    Returns:
+        dict: Column name -> np.ndarray
+    """
+    city_names, courier_ids, poi_lng, poi_lat, sign_lng, sign_lat, weights, receipt_times, sign_times = zip(*rows)
+
+    for name in set(city_names).difference(cities):
+        cities[name] = city_code(name)
+
+    receipt_seconds = np.fromiter((t.timestamp() for t in receipt_times), dtype=np.float64, count=len(rows))
+    sign_seconds = np.fromiter((t.timestamp() for t in sign_times), dtype=np.float64, count=len(rows))
+
+    return {
+        'city_code': np.fromiter((cities[name] for name in city_names), dtype=np.int32, count=len(rows)),
+        'delivery_user_id': np.fromiter((courier_id or 0 for courier_id in courier_ids), dtype=np.int64, count=len(rows)),
+        'poi_lng': _float_column(poi_lng),
+        'poi_lat': _float_column(poi_lat),
+        'sign_lng': _float_column(sign_lng),
+        'sign_lat': _float_column(sign_lat),
+        'package_weight': _float_column(weights),
+        'receipt_time': receipt_seconds.astype(np.int64),
+        'delivery_minutes': (sign_seconds - receipt_seconds) / 60,
+    }
+
+
+def extract_training_snapshot(output_dir, chunk_size=DEFAULT_CHUNK_SIZE, since=None, stdout=None):
+    """
+    Stream delivered packages into a columnar training snapshot
+
+    The snapshot is written next to output_dir and moved into place once complete, so a
+    concurrent reader never sees a half-written one.
+
+    Args:
+        output_dir (str): Snapshot directory to create or replace
+        chunk_size (int): Rows fetched and converted per chunk
+        since (datetime): Only packages received at or after this time
+        stdout: Optional stream for progress lines
+
+    Returns:
+        dict: The snapshot metadata
+    """
+    output_dir = os.path.abspath(output_dir)
+    staging_dir = f'{output_dir}.tmp-{os.getpid()}'
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+
+    rows = delivered_packages(since).values_list(
+        'from_city_name', 'delivery_user_id', 'poi_lng', 'poi_lat', 'sign_lng', 'sign_lat',
+        'package_weight', 'receipt_time', 'sign_time',
+    ).iterator(chunk_size=chunk_size)
+
+    started = time.perf_counter()
+    cities = {}
+    total = 0
+    files = {name: open(os.path.join(staging_dir, f'{name}.bin'), 'wb') for name in SNAPSHOT_COLUMNS}
+    try:
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            for name, values in chunk_columns(chunk, cities).items():
+                values.astype(SNAPSHOT_COLUMNS[name], copy=False).tofile(files[name])
+            total += len(chunk)
+            if stdout is not None:
+                stdout.write(f'Extracted {total} deliveries ({total / (time.perf_counter() - started):.0f} rows/sec)')
+    except BaseException:
+        for f in files.values():
+            f.close()
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    for f in files.values():
+        f.close()
+
+    meta = {
+        'version': SNAPSHOT_VERSION,
+        'rows': total,
+        'columns': SNAPSHOT_COLUMNS,
+        'cities': dict(sorted(cities.items(), key=lambda item: str(item[0]))),
+        'since': since.isoformat() if since is not None else None,
+        'created_at': timezone.now().isoformat(),
+    }
+    with open(os.path.join(staging_dir, SNAPSHOT_META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(staging_dir, output_dir)
+    logger.info(f"Training snapshot with {total} deliveries written to {output_dir}")
+    return meta
+
+
+def load_training_snapshot(snapshot_dir, columns=None, mmap=True):
+    """
+    Load a columnar training snapshot written by extract_training_snapshot
+
+    Args:
+        snapshot_dir (str): Snapshot directory with meta.json and one .bin file per column
+        columns (list): Columns to load, or None for every column
+        mmap (bool): Memory-map the column files instead of reading them into memory
+
+    Returns:
+        tuple: (dict of column name to np.ndarray, snapshot metadata dict)
+    """
+    with open(os.path.join(snapshot_dir, SNAPSHOT_META_FILE)) as f:
+        meta = json.load(f)
+    rows = meta['rows']
+    data = {}
+    for name in columns or meta['columns']:
+        dtype = np.dtype(meta['columns'][name])
+        path = os.path.join(snapshot_dir, f'{name}.bin')
+        if rows == 0:
+            # An empty file cannot be memory-mapped
+            data[name] = np.empty(0, dtype=dtype)
+        elif mmap:
+            data[name] = np.memmap(path, dtype=dtype, mode='r', shape=(rows,))
+        else:
+            data[name] = np.fromfile(path, dtype=dtype, count=rows)
+    return data, meta
@@ -17,12 +17,17 @@ urlpatterns = [
     path('api/dashboard-data/', views.DashboardDataView.as_view(), name='api_dashboard_data'),
     path('api/delivery-insights/', views.DeliveryInsightsView.as_view(), name='api_delivery_insights'),
     path('api/predict/', views.PredictDeliveryTimeView.as_view(), name='api_predict'),
+    path('api/predict/batch/', views.PredictDeliveryTimeBatchView.as_view(), name='api_predict_batch'),
     path('api/anomaly/', views.AnomalyDetectionView.as_view(), name='api_anomaly'),
     path('api/forecast/', views.ForecastView.as_view(), name='api_forecast'),
+    path('api/ml/batching/', views.MLBatchingStatsView.as_view(), name='api_ml_batching'),
     path('api/otp/send/', views.SendOTPView.as_view(), name='api_otp_send'),
     path('api/otp/verify/', views.VerifyOTPView.as_view(), name='api_otp_verify'),
     path('api/chatbot/', views.DropaBotView.as_view(), name='api_chatbot'),
     path('api/packages/', views.PackageListView.as_view(), name='api_packages'),
     path('api/couriers/', views.CourierStatsView.as_view(), name='api_couriers'),
+    path('api/couriers/nearest/', views.NearestCouriersView.as_view(), name='api_couriers_nearest'),
+    path('api/couriers/locations/', views.CourierLocationIngestView.as_view(), name='api_courier_locations'),
     path('api/stats/', views.DashboardStatsView.as_view(), name='api_stats'),
+    path('api/routes/<int:route_id>/geometry/', views.RouteGeometryView.as_view(), name='api_route_geometry'),
 ]
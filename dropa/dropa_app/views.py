@@ -5,35 +5,71 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
+from django.core.cache import cache
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from django.db.models import Count, Q
+from django.db.models import Case, Count, ExpressionWrapper, F, FloatField, Q, Sum, Value, When
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from urllib.parse import urlencode
 from datetime import timedelta
 from .models import *
 from .serializers import *
 from .ml_service import ml_service
+from .dashboard_stats import get_dashboard_counts
+from .spatial import courier_locator
+from .locations import LocationPing, location_buffer
+from .geometry import encode_polyline, simplify, zoom_tolerance
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate_packages
 import pyotp
 import json
 
+# Helpers shared by the frontend and API views
+# Query parameters accepted as package list filters
+PACKAGE_FILTERS = ('status', 'city', 'courier')
+
+def filter_packages(packages, params):
+    """Apply status, city and courier filters from query parameters"""
+    if params.get('status'):
+        packages = packages.filter(status=params['status'])
+    if params.get('city'):
+        packages = packages.filter(from_city_name=params['city'])
+    if params.get('courier'):
+        packages = packages.filter(delivery_user_id=int(params['courier']))
+    return packages
+
+def annotate_courier_stats(couriers):
+    """Annotate couriers with total, completed and recent deliveries plus success rate"""
+    couriers = couriers.annotate(
+        delivery_count=Count('deliveries'),
+        completed_deliveries=Count('deliveries', filter=Q(deliveries__status='delivered')),
+        recent_deliveries=Count('deliveries',
+            filter=Q(deliveries__receipt_time__gte=timezone.now() - timedelta(days=30))),
+    )
+    return couriers.annotate(
+        success_rate=Case(
+            When(delivery_count=0, then=Value(0.0)),
+            default=ExpressionWrapper(
+                F('completed_deliveries') * 100.0 / F('delivery_count'),
+                output_field=FloatField()
+            ),
+            output_field=FloatField()
+        )
+    )
+
 # Frontend Views
 @login_required
 def dashboard_view(request):
     """Main dashboard view"""
     # Get dashboard statistics
-    total_packages = Package.objects.count()
-    active_deliveries = Package.objects.filter(status='in_transit').count()
-    active_couriers = User.objects.filter(role='courier', is_active=True).count()
-    
-    # Calculate delivery success rate
-    total_delivered = Package.objects.filter(status='delivered').count()
-    delivery_rate = (total_delivered / total_packages * 100) if total_packages > 0 else 0
+    counts = get_dashboard_counts()
     
     context = {
-        'total_packages': total_packages,
-        'active_deliveries': active_deliveries,
-        'active_couriers': active_couriers,
-        'delivery_rate': round(delivery_rate, 1),
+        'total_packages': counts['total_packages'],
+        'active_deliveries': counts['in_transit'],
+        'active_couriers': counts['active_couriers'],
+        'delivery_rate': round(counts['delivery_rate'], 1),
     }
     
     return render(request, 'dropa_app/dashboard.html', context)
@@ -41,8 +77,24 @@ def dashboard_view(request):
 @login_required
 def packages_view(request):
     """Packages management view"""
-    packages = Package.objects.all().order_by('-receipt_time')
-    return render(request, 'dropa_app/packages.html', {'packages': packages})
+    filters = {key: request.GET[key] for key in PACKAGE_FILTERS if request.GET.get(key)}
+    cursor = request.GET.get('cursor')
+    
+    try:
+        packages = filter_packages(Package.objects.select_related('delivery_user'), filters)
+        page, next_cursor = paginate_packages(packages, cursor, DEFAULT_PAGE_SIZE)
+    except ValueError:
+        # Stale or hand-edited links fall back to the unfiltered first page
+        filters, cursor = {}, None
+        page, next_cursor = paginate_packages(Package.objects.select_related('delivery_user'))
+    
+    return render(request, 'dropa_app/packages.html', {
+        'packages': page,
+        'filters': filters,
+        'is_first_page': cursor is None,
+        'first_page_url': f"?{urlencode(filters)}",
+        'next_page_url': f"?{urlencode({**filters, 'cursor': next_cursor})}" if next_cursor else None,
+    })
 
 @login_required
 def couriers_view(request):
@@ -115,6 +167,28 @@ class PredictDeliveryTimeView(APIView):
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class PredictDeliveryTimeBatchView(APIView):
+    def post(self, request):
+        """Predict delivery times for a batch of packages in one model call"""
+        try:
+            # Accept either a bare list or {"packages": [...]}
+            data = request.data
+            packages = data.get('packages') if isinstance(data, dict) else data
+            
+            if packages is None:
+                return Response({'error': 'packages is required'}, status=status.HTTP_400_BAD_REQUEST)
+            
+            # Get batch predictions from ML service
+            predictions = ml_service.predict_delivery_time_batch(packages)
+            
+            if 'error' in predictions:
+                return Response({'error': predictions['error']}, status=status.HTTP_400_BAD_REQUEST)
+            
+            return Response(predictions, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 class AnomalyDetectionView(APIView):
     def post(self, request):
         """Detect anomalies in delivery data using trained ML model"""
@@ -133,6 +207,17 @@ class AnomalyDetectionView(APIView):
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class MLBatchingStatsView(APIView):
+    def get(self, request):
+        """Get micro-batching queue depth and batch size metrics of the worker serving the request"""
+        try:
+            # ?reset=1 zeroes the counters after reading, for interval sampling
+            reset = request.GET.get('reset') in ('1', 'true')
+            return Response(ml_service.batching_stats(reset=reset), status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 class ForecastView(APIView):
     def get(self, request):
         """Forecast delivery demand using trained Prophet model"""
@@ -140,8 +225,11 @@ class ForecastView(APIView):
             # Get forecast period from query params (default 30 days)
             days_ahead = int(request.GET.get('days', 30))
             
+            # ?shape=columnar returns parallel arrays for chart clients
+            columnar = request.GET.get('shape') == 'columnar'
+            
             # Get forecast from ML service
-            forecast_result = ml_service.forecast_demand(days_ahead=days_ahead)
+            forecast_result = ml_service.forecast_demand(days_ahead=days_ahead, columnar=columnar)
             
             if 'error' in forecast_result:
                 return Response({'error': forecast_result['error']}, status=status.HTTP_400_BAD_REQUEST)
@@ -176,9 +264,26 @@ class DropaBotView(APIView):
 
 class PackageListView(APIView):
     def get(self, request):
-        packages = Package.objects.all().order_by('-receipt_time')[:10]  # Latest 10 packages
-        serializer = PackageSerializer(packages, many=True)
-        return Response(serializer.data)
+        """List packages newest first, one cursor page at a time (latest 10 by default)"""
+        try:
+            page_size = min(int(request.GET.get('limit', 10)), MAX_PAGE_SIZE)
+            if page_size < 1:
+                raise ValueError('limit must be positive')
+            packages = filter_packages(Package.objects.all(), request.GET)
+            page, next_cursor = paginate_packages(packages, request.GET.get('cursor'), page_size)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = PackageSerializer(page, many=True)
+        response = Response(serializer.data)
+        
+        # The body stays a plain list for existing clients; the next page is advertised in headers
+        if next_cursor:
+            params = request.GET.copy()
+            params['cursor'] = next_cursor
+            response['X-Next-Cursor'] = next_cursor
+            response['Link'] = f'<{request.build_absolute_uri(request.path)}?{params.urlencode()}>; rel="next"'
+        return response
     
     def post(self, request):
         serializer = PackageSerializer(data=request.data)
@@ -191,33 +296,26 @@ class CourierStatsView(APIView):
     def get(self, request):
         """Get courier statistics with real data"""
         try:
-            # Get couriers with their delivery stats
-            couriers = User.objects.filter(role='courier').annotate(
-                delivery_count=Count('delivered_packages'),
-                recent_deliveries=Count('delivered_packages', 
-                    filter=Q(delivered_packages__receipt_time__gte=timezone.now() - timedelta(days=30)))
+            # Get couriers with their delivery stats in a single aggregate query
+            couriers = annotate_courier_stats(
+                User.objects.filter(role='courier')
             ).order_by('-delivery_count')[:10]
             
             courier_data = []
             for courier in couriers:
-                # Calculate additional stats
-                total_packages = courier.delivered_packages.count()
-                completed_packages = courier.delivered_packages.filter(status='delivered').count()
-                success_rate = (completed_packages / total_packages * 100) if total_packages > 0 else 0
-                
                 courier_data.append({
                     'id': courier.id,
                     'name': f"{courier.first_name} {courier.last_name}" if courier.first_name else courier.username,
                     'username': courier.username,
                     'email': courier.email,
-                    'deliveries': total_packages,
-                    'completed_deliveries': completed_packages,
+                    'deliveries': courier.delivery_count,
+                    'completed_deliveries': courier.completed_deliveries,
                     'recent_deliveries': courier.recent_deliveries,
-                    'success_rate': round(success_rate, 1),
-                    'rating': round(4.0 + (success_rate / 100), 1),  # Dynamic rating based on success rate
+                    'success_rate': round(courier.success_rate, 1),
+                    'rating': round(4.0 + (courier.success_rate / 100), 1),  # Dynamic rating based on success rate
                     'status': 'online' if courier.is_active else 'offline',
                     'last_active': courier.last_login.isoformat() if courier.last_login else None,
-                    'phone': courier.phone if hasattr(courier, 'phone') else None
+                    'phone': courier.phone_number
                 })
             
             # If no couriers with deliveries, create sample data
@@ -272,46 +370,181 @@ class CourierStatsView(APIView):
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class NearestCouriersView(APIView):
+    # Upper bound on couriers returned per lookup
+    MAX_RESULTS = 50
+    
+    def get(self, request):
+        """Find the online couriers nearest to a point or to a package's pickup location"""
+        try:
+            package_id = request.GET.get('package_id')
+            if package_id:
+                package = Package.objects.only('poi_lat', 'poi_lng').filter(pk=package_id).first()
+                if package is None:
+                    return Response({'error': 'Package not found'}, status=status.HTTP_404_NOT_FOUND)
+                lat, lng = package.poi_lat, package.poi_lng
+                if lat is None or lng is None:
+                    return Response({'error': 'Package has no pickup location'}, status=status.HTTP_400_BAD_REQUEST)
+            else:
+                try:
+                    lat = float(request.GET['lat'])
+                    lng = float(request.GET['lng'])
+                except (KeyError, ValueError):
+                    return Response({'error': 'lat and lng or package_id are required'}, status=status.HTTP_400_BAD_REQUEST)
+            
+            try:
+                k = min(int(request.GET.get('k', 5)), self.MAX_RESULTS)
+                radius_km = request.GET.get('radius_km')
+                radius_km = float(radius_km) if radius_km else None
+            except ValueError:
+                return Response({'error': 'k and radius_km must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+            
+            matches = courier_locator.get_index().nearest(lat, lng, k=k, radius_km=radius_km)
+            
+            # One query for the matched couriers' details
+            couriers = User.objects.in_bulk([courier_id for courier_id, _ in matches])
+            results = []
+            for courier_id, distance in matches:
+                courier = couriers.get(courier_id)
+                if courier is None:
+                    continue
+                results.append({
+                    'id': courier.id,
+                    'name': courier.full_name,
+                    'username': courier.username,
+                    'phone': courier.phone_number,
+                    'rating': round(courier.rating, 1),
+                    'latitude': courier.last_location_lat,
+                    'longitude': courier.last_location_lng,
+                    'distance_km': round(distance, 3),
+                })
+            
+            return Response({'latitude': lat, 'longitude': lng, 'couriers': results})
+            
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class RouteGeometryView(APIView):
+    def get(self, request, route_id):
+        """Get a route's waypoints simplified for a map zoom level as an encoded polyline"""
+        try:
+            route = DeliveryRoute.objects.only('id', 'waypoints').filter(pk=route_id).first()
+            if route is None:
+                return Response({'error': 'Route not found'}, status=status.HTTP_404_NOT_FOUND)
+            
+            try:
+                zoom = int(request.GET.get('zoom', 12))
+            except ValueError:
+                return Response({'error': 'zoom must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+            
+            # Waypoints are append-only, so the point count identifies the geometry version
+            point_count = len(route.waypoints) + (
+                route.waypoint_blocks.aggregate(total=Sum('point_count'))['total'] or 0
+            )
+            tolerance = zoom_tolerance(zoom)
+            cache_key = f'dropa:route_geometry:{route.id}:{tolerance}:{point_count}'
+            
+            geometry = cache.get(cache_key)
+            if geometry is None:
+                simplified = simplify(route.waypoint_array, tolerance)
+                geometry = {
+                    'route_id': route.id,
+                    'zoom': zoom,
+                    'tolerance': tolerance,
+                    'point_count': point_count,
+                    'simplified_count': len(simplified),
+                    'polyline': encode_polyline(simplified),
+                }
+                cache.set(cache_key, geometry, getattr(settings, 'ROUTE_GEOMETRY_CACHE_TTL', 3600))
+            
+            return Response(geometry)
+            
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class CourierLocationIngestView(APIView):
+    def post(self, request):
+        """Queue a batch of courier location pings for buffered writing"""
+        try:
+            # Accept either a bare list or {"pings": [...]}
+            data = request.data
+            pings = data.get('pings') if isinstance(data, dict) else data
+            
+            if not isinstance(pings, list):
+                return Response({'error': 'pings must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+            
+            accepted = []
+            errors = []
+            now = timezone.now()
+            # A clock far ahead would otherwise pin the courier to that ping until it is reached
+            latest_allowed = now + timedelta(seconds=getattr(settings, 'LOCATION_MAX_CLOCK_SKEW_SECONDS', 120))
+            for index, ping in enumerate(pings):
+                try:
+                    lat = float(ping['lat'])
+                    lng = float(ping['lng'])
+                    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                        raise ValueError('coordinates out of range')
+                    
+                    recorded_at = now
+                    if ping.get('timestamp'):
+                        recorded_at = parse_datetime(ping['timestamp'])
+                        if recorded_at is None:
+                            raise ValueError('invalid timestamp')
+                        if timezone.is_naive(recorded_at):
+                            recorded_at = timezone.make_aware(recorded_at)
+                        if recorded_at > latest_allowed:
+                            raise ValueError('timestamp is in the future')
+                    
+                    package_id = ping.get('package_id')
+                    accepted.append(LocationPing(
+                        courier_id=int(ping['courier_id']),
+                        lat=lat,
+                        lng=lng,
+                        package_id=int(package_id) if package_id is not None else None,
+                        recorded_at=recorded_at,
+                    ))
+                except (KeyError, TypeError, ValueError) as e:
+                    errors.append({'index': index, 'error': str(e)})
+            
+            location_buffer.add(accepted)
+            
+            return Response(
+                {'accepted': len(accepted), 'rejected': len(errors), 'errors': errors},
+                status=status.HTTP_202_ACCEPTED
+            )
+            
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 class DashboardStatsView(APIView):
     def get(self, request):
         """Get dashboard statistics"""
+        counts = get_dashboard_counts()
         stats = {
-            'total_packages': Package.objects.count(),
-            'active_deliveries': Package.objects.filter(status='in_transit').count(),
-            'active_couriers': User.objects.filter(role='courier', is_active=True).count(),
-            'pending_packages': Package.objects.filter(status='pending').count(),
-            'delivered_today': Package.objects.filter(
-                status='delivered',
-                sign_time__date=timezone.now().date()
-            ).count(),
+            'total_packages': counts['total_packages'],
+            'active_deliveries': counts['in_transit'],
+            'active_couriers': counts['active_couriers'],
+            'pending_packages': counts['pending'],
+            'delivered_today': counts['delivered_today'],
+            'delivery_rate': counts['delivery_rate'],
         }
         
-        # Calculate delivery rate
-        total_delivered = Package.objects.filter(status='delivered').count()
-        total_packages = Package.objects.count()
-        stats['delivery_rate'] = (total_delivered / total_packages * 100) if total_packages > 0 else 0
-        
         return Response(stats)
 
 class DashboardDataView(APIView):
     def get(self, request):
         """Comprehensive dashboard data endpoint"""
         # Get basic stats
-        total_packages = Package.objects.count()
-        active_deliveries = Package.objects.filter(status='in_transit').count()
-        active_couriers = User.objects.filter(role='courier', is_active=True).count()
-        pending_packages = Package.objects.filter(status='pending').count()
-        delivered_today = Package.objects.filter(
-            status='delivered',
-            sign_time__date=timezone.now().date()
-        ).count()
-        
-        # Calculate delivery rate
-        total_delivered = Package.objects.filter(status='delivered').count()
-        delivery_rate = (total_delivered / total_packages * 100) if total_packages > 0 else 0
+        counts = get_dashboard_counts()
+        total_packages = counts['total_packages']
+        active_deliveries = counts['in_transit']
+        active_couriers = counts['active_couriers']
+        pending_packages = counts['pending']
+        delivered_today = counts['delivered_today']
+        delivery_rate = counts['delivery_rate']
         
         # Get recent packages
-        recent_packages = Package.objects.all().order_by('-receipt_time')[:5]
+        recent_packages = Package.objects.select_related('delivery_user').order_by('-receipt_time')[:5]
         packages_data = []
         for package in recent_packages:
             packages_data.append({
@@ -325,8 +558,8 @@ class DashboardDataView(APIView):
             })
         
         # Get top couriers
-        top_couriers = User.objects.filter(role='courier').annotate(
-            delivery_count=Count('deliveries')
+        top_couriers = annotate_courier_stats(
+            User.objects.filter(role='courier')
         ).order_by('-delivery_count')[:3]
         
         couriers_data = []
@@ -379,11 +612,6 @@ class DeliveryInsightsView(APIView):
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class CourierStatsView(APIView):
-    def get(self, request):
-        # Return courier stats
-        return Response({'stats': 'Courier stats'}, status=status.HTTP_200_OK)
-
 class DashboardView(APIView):
     def get(self, request):
         # Return dashboard data
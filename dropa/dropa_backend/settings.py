@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -128,3 +129,47 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# ML models
+# Models load lazily on first use. Set DROPA_ML_WARMUP=1 for web workers to load
+# them in the background at startup instead of on the first prediction request.
+
+ML_WARMUP_ON_READY = os.environ.get('DROPA_ML_WARMUP') == '1'
+
+# Dashboard counters are cached for this many seconds (per process with the default cache)
+
+DASHBOARD_STATS_TTL = 15
+
+# Nearest-courier index
+# Grid cell size in degrees (~5.5 km) and how often the in-process index is rebuilt from the database
+
+COURIER_INDEX_CELL_DEGREES = 0.05
+COURIER_INDEX_REFRESH_SECONDS = 60
+
+# Courier location ingestion
+# Buffered pings are written every LOCATION_FLUSH_INTERVAL_MS or as soon as LOCATION_FLUSH_MAX_ROWS are waiting
+
+LOCATION_FLUSH_INTERVAL_MS = 500
+LOCATION_FLUSH_MAX_ROWS = 1000
+# Pings timestamped further than this ahead of the server clock are rejected
+LOCATION_MAX_CLOCK_SKEW_SECONDS = 120
+
+# Route geometry
+# Simplified polylines are cached per route, zoom level and point count
+
+ROUTE_GEOMETRY_CACHE_TTL = 3600
+
+# ML model hot reload
+# Web workers poll the published model version this often (seconds) and swap in a new model set
+# without restarting. Set DROPA_ML_WATCH_SECONDS to enable; 0 leaves models pinned until restart.
+
+ML_MODEL_WATCH_SECONDS = float(os.environ.get('DROPA_ML_WATCH_SECONDS', '0'))
+
+# ML micro-batching
+# Concurrent single-row predictions in one worker are scored together: a batch closes after
+# ML_BATCH_WINDOW_MS or at ML_BATCH_MAX_SIZE rows. Only helps workers that serve requests on
+# several threads (e.g. gunicorn --threads); set DROPA_ML_MICRO_BATCH=1 to enable.
+
+ML_MICRO_BATCHING = os.environ.get('DROPA_ML_MICRO_BATCH') == '1'
+ML_BATCH_WINDOW_MS = float(os.environ.get('DROPA_ML_BATCH_WINDOW_MS', '2'))
+ML_BATCH_MAX_SIZE = int(os.environ.get('DROPA_ML_BATCH_MAX_SIZE', '64'))